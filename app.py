@@ -1,18 +1,28 @@
 import os
+import time
 import asyncio
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response,
+                   stream_with_context, send_file)
 from werkzeug.security import generate_password_hash, check_password_hash
 from telethon.errors import PhoneCodeInvalidError, SessionPasswordNeededError
 from database import db
+from storage import DEFAULT_PAGE_SIZE, SEARCH_MAX_DEPTH, clamp_page_size, decode_cursor
 from telegram_monitor import monitor
+from detection import categories_from_mask
+from exports import EXPORT_FORMATS, PARQUET_AVAILABLE, export_watermark, iter_csv, parse_export_fields
+from bulk_export import start_bulk_export, load_job, artifact_path
+from retention import remove_archived_results
+from image_index import KnownImageIndex
 from async_helper import telegram_helper
 from simple_auth import simple_auth
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import glob
 import tempfile
 import re
+import unicodedata
+from urllib.parse import quote
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
@@ -22,6 +32,17 @@ app.config['SESSION_COOKIE_SECURE'] = os.getenv('FLASK_ENV') == 'production'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
 
+# Perceptual hashes of reviewed advertisement images; matching uploads skip OCR
+known_images = KnownImageIndex(db)
+# Users allowed to add images to the known-advertisement index (comma-separated)
+KNOWN_IMAGE_REVIEWERS = {name.strip() for name in os.getenv('KNOWN_IMAGE_REVIEWERS', '').split(',') if name.strip()}
+
+# Batch /analyze_text limits
+ANALYZE_BATCH_SIZE = int(os.getenv('ANALYZE_BATCH_SIZE', '200'))
+ANALYZE_MAX_ITEMS = int(os.getenv('ANALYZE_MAX_ITEMS', '5000'))
+ANALYZE_MAX_TEXT_CHARS = int(os.getenv('ANALYZE_MAX_TEXT_CHARS', '10000'))
+ANALYZE_MAX_BODY_BYTES = int(os.getenv('ANALYZE_MAX_BODY_BYTES', str(8 * 1024 * 1024)))
+
 def format_indian_phone_number(phone_number):
     """Format phone number to ensure it has +91 prefix for Indian numbers"""
     if not phone_number:
@@ -57,6 +78,63 @@ def format_indian_phone_number(phone_number):
     
     return phone_number  # Return original if we can't determine format
 
+def parse_result_filters(args):
+    """Parse result filter query parameters (prediction, min confidence, date range).
+    Dates are YYYY-MM-DD; date_to is inclusive. Raises ValueError on bad input."""
+    filters = {}
+    prediction = args.get('prediction', '').strip()
+    if prediction and prediction != 'all':
+        filters['prediction'] = prediction
+    
+    min_confidence = args.get('min_confidence', '').strip()
+    if min_confidence:
+        value = float(min_confidence)
+        # Accept both 0-1 and percentage values
+        filters['min_confidence'] = value / 100.0 if value > 1 else value
+    
+    date_from = args.get('date_from', '').strip()
+    if date_from:
+        filters['date_from'] = datetime.strptime(date_from, '%Y-%m-%d')
+    
+    date_to = args.get('date_to', '').strip()
+    if date_to:
+        filters['date_to'] = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+    
+    return filters
+
+@app.template_filter('categories')
+def result_categories(result):
+    """Keyword categories matched by a result, read from its stored features"""
+    features = result.get('features') or {}
+    return [name.replace('_', ' ') for name in categories_from_mask(features.get('category_mask', 0))]
+
+def serialize_doc(doc):
+    """Make a MongoDB document JSON serializable"""
+    serialized = {}
+    for key, value in doc.items():
+        if isinstance(value, ObjectId):
+            serialized[key] = str(value)
+        elif isinstance(value, datetime):
+            serialized[key] = value.isoformat()
+        elif isinstance(value, bytes):
+            continue
+        else:
+            serialized[key] = value
+    return serialized
+
+def streamed_download(chunks, download_name, mimetype):
+    """Attachment response that sends chunks as they are produced"""
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    try:
+        download_name.encode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    except UnicodeEncodeError:
+        # ASCII fallback plus the RFC 5987 UTF-8 name, as send_file does
+        fallback = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        response.headers.set('Content-Disposition', 'attachment', filename=fallback,
+                             **{'filename*': "UTF-8''" + quote(download_name, safe="!#$&+^`|~")})
+    return response
+
 @app.route('/')
 def index():
     if 'username' in session:
@@ -137,11 +215,8 @@ def logout():
         print(f"DEBUG: Logging out user {username}")
         
         # Reset telegram_linked status in database
-        result = db.users.update_one(
-            {"username": username},
-            {"$set": {"telegram_linked": False, "phone_number": None}}
-        )
-        print(f"DEBUG: Database update result: {result.modified_count} documents modified")
+        modified = db.clear_telegram_link(username)
+        print(f"DEBUG: Database update result: {modified} documents modified")
         
         # Clean up session files with absolute paths
         current_dir = os.getcwd()
@@ -203,14 +278,16 @@ def dashboard():
     print(f"DEBUG: User {username} is telegram linked, loading dashboard")
     
     channels = db.get_user_channels(username)
-    alerts = db.get_alerts(username)
+    alerts = db.get_alerts(username, limit=5)
+    alert_count = db.count_alerts(username)
     
-    # Add suspicious count to each channel
+    # Add suspicious count to each channel (one rollup read for all of them)
+    stats = db.get_channel_stats([str(channel['_id']) for channel in channels])
     for channel in channels:
-        suspicious_results = db.get_monitoring_results(str(channel['_id']))
-        channel['suspicious_count'] = sum(1 for r in suspicious_results if r.get('prediction') == 'drug sale')
+        channel['suspicious_count'] = stats[str(channel['_id'])]['predictions'].get('drug sale', 0)
     
-    return render_template('dashboard.html', user=user, channels=channels, alerts=alerts)
+    return render_template('dashboard.html', user=user, channels=channels, alerts=alerts,
+                           alert_count=alert_count)
 
 @app.route('/link_telegram', methods=['GET', 'POST'])
 def link_telegram():
@@ -335,7 +412,7 @@ def monitor_channel_route(channel_id):
             return jsonify({'success': False, 'message': 'Please link your Telegram account first'})
         
         # Get channel info
-        channel = db.channels.find_one({'_id': ObjectId(channel_id), 'username': username})
+        channel = db.get_channel(channel_id, username)
         if not channel:
             return jsonify({'success': False, 'message': 'Channel not found'})
         
@@ -376,31 +453,83 @@ def view_results(channel_id):
     user = db.get_user_by_username(username)
     
     # Get channel info
-    channel = db.channels.find_one({'_id': ObjectId(channel_id), 'username': username})
+    channel = db.get_channel(channel_id, username)
     if not channel:
         flash('Channel not found!', 'error')
         return redirect(url_for('dashboard'))
     
-    # Get monitoring results
-    results = db.get_monitoring_results(channel_id)
+    try:
+        filters = parse_result_filters(request.args)
+        results, next_cursor = db.get_monitoring_results_page(
+            channel_id,
+            cursor=request.args.get('cursor'),
+            limit=DEFAULT_PAGE_SIZE,
+            **filters
+        )
+    except ValueError as e:
+        flash(f'Invalid filter: {str(e)}', 'error')
+        return redirect(url_for('view_results', channel_id=channel_id))
+    
+    # Statistics over the whole channel (from the hourly rollups), not just this page
+    stats = db.get_channel_stats([channel_id])[channel_id]
+    total_count = stats['total']
+    suspicious_count = stats['predictions'].get('drug sale', 0)
+    normal_count = stats['predictions'].get('normal', 0)
+    spam_count = stats['predictions'].get('spam', 0)
+    other_count = stats['predictions'].get('other', 0)
     
-    # Calculate statistics
-    suspicious_count = sum(1 for r in results if r.get('prediction') == 'drug sale')
-    normal_count = sum(1 for r in results if r.get('prediction') == 'normal')
-    spam_count = sum(1 for r in results if r.get('prediction') == 'spam')
-    other_count = sum(1 for r in results if r.get('prediction') == 'other')
+    # Carry the active filters over to the "next page" link
+    filter_args = {key: request.args.get(key) for key in ('prediction', 'min_confidence', 'date_from', 'date_to')
+                   if request.args.get(key)}
     
     return render_template('results.html', 
                          user=user,
                          channel=channel, 
                          results=results,
+                         next_cursor=next_cursor,
+                         filter_args=filter_args,
+                         total_count=total_count,
                          suspicious_count=suspicious_count,
                          normal_count=normal_count,
                          spam_count=spam_count,
-                         other_count=other_count)
+                         other_count=other_count,
+                         parquet_available=PARQUET_AVAILABLE)
 
-@app.route('/export_csv/<channel_id>')
-def export_csv(channel_id):
+@app.route('/api/results/<channel_id>')
+def api_results(channel_id):
+    """JSON variant of view_results for incremental loading"""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    
+    username = session['username']
+    
+    try:
+        channel = db.get_channel(channel_id, username)
+        if not channel:
+            return jsonify({'success': False, 'message': 'Channel not found'}), 404
+        
+        filters = parse_result_filters(request.args)
+        results, next_cursor = db.get_monitoring_results_page(
+            channel_id,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', type=int),
+            **filters
+        )
+        
+        return jsonify({
+            'success': True,
+            'results': [serialize_doc(r) for r in results],
+            'next_cursor': next_cursor
+        })
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/export_csv/<channel_id>', defaults={'export_format': 'csv'})
+@app.route('/export/<channel_id>/<export_format>')
+def export_results(channel_id, export_format):
     if 'username' not in session:
         return redirect(url_for('login'))
     
@@ -408,48 +537,146 @@ def export_csv(channel_id):
     
     try:
         # Verify channel ownership
-        channel = db.channels.find_one({'_id': ObjectId(channel_id), 'username': username})
+        channel = db.get_channel(channel_id, username)
         if not channel:
             flash('Channel not found!', 'error')
             return redirect(url_for('dashboard'))
         
-        # Check if there are results to export
-        results = db.get_monitoring_results(channel_id)
-        if not results:
-            flash('No monitoring results found for this channel. Please monitor the channel first.', 'warning')
+        if export_format != 'csv' and export_format not in EXPORT_FORMATS:
+            flash(f'Unknown export format: {export_format}', 'error')
+            return redirect(url_for('view_results', channel_id=channel_id))
+        if export_format == 'parquet' and not PARQUET_AVAILABLE:
+            flash('Parquet export is not available on this server (pyarrow is not installed).', 'error')
             return redirect(url_for('view_results', channel_id=channel_id))
         
-        # Export results using the main monitor
-        from telegram_monitor import monitor
-        import tempfile
-        import os
-        
-        # Create temporary file for export
-        temp_dir = tempfile.gettempdir()
-        safe_channel_name = channel.get('channel_name', 'unknown').replace('/', '_').replace('\\', '_')
-        temp_filename = os.path.join(temp_dir, f"trinetra_export_{safe_channel_name}_{channel_id}.csv")
-        
-        # Export to temporary file
-        filename = monitor.export_results_to_csv(channel_id, temp_filename)
+        # Delta export: only results added or changed after the since watermark
+        since = decode_cursor(request.args['since']) if request.args.get('since') else None
+        until, next_watermark = export_watermark()
         
-        if not os.path.exists(filename):
-            flash('Error creating export file. Please try again.', 'error')
+        # Check if there are results to export (rollups also count archived results)
+        total = db.get_channel_stats([channel_id])[channel_id]["total"]
+        if not since and not total and not db.get_monitoring_results(channel_id, limit=1):
+            flash('No monitoring results found for this channel. Please monitor the channel first.', 'warning')
             return redirect(url_for('view_results', channel_id=channel_id))
         
         # Generate download filename with channel name and timestamp
-        from datetime import datetime
+        safe_channel_name = channel.get('channel_name', 'unknown').replace('/', '_').replace('\\', '_')
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        download_name = f"trinetra_{safe_channel_name}_{timestamp}.csv"
+        base_name = f"trinetra_{safe_channel_name}_{'delta_' if since else ''}{timestamp}"
+        delta = {'since': since, 'until': until} if since else {}
         
-        print(f"📊 Exporting {len(results)} results for channel {safe_channel_name}")
+        if since:
+            print(f"📊 Streaming {export_format} delta export for channel {safe_channel_name}")
+        else:
+            print(f"📊 Streaming {export_format} export of ~{total} results for channel {safe_channel_name}")
+        
+        # Rows are written to the client as they are read; nothing is staged on disk
+        if export_format == 'csv':
+            chunks = (chunk.encode('utf-8') for chunk in iter_csv(db, channel_id, **delta))
+            response = streamed_download(chunks, f"{base_name}.csv", 'text/csv')
+        else:
+            stream, extension, mimetype = EXPORT_FORMATS[export_format]
+            fields = parse_export_fields(request.args.get('fields'))
+            response = streamed_download(stream(db, channel_id, fields, **delta), f"{base_name}.{extension}", mimetype)
         
-        return send_file(filename, as_attachment=True, download_name=download_name)
+        # Pass back as ?since= to get only what changes after this export
+        response.headers['X-Export-Watermark'] = next_watermark
+        return response
         
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('view_results', channel_id=channel_id))
     except Exception as e:
-        print(f"Error exporting CSV: {str(e)}")
+        print(f"Error exporting {export_format}: {str(e)}")
         flash('An error occurred while exporting the data. Please try again.', 'error')
         return redirect(url_for('view_results', channel_id=channel_id))
 
+def bulk_job_response(state):
+    """Job state as returned by the bulk export API"""
+    job = {key: state[key] for key in ('job_id', 'status', 'format', 'channel_ids', 'date_from', 'date_to',
+                                       'channels_total', 'channels_done', 'rows', 'size_bytes', 'error')}
+    job['status_url'] = url_for('bulk_export_status', job_id=state['job_id'])
+    if state['status'] == 'done':
+        job['download_url'] = url_for('bulk_export_download', job_id=state['job_id'])
+    return jsonify({'success': True, 'job': job}), (200 if state['status'] in ('done', 'failed') else 202)
+
+def load_user_bulk_job(job_id):
+    """The session user's bulk export job, or None"""
+    if not re.fullmatch(r'[0-9a-f]{16}', job_id):
+        return None
+    state = load_job(job_id)
+    if not state or state['username'] != session['username']:
+        return None
+    return state
+
+@app.route('/api/exports', methods=['POST'])
+def bulk_export():
+    """Start a ZIP export of several channels (one file per channel plus
+    summary.csv). JSON body: channel_ids, optional date_from/date_to
+    (YYYY-MM-DD, inclusive) and format (csv, ndjson or parquet). Identical
+    requests reuse the finished ZIP until new results arrive."""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    
+    body = request.get_json(silent=True) or {}
+    channel_ids = body.get('channel_ids')
+    if not isinstance(channel_ids, list) or not channel_ids:
+        return jsonify({'success': False, 'message': 'channel_ids must be a non-empty list'}), 400
+    
+    export_format = body.get('format', 'csv')
+    if not isinstance(export_format, str):
+        return jsonify({'success': False, 'message': 'format must be a string'}), 400
+    for field in ('date_from', 'date_to'):
+        if not isinstance(body.get(field) or '', str):
+            return jsonify({'success': False, 'message': f'{field} must be a YYYY-MM-DD string'}), 400
+    if export_format == 'parquet' and not PARQUET_AVAILABLE:
+        return jsonify({'success': False, 'message': 'Parquet export needs pyarrow on the server'}), 400
+    
+    try:
+        owned = {str(c['_id']): c for c in db.get_user_channels(session['username'])}
+        missing = [cid for cid in channel_ids if str(cid) not in owned]
+        if missing:
+            return jsonify({'success': False, 'message': f'Channel not found: {missing[0]}'}), 404
+        
+        filters = parse_result_filters({'date_from': body.get('date_from') or '', 'date_to': body.get('date_to') or ''})
+        channels = [owned[cid] for cid in dict.fromkeys(str(cid) for cid in channel_ids)]
+        state = start_bulk_export(db, session['username'], channels, filters.get('date_from'),
+                                  filters.get('date_to'), export_format)
+        return bulk_job_response(state)
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/exports/<job_id>')
+def bulk_export_status(job_id):
+    """Progress of a bulk export job"""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    
+    state = load_user_bulk_job(job_id)
+    if not state:
+        return jsonify({'success': False, 'message': 'Export not found'}), 404
+    return bulk_job_response(state)
+
+@app.route('/exports/<job_id>/download')
+def bulk_export_download(job_id):
+    """Finished bulk export ZIP"""
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    state = load_user_bulk_job(job_id)
+    if not state:
+        return jsonify({'success': False, 'message': 'Export not found'}), 404
+    if state['status'] != 'done':
+        return jsonify({'success': False, 'message': f"Export is {state['status']}"}), 409
+    
+    # send_file streams the artifact from disk in blocks
+    timestamp = datetime.fromtimestamp(state['updated_at']).strftime('%Y%m%d_%H%M%S')
+    return send_file(os.path.abspath(artifact_path(job_id)), mimetype='application/zip', as_attachment=True,
+                     download_name=f"trinetra_bulk_{job_id}_{timestamp}.zip")
+
 @app.route('/remove_channel/<channel_id>', methods=['DELETE'])
 def remove_channel(channel_id):
     if 'username' not in session:
@@ -458,14 +685,9 @@ def remove_channel(channel_id):
     username = session['username']
     
     try:
-        # Remove channel and its data
-        result = db.channels.delete_one({'_id': ObjectId(channel_id), 'username': username})
-        
-        if result.deleted_count > 0:
-            # Also remove monitoring results and alerts
-            db.monitoring_results.delete_many({'channel_id': channel_id})
-            db.alerts.delete_many({'channel_id': channel_id})
-            
+        # Remove channel together with its monitoring results, alerts and archive
+        if db.remove_channel(channel_id, username):
+            remove_archived_results(channel_id)
             return jsonify({'success': True, 'message': 'Channel removed successfully'})
         else:
             return jsonify({'success': False, 'message': 'Channel not found'})
@@ -480,9 +702,142 @@ def view_alerts():
     
     username = session['username']
     user = db.get_user_by_username(username)
-    alerts = db.get_alerts(username)
     
-    return render_template('alerts.html', user=user, alerts=alerts)
+    status = request.args.get('status', 'new')
+    try:
+        alerts, next_cursor = db.get_alerts_page(
+            username,
+            status=None if status == 'all' else status,
+            cursor=request.args.get('cursor'),
+            limit=DEFAULT_PAGE_SIZE
+        )
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('view_alerts'))
+    
+    summary = db.get_alert_summary(username)
+    
+    return render_template('alerts.html', user=user, alerts=alerts, next_cursor=next_cursor,
+                           status=status, summary=summary)
+
+@app.route('/api/alerts')
+def api_alerts():
+    """JSON variant of view_alerts for incremental loading"""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    
+    status = request.args.get('status', 'new')
+    
+    try:
+        alerts, next_cursor = db.get_alerts_page(
+            session['username'],
+            status=None if status == 'all' else status,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', type=int)
+        )
+        
+        return jsonify({
+            'success': True,
+            'alerts': [serialize_doc(a) for a in alerts],
+            'next_cursor': next_cursor
+        })
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/stats')
+def api_stats():
+    """Channel statistics from the hourly rollups, for trend charts.
+    Optional channel_id (default: all of the user's channels), date_from,
+    date_to and bucket (hour or day)."""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in ('hour', 'day'):
+        return jsonify({'success': False, 'message': 'bucket must be hour or day'}), 400
+    
+    try:
+        channel_ids = [str(c['_id']) for c in db.get_user_channels(session['username'])]
+        channel_id = request.args.get('channel_id')
+        if channel_id:
+            if channel_id not in channel_ids:
+                return jsonify({'success': False, 'message': 'Channel not found'}), 404
+            channel_ids = [channel_id]
+        
+        filters = parse_result_filters(request.args)
+        start, end = filters.get('date_from'), filters.get('date_to')
+        per_channel = db.get_channel_stats(channel_ids, start, end)
+        series = db.get_stats_series(channel_ids, start, end, bucket)
+        
+        # Term counters are keyed by term id; show the terms themselves
+        terms_by_id = monitor.engine.terms_by_id
+        def named_terms(summary):
+            summary['terms'] = {terms_by_id.get(int(tid), tid): count
+                                for tid, count in summary['terms'].items() if count}
+            return summary
+        
+        return jsonify({
+            'success': True,
+            'bucket': bucket,
+            'channels': {cid: named_terms(s) for cid, s in per_channel.items()},
+            'series': [serialize_doc(named_terms(point)) for point in series]
+        })
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/search')
+def api_search():
+    """Full-text search over messages from all of the user's channels.
+    q: words and "quoted phrases" (all must match); optional channel_id,
+    prediction, min_confidence, date_from, date_to, page and limit."""
+    if 'username' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'}), 401
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'message': 'Provide a search query'}), 400
+    
+    try:
+        channels = db.get_user_channels(session['username'])
+        channel_names = {str(c['_id']): c.get('channel_name') for c in channels}
+        
+        channel_id = request.args.get('channel_id')
+        if channel_id and channel_id not in channel_names:
+            return jsonify({'success': False, 'message': 'Channel not found'}), 404
+        channel_ids = [channel_id] if channel_id else list(channel_names)
+        
+        filters = parse_result_filters(request.args)
+        limit = clamp_page_size(request.args.get('limit', type=int))
+        page = max(1, request.args.get('page', 1, type=int))
+        
+        started = time.perf_counter()
+        results, has_more = db.search_results(
+            query, channel_ids, offset=(page - 1) * limit, limit=limit, **filters
+        )
+        took_ms = (time.perf_counter() - started) * 1000
+        
+        for result in results:
+            result['channel_name'] = channel_names.get(result['channel_id'])
+        
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': [serialize_doc(r) for r in results],
+            'page': page,
+            'next_page': page + 1 if has_more and page * limit < SEARCH_MAX_DEPTH else None,
+            'took_ms': round(took_ms, 1)
+        })
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/dismiss_alert/<alert_id>', methods=['POST'])
 def dismiss_alert(alert_id):
@@ -490,10 +845,7 @@ def dismiss_alert(alert_id):
         return jsonify({'success': False, 'message': 'Not authenticated'})
     
     try:
-        db.alerts.update_one(
-            {'_id': ObjectId(alert_id)},
-            {'$set': {'status': 'dismissed', 'dismissed_at': datetime.utcnow()}}
-        )
+        db.dismiss_alert(alert_id)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -623,18 +975,30 @@ def check_existing_session():
         return jsonify({'success': False, 'message': str(e)})
 
 # Health check endpoint for Render
+def health_cache_stats():
+    from ocr import ocr_cache
+    caches = {'users': db.user_cache.stats()}
+    if ocr_cache is not None:
+        caches['ocr'] = ocr_cache.stats()
+    return caches
+
 @app.route('/health')
 def health_check():
     """Health check endpoint for cloud deployment monitoring"""
+    from ocr import ocr_pool, tesseract_status
     try:
         # Check database connection
-        db.users.find_one()
+        db.ping()
         
         return jsonify({
             'status': 'healthy',
             'timestamp': datetime.utcnow().isoformat(),
             'service': 'Trinetra',
-            'version': '1.0.0'
+            'version': '1.0.0',
+            'storage': db.name,
+            'caches': health_cache_stats(),
+            'ocr_pool': ocr_pool.stats(),
+            'ocr_engine': tesseract_status()
         }), 200
     except Exception as e:
         return jsonify({
@@ -652,32 +1016,87 @@ def not_found(error):
 def internal_error(error):
     return render_template('error.html', error="Internal server error"), 500
 
+def analysis_item(raw):
+	"""(id, text) from a batch item: a string or an {"id", "text"} object"""
+	item_id = None
+	if isinstance(raw, dict):
+		item_id, raw = raw.get('id'), raw.get('text')
+	if not isinstance(raw, str) or not raw.strip():
+		raise ValueError('Provide non-empty text')
+	if len(raw) > ANALYZE_MAX_TEXT_CHARS:
+		raise ValueError(f'Text longer than {ANALYZE_MAX_TEXT_CHARS} characters')
+	return item_id, raw
+
+def stream_batch_analysis(items, parse_item):
+	"""NDJSON lines for each item, analyzed ANALYZE_BATCH_SIZE at a time, then a summary line"""
+	errors = 0
+	for start in range(0, len(items), ANALYZE_BATCH_SIZE):
+		records, texts, pending = [], [], []
+		for index, raw in enumerate(items[start:start + ANALYZE_BATCH_SIZE], start):
+			record = {'index': index}
+			try:
+				item_id, text = analysis_item(parse_item(raw))
+				if item_id is not None:
+					record['id'] = item_id
+				texts.append(text)
+				pending.append(record)
+			except ValueError as e:
+				record.update(success=False, message=str(e))
+				errors += 1
+			records.append(record)
+		for record, analysis in zip(pending, monitor.engine.analyze_batch(texts)):
+			record.update(success=True, analysis=analysis)
+		yield ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+	yield json.dumps({'done': True, 'count': len(items), 'errors': errors}) + '\n'
+
+def parse_ndjson_line(line):
+	try:
+		return json.loads(line)
+	except ValueError:
+		raise ValueError('Invalid JSON line')
+
 # Lightweight NLP test endpoint
 @app.route('/analyze_text', methods=['POST'])
 def analyze_text():
+	"""Analyze {"text": ...} and return one JSON result, or analyze a batch:
+	a JSON array or an NDJSON body (application/x-ndjson) of strings or
+	{"id", "text"} objects. Batches are answered as an NDJSON stream, one line
+	per item in request order as each batch is scored, then a summary line."""
 	if request.method != 'POST':
 		return jsonify({'success': False, 'message': 'Invalid method'}), 405
 	try:
-		data = request.get_json(silent=True) or {}
-		text = data.get('text', '')
-		if not isinstance(text, str) or not text.strip():
-			return jsonify({'success': False, 'message': 'Provide non-empty text'}), 400
-
-		# Run the async analyze_message
-		loop = asyncio.new_event_loop()
-		asyncio.set_event_loop(loop)
-		try:
-			analysis = loop.run_until_complete(monitor.analyze_message(text))
-		finally:
-			loop.close()
+		body = request.stream.read(ANALYZE_MAX_BODY_BYTES + 1)
+		if len(body) > ANALYZE_MAX_BODY_BYTES:
+			return jsonify({'success': False, 'message': f'Request body over {ANALYZE_MAX_BODY_BYTES} bytes'}), 413
+
+		if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+			items, parse_item = [line for line in body.splitlines() if line.strip()], parse_ndjson_line
+		else:
+			try:
+				data = json.loads(body) if body.strip() else {}
+			except ValueError:
+				return jsonify({'success': False, 'message': 'Invalid JSON'}), 400
+			if not isinstance(data, list):
+				text = data.get('text', '') if isinstance(data, dict) else ''
+				if not isinstance(text, str) or not text.strip():
+					return jsonify({'success': False, 'message': 'Provide non-empty text'}), 400
+				return jsonify({'success': True, 'analysis': monitor.engine.analyze(text)}), 200
+			items, parse_item = data, (lambda item: item)
 
-		return jsonify({'success': True, 'analysis': analysis}), 200
+		if len(items) > ANALYZE_MAX_ITEMS:
+			return jsonify({'success': False, 'message': f'At most {ANALYZE_MAX_ITEMS} items per request'}), 413
+		return Response(stream_with_context(stream_batch_analysis(items, parse_item)), mimetype='application/x-ndjson')
 	except Exception as e:
 		return jsonify({'success': False, 'message': str(e)}), 500
 
 # Image analysis endpoint (multipart/form-data)
 @app.route('/analyze_image', methods=['POST'])
 def analyze_image():
+	"""Decode the upload once, OCR it in the background while the caption and
+	the image itself are analyzed, and report per-stage timings_ms. Images
+	matching a known advertisement (by perceptual hash) skip OCR; images whose
+	OCR text is flagged but match none are reported as known_image_candidate
+	for a reviewer to add through /api/known_images."""
 	try:
 		if 'file' not in request.files:
 			return jsonify({'success': False, 'message': 'No file uploaded'}), 400
@@ -686,33 +1105,113 @@ def analyze_image():
 		if not image_bytes:
 			return jsonify({'success': False, 'message': 'Empty file'}), 400
 
-		from image_analysis import analyze_image_bytes
-		image_info = analyze_image_bytes(image_bytes)
+		from image_analysis import (ANALYSIS_MAX_SIZE, ImageTooLargeError, load_image, perceptual_hashes,
+									sha256_hex, analyze_image as analyze_decoded_image)
+		from concurrent.futures import TimeoutError as FutureTimeoutError
+		from ocr import OCR_TIMEOUT_SECONDS, OCRQueueFullError, submit_ocr
+		timings = {}
+		started = time.perf_counter()
 
-		# Optional caption analysis with existing NLP hybrid
-		caption = request.form.get('caption', '')
-		caption_analysis = None
-		if caption and caption.strip():
-			loop = asyncio.new_event_loop()
-			asyncio.set_event_loop(loop)
-			try:
-				caption_analysis = loop.run_until_complete(monitor.analyze_message(caption))
-			finally:
-				loop.close()
+		def lap(stage, since):
+			now = time.perf_counter()
+			timings[stage] = round((now - since) * 1000, 1)
+			return now
+
+		try:
+			image = load_image(image_bytes, ANALYSIS_MAX_SIZE)
+		except ImageTooLargeError as e:
+			return jsonify({'success': False, 'message': str(e)}), 413
+		except Exception as e:
+			return jsonify({'success': False, 'message': f'Could not decode image: {e}'}), 400
+		with image:
+			mark = lap('decode', started)
+			hashes = perceptual_hashes(image)
+			known_matches = known_images.lookup(hashes)
+			mark = lap('known_image_lookup', mark)
+			ocr_future = None
+			if not known_matches:
+				# The job gets its own copy: a timed-out job keeps running after this
+				# request closes image, so it closes the copy itself once done
+				ocr_image = image.copy()
+				try:
+					ocr_future = submit_ocr(ocr_image, sha256=sha256_hex(image_bytes))
+				except OCRQueueFullError as e:
+					ocr_image.close()
+					response = jsonify({'success': False, 'message': f'{e}, try again shortly'})
+					response.headers['Retry-After'] = '5'
+					return response, 503
+				ocr_future.add_done_callback(lambda _: ocr_image.close())
+
+			# Optional caption analysis with existing NLP hybrid
+			caption = request.form.get('caption', '')
+			caption_analysis = None
+			if caption and caption.strip():
+				caption_analysis = monitor.engine.analyze(caption)
+				mark = lap('caption_analysis', mark)
 
-		# OCR on image and analyze extracted text
-		from ocr import extract_text_from_image_bytes
-		ocr_result = extract_text_from_image_bytes(image_bytes)
+			image_info = analyze_decoded_image(image, image_bytes, hashes=hashes)
+			mark = lap('image_analysis', mark)
+
+			# OCR on image and analyze extracted text
+			if ocr_future is not None:
+				try:
+					# Jobs end within OCR_TIMEOUT_SECONDS of submission; the grace covers scheduling
+					ocr_result = ocr_future.result(timeout=OCR_TIMEOUT_SECONDS + 2)
+				except FutureTimeoutError:
+					ocr_future.cancel()
+					ocr_result = {'ok': False, 'text': '', 'error': 'OCR timed out'}
+				timings['ocr_queue'] = ocr_result.get('queue_wait_ms')
+				timings['ocr'] = ocr_result.get('elapsed_ms')
+				mark = lap('ocr_wait', mark)
+			else:
+				ocr_result = {'ok': False, 'text': '', 'error': None, 'skipped': 'known_image'}
 		ocr_analysis = None
 		if ocr_result.get('ok') and ocr_result.get('text'):
-			loop2 = asyncio.new_event_loop()
-			asyncio.set_event_loop(loop2)
-			try:
-				ocr_analysis = loop2.run_until_complete(monitor.analyze_message(ocr_result['text']))
-			finally:
-				loop2.close()
+			ocr_analysis = monitor.engine.analyze(ocr_result['text'])
+			mark = lap('ocr_analysis', mark)
+
+		# Only what the image itself says counts; captions are free text from the uploader
+		known_image_candidate = bool(ocr_analysis and ocr_analysis['prediction'] == 'drug sale'
+									 and not known_matches and image_info['ok'])
+		lap('total', started)
+
+		return jsonify({'success': True, 'image': image_info, 'caption_analysis': caption_analysis, 'ocr': ocr_result, 'ocr_analysis': ocr_analysis,
+						'known_image_matches': known_matches, 'known_image_candidate': known_image_candidate, 'timings_ms': timings}), 200
+	except Exception as e:
+		return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/known_images', methods=['POST'])
+def add_known_image():
+	"""Add a reviewed advertisement image to the known-image index
+	(multipart/form-data: file, optional label). Only logged-in users listed in
+	KNOWN_IMAGE_REVIEWERS may add images; the reviewer is recorded with it."""
+	if 'username' not in session:
+		return jsonify({'success': False, 'message': 'Login required'}), 401
+	username = session['username']
+	if username not in KNOWN_IMAGE_REVIEWERS:
+		return jsonify({'success': False, 'message': 'Not allowed to add known images'}), 403
+	try:
+		file = request.files.get('file')
+		image_bytes = file.read() if file else b''
+		if not image_bytes:
+			return jsonify({'success': False, 'message': 'No file uploaded'}), 400
+		label = (request.form.get('label') or 'drug sale').strip()
+
+		from image_analysis import ANALYSIS_MAX_SIZE, ImageTooLargeError, load_image, analyze_image as analyze_decoded_image
+		try:
+			image = load_image(image_bytes, ANALYSIS_MAX_SIZE)
+		except ImageTooLargeError as e:
+			return jsonify({'success': False, 'message': str(e)}), 413
+		except Exception as e:
+			return jsonify({'success': False, 'message': f'Could not decode image: {e}'}), 400
+		with image:
+			image_info = analyze_decoded_image(image, image_bytes)
+		if not image_info['ok']:
+			return jsonify({'success': False, 'message': image_info.get('error') or 'Image analysis failed'}), 400
 
-		return jsonify({'success': True, 'image': image_info, 'caption_analysis': caption_analysis, 'ocr': ocr_result, 'ocr_analysis': ocr_analysis}), 200
+		added = known_images.add(image_info, label, source='review', username=username)
+		return jsonify({'success': True, 'added': added, 'sha256': image_info['sha256'],
+						'phash': image_info['phash']}), (201 if added else 200)
 	except Exception as e:
 		return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -199,8 +199,8 @@ class AsyncTelegramHelper:
         """Verify OTP with phone_code_hash"""
         try:
             # Get user data for API credentials
-            from database import db
-            user = db.get_user_by_username(username)
+            from database import async_db
+            user = await async_db.get_user_by_username(username)
             if not user:
                 return False, "User not found"
             
@@ -294,6 +294,7 @@ class AsyncTelegramHelper:
     async def monitor_real_channel(self, api_id, api_hash, channel_link, channel_id):
         """Monitor real channel using authenticated session"""
         from real_monitor_v2 import real_monitor_v2
+        from database import async_db
         
         # Use the authenticated session
         session_name = 'authenticated_session'
@@ -319,6 +320,7 @@ class AsyncTelegramHelper:
             print(f"✅ Accessing real channel: {getattr(channel_entity, 'title', 'Unknown')}")
             
             results = []
+            pending_writes = []
             message_count = 0
             suspicious_count = 0
             
@@ -345,21 +347,22 @@ class AsyncTelegramHelper:
                     
                     results.append(message_data)
                     
-                    # Save real data to database
-                    from database import db
-                    db.save_monitoring_result(channel_id, message_data)
+                    # Save real data to database in the background
+                    pending_writes.append(asyncio.ensure_future(
+                        async_db.save_monitoring_result(channel_id, message_data)
+                    ))
                     
                     if analysis_result["prediction"] == "drug sale":
                         suspicious_count += 1
                         print(f"🚨 REAL DRUG SALE DETECTED: {text[:80]}")
                         print(f"   Keywords: {', '.join(analysis_result['keyword_matches'])}")
             
+            await asyncio.gather(*pending_writes)
             print(f"✅ REAL DATA COMPLETE: {message_count} messages, {suspicious_count} drug sales")
             
             # Update status
-            from database import db
             from datetime import datetime
-            db.update_channel_status(channel_id, "monitored", datetime.utcnow())
+            await async_db.update_channel_status(channel_id, "monitored", datetime.utcnow())
             
             await client.disconnect()
             return results
@@ -37,10 +37,7 @@ async def authenticate_telegram():
             print(f"✅ SUCCESS! Can access channels: {test_channel.title}")
             
             # Save phone number to database for future use
-            db.users.update_one(
-                {"username": "Devesh"},
-                {"$set": {"phone_number": phone, "telegram_linked": True}}
-            )
+            db.update_telegram_link("Devesh", phone)
             print("✅ Phone number saved for future sessions")
             
         except Exception as e:
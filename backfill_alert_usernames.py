@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Backfill the username field on existing alerts
+Alerts created before username was denormalized onto them are invisible to
+the single-query alert lookup until this has been run once.
+"""
+
+from database import db
+
+def backfill():
+    """Copy each channel's owner onto its alerts"""
+    print("🔄 Backfilling usernames onto existing alerts...")
+    
+    missing = db.count_alerts_without_username()
+    print(f"📊 Alerts without username: {missing}")
+    
+    if missing == 0:
+        print("✅ Nothing to do")
+        return
+    
+    updated = db.backfill_alert_usernames()
+    print(f"✅ Updated {updated} alerts")
+    
+    orphaned = db.count_alerts_without_username()
+    if orphaned:
+        print(f"⚠️ {orphaned} alerts belong to channels that no longer exist")
+
+if __name__ == "__main__":
+    backfill()
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+Backfill updated_at on existing monitoring results
+Results saved before updated_at existed never show up in delta exports
+(?since=...) until this has been run once; they are given their processed_at.
+SQLite files are migrated automatically when opened.
+"""
+
+from database import db
+
+def backfill():
+    """Copy processed_at into updated_at where it is missing"""
+    print("🔄 Backfilling updated_at onto existing monitoring results...")
+    updated = db.backfill_result_updated_at()
+    print(f"✅ Updated {updated} results")
+
+if __name__ == "__main__":
+    backfill()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Image analysis benchmark
+Decodes and analyzes synthetic photos of several sizes, once with JPEG draft
+decoding (what /analyze_image does) and once with a full decode, and reports
+latency and peak RSS per image. Every case runs in a fresh process so its
+peak RSS (interpreter and upload bytes included) is not hidden by an
+earlier, larger one.
+
+It also times known-image lookups among random pHashes.
+
+Usage: python benchmark_images.py [runs] [known_images]
+(runs per case, default 5; known_images default 100000; OCR is not included)
+"""
+
+import io
+import sys
+import time
+import random
+import statistics
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# (label, width, height, format)
+CASES = [
+    ("2 MP JPEG", 1600, 1200, "JPEG"),
+    ("12 MP JPEG", 4000, 3000, "JPEG"),
+    ("48 MP JPEG", 8000, 6000, "JPEG"),
+    ("12 MP PNG", 4000, 3000, "PNG"),
+]
+
+def make_image(width, height, image_format):
+    """A noisy photo-like image, so the encoders cannot cheat on flat colour"""
+    from PIL import Image
+    noise = Image.effect_noise((width, height), 40)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    image = Image.merge("RGB", (noise, gradient, noise.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=90)
+    return buffer.getvalue()
+
+def _peak_rss_mb():
+    # VmHWM belongs to this process image; ru_maxrss survives fork and exec on Linux
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _run_case(image_bytes, draft, runs, queue):
+    from image_analysis import ANALYSIS_MAX_SIZE, load_image, analyze_image
+
+    latencies = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        with load_image(image_bytes, ANALYSIS_MAX_SIZE if draft else None) as image:
+            decoded_size = image.size
+            analyze_image(image, image_bytes)
+        latencies.append(time.perf_counter() - t0)
+    peak = _peak_rss_mb()
+    queue.put((latencies, decoded_size, peak))
+
+def measure(image_bytes, draft, runs):
+    # spawn, not fork: a forked child shares the parent's heap, upload bytes included
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_case, args=(image_bytes, draft, runs, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def run_benchmark(runs):
+    print(f"📊 IMAGE ANALYSIS BENCHMARK ({runs} runs per case, median latency)")
+    print("=" * 78)
+    print(f"{'Image':<12} {'Decode':<7} {'Decoded at':>12} {'Latency':>10} {'Peak RSS':>12}")
+    for label, width, height, image_format in CASES:
+        image_bytes = make_image(width, height, image_format)
+        for draft in (False, True):
+            if draft and image_format != "JPEG":
+                continue
+            latencies, decoded_size, rss = measure(image_bytes, draft, runs)
+            rss_text = "n/a" if rss is None else f"{rss:.1f} MB"
+            print(f"{label:<12} {'draft' if draft else 'full':<7} "
+                  f"{decoded_size[0]:>5}x{decoded_size[1]:<6} "
+                  f"{statistics.median(latencies) * 1000:>8.1f}ms {rss_text:>12}")
+
+def run_index_benchmark(size, lookups=1000):
+    from image_index import MultiIndexHashTable, KNOWN_IMAGE_MAX_DISTANCE
+
+    rng = random.Random(0)
+    table = MultiIndexHashTable()
+    hashes = [rng.getrandbits(64) for _ in range(size)]
+    t0 = time.perf_counter()
+    for i, key in enumerate(hashes):
+        table.add(key, i)
+    build_time = time.perf_counter() - t0
+
+    # Half the probes are near-duplicates of indexed hashes (a few flipped bits)
+    probes = [rng.getrandbits(64) for _ in range(lookups // 2)]
+    probes += [rng.choice(hashes) ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for _ in range(lookups // 2)]
+    latencies = []
+    for probe in probes:
+        t0 = time.perf_counter()
+        table.search(probe, KNOWN_IMAGE_MAX_DISTANCE)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    print(f"Known-image index:   {size:,} hashes built in {build_time:.2f}s; lookup within "
+          f"{KNOWN_IMAGE_MAX_DISTANCE} bits median {statistics.median(latencies) * 1000:.3f}ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms")
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
+    run_index_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
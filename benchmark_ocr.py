@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+OCR preprocessing benchmark
+OCRs a fixture set twice, once as before preprocessing existed (the whole
+RGB image in one Tesseract call) and once through ocr_preprocess (binarized
+text regions only), and reports latency and word recall for both.
+
+Fixtures are synthetic product photos, light and dark screenshots, a poster
+and pages with known text, plus any `<name>.png|jpg` in fixture_dir that has its expected text in
+`<name>.txt`. Without a Tesseract binary only the preprocessing cost and the
+share of pixels that would be sent to Tesseract are reported.
+
+Usage: python benchmark_ocr.py [fixture_dir]
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import random
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+SALES_LINES = [
+    "PREMIUM QUALITY AVAILABLE",
+    "DM for price list",
+    "stealth shipping all india",
+    "cash on delivery 24x7",
+    "bulk discount for resellers",
+    "new stock just landed",
+]
+
+def _font(size):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default()
+
+def synthetic_fixtures():
+    """(name, image, expected text) for photos with captions, screenshots and a page"""
+    rng = random.Random(7)
+    fixtures = []
+    for i in range(3):
+        photo = Image.effect_noise((3000, 2000), 30).convert("RGB").filter(ImageFilter.GaussianBlur(3))
+        draw = ImageDraw.Draw(photo)
+        lines = rng.sample(SALES_LINES, 2)
+        draw.text((200, 250), lines[0], font=_font(72), fill=(255, 255, 255))
+        draw.text((300, 1600), lines[1], font=_font(64), fill=(255, 230, 0))
+        fixtures.append((f"photo_{i}", photo, " ".join(lines)))
+
+    photo = Image.effect_noise((3000, 2000), 30).convert("RGB").filter(ImageFilter.GaussianBlur(3))
+    fixtures.append(("photo_no_text", photo, ""))
+
+    shot = Image.new("RGB", (720, 400), "white")
+    draw = ImageDraw.Draw(shot)
+    lines = rng.sample(SALES_LINES, 5)
+    for row, line in enumerate(lines):
+        draw.text((24, 24 + 70 * row), line, font=_font(28), fill="black")
+    fixtures.append(("screenshot", shot, " ".join(lines)))
+
+    page = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(page)
+    lines = [rng.choice(SALES_LINES) for _ in range(30)]
+    for row, line in enumerate(lines):
+        draw.text((80, 80 + 52 * row), line, font=_font(32), fill="black")
+    fixtures.append(("page", page, " ".join(lines)))
+
+    # Harder cases: dark-mode phone screenshot, low-contrast poster, small caption
+    dark = Image.new("RGB", (1080, 1920), (18, 18, 24))
+    draw = ImageDraw.Draw(dark)
+    lines = rng.sample(SALES_LINES, 4)
+    for row, line in enumerate(lines):
+        draw.rounded_rectangle((40, 200 + 260 * row, 1000, 380 + 260 * row), 30, fill=(43, 82, 120))
+        draw.text((80, 260 + 260 * row), line, font=_font(44), fill=(235, 235, 235))
+    fixtures.append(("dark_screenshot", dark, " ".join(lines)))
+
+    poster = Image.linear_gradient("L").resize((1600, 1600)).convert("RGB")
+    poster = Image.merge("RGB", (poster.getchannel(0), Image.new("L", poster.size, 90),
+                                 poster.getchannel(0).transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(poster)
+    lines = rng.sample(SALES_LINES, 3)
+    for row, (line, size) in enumerate(zip(lines, (96, 60, 40))):
+        draw.text((120, 300 + 400 * row), line, font=_font(size), fill=(250, 200, 60))
+    fixtures.append(("poster", poster, " ".join(lines)))
+
+    photo = Image.effect_noise((2400, 1600), 30).convert("RGB").filter(ImageFilter.GaussianBlur(3))
+    draw = ImageDraw.Draw(photo)
+    line = rng.choice(SALES_LINES)
+    draw.text((120, 1450), line, font=_font(30), fill=(255, 255, 255))
+    fixtures.append(("small_caption", photo, line))
+    return fixtures
+
+def directory_fixtures(directory):
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.png")) + glob.glob(os.path.join(directory, "*.jpg"))):
+        expected_path = os.path.splitext(path)[0] + ".txt"
+        if os.path.exists(expected_path):
+            with open(expected_path, encoding="utf-8") as f:
+                expected = f.read()
+            with Image.open(path) as image:
+                fixtures.append((os.path.basename(path), image.convert("RGB"), expected))
+    return fixtures
+
+def _words(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def recall(expected, text):
+    """Share of the expected words found in the OCR text (None if none are expected)"""
+    expected_words = _words(expected)
+    if not expected_words:
+        return None
+    found = set(_words(text))
+    return sum(word in found for word in expected_words) / len(expected_words)
+
+def run_ocr(image, preprocess):
+    import ocr
+    ocr.OCR_PREPROCESS = preprocess
+    t0 = time.perf_counter()
+    result = ocr._run_tesseract(image, "eng")
+    return result, time.perf_counter() - t0
+
+def run_benchmark(fixtures):
+    import ocr
+    from ocr_preprocess import ocr_plan
+
+    print(f"📊 OCR PREPROCESSING BENCHMARK ({len(fixtures)} images)")
+    print("=" * 78)
+    if not ocr.tesseract_info()["available"]:
+        print("⚠️ Tesseract is not available: reporting preprocessing only (no latency or recall)")
+        print(f"{'Image':<16} {'Size':>10} {'Plan':>9} {'Regions':>8} {'Pixels OCRed':>13}")
+        for name, image, _ in fixtures:
+            t0 = time.perf_counter()
+            plan = ocr_plan(image)
+            elapsed = time.perf_counter() - t0
+            pixels = sum(crop.size[0] * crop.size[1] for crop, _ in plan)
+            # An empty plan falls back to OCRing the whole image
+            share = pixels / (image.size[0] * image.size[1]) if plan else 1.0
+            print(f"{name:<16} {image.size[0]:>5}x{image.size[1]:<4} {elapsed * 1000:>7.1f}ms "
+                  f"{len(plan):>8} {share * 100:>12.1f}%")
+        return
+
+    print(f"{'Image':<16} {'Before':>10} {'Recall':>7} {'After':>10} {'Recall':>7} {'Regions':>8}")
+    totals = {False: [0.0, []], True: [0.0, []]}
+    for name, image, expected in fixtures:
+        row = []
+        for preprocess in (False, True):
+            result, elapsed = run_ocr(image, preprocess)
+            score = recall(expected, result["text"]) if result["ok"] else 0.0
+            totals[preprocess][0] += elapsed
+            if score is not None:
+                totals[preprocess][1].append(score)
+            row.append((elapsed, score, result.get("regions", "-")))
+        (before, before_recall, _), (after, after_recall, regions) = row
+        fmt = lambda score: "n/a" if score is None else f"{score * 100:.0f}%"
+        print(f"{name:<16} {before * 1000:>8.0f}ms {fmt(before_recall):>7} "
+              f"{after * 1000:>8.0f}ms {fmt(after_recall):>7} {regions:>8}")
+    for preprocess, label in ((False, "Before"), (True, "After")):
+        elapsed, scores = totals[preprocess]
+        mean = sum(scores) / len(scores) if scores else 0.0
+        print(f"{label + ':':<10} {elapsed:.2f}s total, mean recall {mean * 100:.1f}%")
+
+if __name__ == "__main__":
+    fixture_set = synthetic_fixtures()
+    if len(sys.argv) > 1:
+        fixture_set += directory_fixtures(sys.argv[1])
+    run_benchmark(fixture_set)
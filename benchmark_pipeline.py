@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Detection pipeline benchmark
+Runs message analysis and result storage against the embedded SQLite
+backend, so the numbers are not distorted by network latency to Atlas.
+
+Usage: python benchmark_pipeline.py [messages] [sqlite_path]
+(sqlite_path defaults to :memory:)
+"""
+
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+# Must be set before database is imported
+os.environ['STORAGE_BACKEND'] = 'sqlite'
+os.environ['SQLITE_PATH'] = sys.argv[2] if len(sys.argv) > 2 else ':memory:'
+
+SAMPLE_MESSAGES = [
+    "Good morning everyone, meeting moved to 5pm today",
+    "Premium quality MDMA available, home delivery, dm for price",
+    "Check out the latest news update on our website",
+    "Party stuff in stock 💊 cash on delivery, whatsapp for details",
+    "FREE subscription! Click the link to win a bonus",
+    "Anyone watching the match tonight?",
+    "Bulk discount on maal, serious buyers only, stealth shipping 📦",
+    "Thanks for sharing the information",
+]
+
+async def run_benchmark(count):
+    from database import db
+    from telegram_monitor import monitor
+
+    channel_id = db.add_channel("benchmark", "https://t.me/benchmark_channel")
+    texts = [SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)] + f" #{i}" for i in range(count)]
+    start_date = datetime(2024, 1, 1)
+
+    analysis_time = 0.0
+    storage_time = 0.0
+    suspicious = 0
+
+    for i, text in enumerate(texts):
+        t0 = time.perf_counter()
+        analysis = await monitor.analyze_message(text)
+        t1 = time.perf_counter()
+        db.save_monitoring_result(channel_id, {
+            "message_id": i,
+            "sender_id": 1,
+            "date": start_date + timedelta(seconds=i),
+            "message_text": text,
+            "prediction": analysis["prediction"],
+            "confidence": analysis["confidence"],
+            "keyword_matches": analysis["keyword_matches"],
+            "features": analysis["features"]
+        })
+        t2 = time.perf_counter()
+        analysis_time += t1 - t0
+        storage_time += t2 - t1
+        if analysis["prediction"] == "drug sale":
+            suspicious += 1
+
+    t0 = time.perf_counter()
+    pages = 0
+    cursor = None
+    while True:
+        _, cursor = db.get_monitoring_results_page(channel_id, cursor=cursor, limit=50)
+        pages += 1
+        if not cursor:
+            break
+    paging_time = time.perf_counter() - t0
+
+    total = analysis_time + storage_time
+    print("📊 PIPELINE BENCHMARK (storage: sqlite "
+          f"{os.environ['SQLITE_PATH']})")
+    print("=" * 60)
+    print(f"Messages:            {count} ({suspicious} flagged)")
+    print(f"Analysis:            {analysis_time:.3f}s ({count / analysis_time:,.0f} msg/s)")
+    print(f"Storage:             {storage_time:.3f}s ({count / storage_time:,.0f} msg/s)")
+    print(f"End to end:          {total:.3f}s ({count / total:,.0f} msg/s)")
+    print(f"Paged read-back:     {pages} pages in {paging_time * 1000:.1f}ms "
+          f"({paging_time / pages * 1000:.2f}ms/page)")
+
+if __name__ == "__main__":
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    asyncio.run(run_benchmark(message_count))
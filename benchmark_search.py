@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Search benchmark
+Fills a store with synthetic messages spread over several channels and times
+search_results for word, phrase and filtered queries (p50 / p95 over several
+runs), as GET /api/search would call it across all of a user's channels.
+
+The backend is picked by STORAGE_BACKEND like the app: SQLite defaults to
+:memory:, and MongoDB (MONGODB_URI) runs in a scratch database that is
+dropped afterwards.
+
+Usage: python benchmark_search.py [messages] [runs]
+(messages default 100000, runs per query default 20)
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import statistics
+from datetime import datetime, timedelta
+
+# Must be set before database is imported
+os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', ':memory:')
+
+CHANNELS = 20
+
+WORDS = (
+    "the meeting moved to tomorrow please share the link good morning bhai kya scene hai match tonight "
+    "new video uploaded check the website offer ends soon weekend plans party thanks for sharing update "
+    "join our channel free subscription exam results college fest tickets available crystal clear water"
+).split()
+PHRASES = ["crystal meth", "home delivery", "cash on delivery", "dm for price", "weed", "mdma"]
+
+def _queries(channel_ids, start):
+    week = (start + timedelta(days=20), start + timedelta(days=27))
+    return [
+        ("word", "meth", {}),
+        ("phrase", '"home delivery"', {}),
+        ("two words", "cash delivery", {}),
+        ("phrase + prediction", '"crystal meth"', {"prediction": "drug sale"}),
+        ("word + last week", "weed", {"date_from": week[0], "date_to": week[1]}),
+        ("word, page 3", "mdma", {"offset": 100}),
+        ("common word", "the", {}),
+    ]
+
+def make_store():
+    from database import create_database, Database
+    if os.environ['STORAGE_BACKEND'].lower() == 'mongo':
+        return Database(database_name=f"trinetra_bench_{uuid.uuid4().hex[:8]}")
+    return create_database()
+
+def fill(store, count):
+    rng = random.Random(11)
+    channel_ids = [store.add_channel("benchmark", f"https://t.me/search_bench_{i}") for i in range(CHANNELS)]
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 30))]
+        suspicious = rng.random() < 0.1
+        if suspicious:
+            words.insert(rng.randrange(len(words)), rng.choice(PHRASES))
+        store.save_monitoring_result(channel_ids[i % CHANNELS], {
+            "message_id": i, "date": start + timedelta(minutes=i * 30 * 24 * 60 // count),
+            "message_text": " ".join(words), "prediction": "drug sale" if suspicious else "normal",
+            "confidence": 0.9 if suspicious else 0.4
+        })
+    return channel_ids, start
+
+def run_benchmark(count, runs):
+    store = make_store()
+    try:
+        t0 = time.perf_counter()
+        channel_ids, start = fill(store, count)
+        fill_time = time.perf_counter() - t0
+
+        print(f"📊 SEARCH BENCHMARK (storage: {store.name})")
+        print("=" * 60)
+        print(f"Messages:            {count:,} in {CHANNELS} channels (stored in {fill_time:.1f}s)")
+        print(f"{'Query':<24}{'Hits':>6}{'p50':>10}{'p95':>10}")
+        for label, query, filters in _queries(channel_ids, start):
+            timings = []
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                results, _ = store.search_results(query, channel_ids, limit=50, **filters)
+                timings.append((time.perf_counter() - t0) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{label:<24}{len(results):>6}{statistics.median(timings):>8.1f}ms{p95:>8.1f}ms")
+    finally:
+        if store.name == "mongo":
+            store.client.drop_database(store.database_name)
+        store.close()
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+                  int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark
+Imports the modules a web worker or script boots with, each in a fresh
+interpreter so nothing is already in sys.modules, and reports the median
+import time. For ocr it also times the first tesseract_info() call, the
+engine probe that runs on first OCR use rather than at import.
+
+app is imported with whatever STORAGE_BACKEND is configured; set
+STORAGE_BACKEND=sqlite SQLITE_PATH=:memory: to leave the database out.
+
+Usage: python benchmark_startup.py [runs]   (default 5)
+"""
+
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+MODULES = ["ocr", "image_analysis", "detection", "app"]
+
+_SNIPPET = """
+import json, time
+t0 = time.perf_counter()
+import {module}
+imported = time.perf_counter() - t0
+probe = None
+if {probe!r} and hasattr({module}, "tesseract_info"):
+    t0 = time.perf_counter()
+    {module}.tesseract_info()
+    probe = time.perf_counter() - t0
+print("\\n" + json.dumps({{"import": imported, "probe": probe}}))
+"""
+
+def measure(module, probe=False):
+    """(import seconds, first probe seconds or None) in a fresh interpreter"""
+    completed = subprocess.run(
+        [sys.executable, "-c", _SNIPPET.format(module=module, probe=probe)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    # The module may print while importing; the timings are the last line
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    return timings["import"], timings["probe"]
+
+def run_benchmark(runs):
+    print(f"📊 COLD START BENCHMARK ({runs} fresh interpreters per module, median)")
+    print("=" * 60)
+    print(f"{'Module':<16} {'Import':>10} {'First probe':>14}")
+    for module in MODULES:
+        try:
+            samples = [measure(module, probe=True) for _ in range(runs)]
+        except RuntimeError as e:
+            print(f"{module:<16} failed: {e}")
+            continue
+        imported = statistics.median(sample[0] for sample in samples)
+        probes = [sample[1] for sample in samples if sample[1] is not None]
+        probe_text = f"{statistics.median(probes) * 1000:.1f}ms" if probes else "-"
+        print(f"{module:<16} {imported * 1000:>8.1f}ms {probe_text:>14}")
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
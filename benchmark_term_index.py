@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Term index benchmark
+Stores a synthetic channel corpus in the embedded SQLite backend and reports
+the term index size per result (next to the all-trigram and winnowed-only
+schemes it replaced) and, for a few lexicon terms, how many candidate rows a
+targeted rescore reads compared with a full rescore.
+
+Usage: python benchmark_term_index.py [messages] [sqlite_path]
+(sqlite_path defaults to :memory:)
+"""
+
+import os
+import sys
+import time
+import random
+import statistics
+from datetime import datetime, timedelta
+
+# Must be set before database is imported
+os.environ['STORAGE_BACKEND'] = 'sqlite'
+os.environ['SQLITE_PATH'] = sys.argv[2] if len(sys.argv) > 2 else ':memory:'
+
+# Everyday chatter with the odd lexicon term mixed in, roughly the mix of a
+# monitored channel where most messages are not drug sales
+FILLER = (
+    "the meeting moved to tomorrow please share the link everyone good morning bhai kya scene hai "
+    "match tonight who is watching new video uploaded check the website offer ends soon spot the "
+    "difference depot opening hours potato prices went up weekend plans anyone going to the party "
+    "thanks for sharing information update your app contact admin for group rules join our channel "
+    "free subscription win a bonus exam results announced college fest tickets available at the gate"
+).split()
+LEXICON = ["weed", "maal", "mdma", "charas", "coke", "molly", "meth", "home delivery", "dm for price",
+           "cash on delivery", "stealth shipping", "💊", "📦", "in stock"]
+EXTRAS = ["#{}", "rs {}", "{}k", "+91 98{}"]
+
+BENCHMARK_TERMS = ["pot", "weed", "coke", "molly", "meth", "chitta", "crystal meth", "💊"]
+
+def make_message(rng):
+    words = [rng.choice(FILLER) for _ in range(rng.randint(6, 40))]
+    if rng.random() < 0.15:
+        words.insert(rng.randrange(len(words)), rng.choice(LEXICON))
+    if rng.random() < 0.3:
+        words.append(rng.choice(EXTRAS).format(rng.randint(0, 99999)))
+    return " ".join(words)
+
+def run_benchmark(count):
+    from database import db
+    from detection import text_grams, _winnowed_grams, _symbols, GRAM_SIZE
+
+    rng = random.Random(42)
+    channel_id = db.add_channel("benchmark", "https://t.me/term_index_benchmark")
+    texts = [make_message(rng) for _ in range(count)]
+    start_date = datetime(2024, 1, 1)
+
+    t0 = time.perf_counter()
+    for i, text in enumerate(texts):
+        db.save_monitoring_result(channel_id, {"message_id": i, "date": start_date + timedelta(seconds=i),
+                                               "message_text": text, "prediction": "normal", "confidence": 0.5})
+    storage_time = time.perf_counter() - t0
+
+    def keys_per_result(scheme):
+        return statistics.mean(len(scheme(text.lower())) for text in texts)
+
+    all_grams = keys_per_result(lambda t: {t[i:i + GRAM_SIZE] for i in range(len(t) - GRAM_SIZE + 1)} | _symbols(t))
+    winnowed = keys_per_result(lambda t: _winnowed_grams(t) | _symbols(t))
+    current = keys_per_result(text_grams)
+    with db._transaction() as conn:
+        vocabulary = conn.execute("SELECT COUNT(*) FROM term_words").fetchone()[0]
+
+    print("📊 TERM INDEX BENCHMARK (storage: sqlite "
+          f"{os.environ['SQLITE_PATH']})")
+    print("=" * 60)
+    print(f"Messages:            {count:,} (mean {statistics.mean(map(len, texts)):.0f} chars)")
+    print(f"Storage:             {storage_time:.3f}s ({count / storage_time:,.0f} msg/s)")
+    print(f"Keys per result:     {current:.1f} (all trigrams {all_grams:.1f}, "
+          f"winnowed only {winnowed:.1f})")
+    print(f"Vocabulary words:    {vocabulary:,}")
+    print(f"{'Term':<20}{'Candidates':>12}{'Share':>10}{'Lookup':>12}")
+    for term in BENCHMARK_TERMS:
+        t0 = time.perf_counter()
+        candidates = sum(len(batch) for batch in db.iter_term_candidate_batches([term]))
+        elapsed = time.perf_counter() - t0
+        print(f"{term:<20}{candidates:>12,}{candidates / count:>10.1%}{elapsed * 1000:>10.1f}ms")
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,261 @@
+"""
+Bulk export of several channels as one ZIP
+A background job writes one export file per channel plus summary.csv into a
+ZIP under BULK_EXPORT_DIR. Progress is kept in a JSON sidecar next to the
+artifact, so every web worker can report it and serve the finished file.
+
+Jobs are keyed by their request (user, channels, date range, format). An
+identical request reuses the finished artifact while the channels' results are
+unchanged (the watermark): none added, rescored or otherwise updated since the
+job's export watermark, and no retention run since, so archiving, compaction
+and purges are noticed too. Both checks are index lookups, whatever the size of
+the channels. Stubs removed by MongoDB's TTL monitor between retention runs
+are not noticed; they are a year old by then and artifacts live a day. Anything
+else starts a fresh job. Artifacts are removed BULK_EXPORT_TTL_HOURS after they were built.
+"""
+
+import io
+import os
+import csv
+import json
+import time
+import hashlib
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from exports import EXPORT_FORMATS, EXPORT_FIELDS, ExportSummary, export_watermark, iter_csv
+from storage import decode_cursor
+
+# render.yaml mounts the persistent disk at /app/temp
+BULK_EXPORT_DIR = os.getenv('BULK_EXPORT_DIR', os.path.join('temp', 'exports'))
+BULK_EXPORT_MAX_CHANNELS = int(os.getenv('BULK_EXPORT_MAX_CHANNELS', '100'))
+BULK_EXPORT_WORKERS = int(os.getenv('BULK_EXPORT_WORKERS', '2'))
+BULK_EXPORT_TTL_HOURS = float(os.getenv('BULK_EXPORT_TTL_HOURS', '24'))
+# A job that has not reported progress for this long is presumed dead (its worker was restarted)
+BULK_EXPORT_STALE_SECONDS = int(os.getenv('BULK_EXPORT_STALE_SECONDS', '300'))
+
+# Rows between sidecar progress updates
+PROGRESS_ROWS = 5000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    """Job threads are started lazily, so forked web workers each get their own"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=BULK_EXPORT_WORKERS, thread_name_prefix='bulk-export')
+        return _executor
+
+def bulk_job_id(username, channel_ids, date_from=None, date_to=None, export_format='csv'):
+    """Stable id for a bulk export request"""
+    key = json.dumps({
+        'username': username,
+        'channel_ids': sorted(channel_ids),
+        'date_from': date_from.isoformat() if date_from else None,
+        'date_to': date_to.isoformat() if date_to else None,
+        'format': export_format
+    }, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def artifact_path(job_id, export_dir=None):
+    return os.path.join(export_dir or BULK_EXPORT_DIR, f'{job_id}.zip')
+
+def _sidecar_path(job_id, export_dir=None):
+    return os.path.join(export_dir or BULK_EXPORT_DIR, f'{job_id}.json')
+
+def load_job(job_id, export_dir=None):
+    """Current state of a job, or None if it is unknown"""
+    try:
+        with open(_sidecar_path(job_id, export_dir), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _save_job(state, export_dir=None):
+    state['updated_at'] = time.time()
+    path = _sidecar_path(state['job_id'], export_dir)
+    # Unique temp name: the job thread and request threads may write concurrently
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def results_watermark(store):
+    """Where an export starting now stands: the delta-export cursor (see
+    exports.export_watermark) and the time of the last retention run"""
+    _, cursor = export_watermark()
+    retention_run = store.last_retention_run()
+    return {
+        'cursor': cursor,
+        'retention_run': retention_run.isoformat() if retention_run else None
+    }
+
+def _changed_since(store, channel_ids, cursor):
+    """Whether any of the channels' results was added or updated after cursor"""
+    since = decode_cursor(cursor)
+    for channel_id in channel_ids:
+        changes = store.iter_changed_results(channel_id, since=since, fields=['_id'], batch_size=1)
+        try:
+            if next(changes, None) is not None:
+                return True
+        finally:
+            changes.close()
+    return False
+
+def _is_current(store, state, watermark):
+    """Whether a job's artifact still matches the channels' results"""
+    built = state.get('watermark') or {}
+    if 'cursor' not in built or built.get('retention_run', False) != watermark['retention_run']:
+        return False
+    return not _changed_since(store, state['channel_ids'], built['cursor'])
+
+def _prune_expired(export_dir=None):
+    """Remove artifacts (and their sidecars) built more than BULK_EXPORT_TTL_HOURS ago"""
+    export_dir = export_dir or BULK_EXPORT_DIR
+    cutoff = time.time() - BULK_EXPORT_TTL_HOURS * 3600
+    for name in os.listdir(export_dir):
+        if not name.endswith('.json'):
+            continue
+        state = load_job(name[:-len('.json')], export_dir)
+        if state and state['status'] in ('done', 'failed') and state['updated_at'] < cutoff:
+            for path in (artifact_path(state['job_id'], export_dir), _sidecar_path(state['job_id'], export_dir)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+def _is_active(state):
+    return (state['status'] in ('queued', 'running')
+            and time.time() - state['updated_at'] < BULK_EXPORT_STALE_SECONDS)
+
+def start_bulk_export(store, username, channels, date_from=None, date_to=None,
+                      export_format='csv', export_dir=None, archive_dir=None):
+    """Start (or reuse) a bulk export of channel documents; returns the job state"""
+    if export_format != 'csv' and export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if not channels:
+        raise ValueError("No channels selected")
+    if len(channels) > BULK_EXPORT_MAX_CHANNELS:
+        raise ValueError(f"At most {BULK_EXPORT_MAX_CHANNELS} channels per bulk export")
+
+    export_dir = export_dir or BULK_EXPORT_DIR
+    os.makedirs(export_dir, exist_ok=True)
+    _prune_expired(export_dir)
+
+    channels = sorted(channels, key=lambda channel: str(channel['_id']))
+    channel_ids = [str(channel['_id']) for channel in channels]
+    job_id = bulk_job_id(username, channel_ids, date_from, date_to, export_format)
+    watermark = results_watermark(store)
+
+    state = load_job(job_id, export_dir)
+    if state and _is_current(store, state, watermark):
+        if state['status'] == 'done' and os.path.exists(artifact_path(job_id, export_dir)):
+            return state
+        if _is_active(state):
+            return state
+
+    state = {
+        'job_id': job_id,
+        'username': username,
+        'channel_ids': channel_ids,
+        'date_from': date_from.isoformat() if date_from else None,
+        'date_to': date_to.isoformat() if date_to else None,
+        'format': export_format,
+        'watermark': watermark,
+        'status': 'queued',
+        'channels_total': len(channels),
+        'channels_done': 0,
+        'rows': 0,
+        'size_bytes': None,
+        'error': None,
+        'created_at': time.time()
+    }
+    _save_job(state, export_dir)
+    _get_executor().submit(run_bulk_export, store, state, channels, date_from, date_to, export_dir, archive_dir)
+    return state
+
+def _channel_file_name(channel, extension):
+    safe_channel_name = (channel.get('channel_name') or 'unknown').replace('/', '_').replace('\\', '_')
+    return f"{safe_channel_name}_{channel['_id']}.{extension}"
+
+def _channel_chunks(store, channel_id, export_format, summary, date_from, date_to, archive_dir):
+    if export_format == 'csv':
+        for chunk in iter_csv(store, channel_id, summary, archive_dir, date_from, date_to):
+            yield chunk.encode('utf-8')
+    else:
+        stream = EXPORT_FORMATS[export_format][0]
+        yield from stream(store, channel_id, EXPORT_FIELDS, archive_dir, date_from, date_to, summary)
+
+def _write_summary(archive, state, entries):
+    """summary.csv: one row per channel file plus the combined totals"""
+    total = ExportSummary()
+    # UTF-8 with BOM, like the per-channel CSVs, so Excel reads it correctly
+    with io.TextIOWrapper(archive.open('summary.csv', 'w'), encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Channel", "Channel ID", "File", "Total Messages", "Drug Sale Detected",
+                         "Normal Messages", "Spam Messages", "Other Messages", "Average Confidence (%)"])
+        for channel, file_name, summary in entries:
+            total.merge(summary)
+            writer.writerow(_summary_row(channel.get('channel_name') or 'unknown',
+                                         str(channel['_id']), file_name, summary))
+        writer.writerow(_summary_row("All Channels", "", "", total))
+        writer.writerow([])
+        writer.writerow(["Message Dates From", state['date_from'] or "any", "Before", state['date_to'] or "any"])
+        writer.writerow(["Export Time", datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')])
+        writer.writerow(["Exported by", "Trinetra Drug Detection System"])
+
+def _summary_row(name, channel_id, file_name, summary):
+    predictions = summary.predictions
+    return [name, channel_id, file_name, summary.total, predictions.get("drug sale", 0),
+            predictions.get("normal", 0), predictions.get("spam", 0), predictions.get("other", 0),
+            f"{summary.avg_confidence * 100:.1f}"]
+
+def run_bulk_export(store, state, channels, date_from=None, date_to=None, export_dir=None, archive_dir=None):
+    """Build the ZIP for a job, reporting progress in its sidecar"""
+    path = artifact_path(state['job_id'], export_dir)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    export_format = state['format']
+    extension = 'csv' if export_format == 'csv' else EXPORT_FORMATS[export_format][1]
+
+    state['status'] = 'running'
+    _save_job(state, export_dir)
+    try:
+        entries = []
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for channel in channels:
+                channel_id = str(channel['_id'])
+                file_name = _channel_file_name(channel, extension)
+                info = zipfile.ZipInfo(file_name, date_time=time.gmtime()[:6])
+                # NDJSON and Parquet are compressed already
+                info.compress_type = zipfile.ZIP_DEFLATED if export_format == 'csv' else zipfile.ZIP_STORED
+                summary = ExportSummary()
+                reported = 0
+                with archive.open(info, 'w', force_zip64=True) as entry:
+                    for chunk in _channel_chunks(store, channel_id, export_format, summary,
+                                                 date_from, date_to, archive_dir):
+                        entry.write(chunk)
+                        if summary.total - reported >= PROGRESS_ROWS:
+                            state['rows'] += summary.total - reported
+                            reported = summary.total
+                            _save_job(state, export_dir)
+                entries.append((channel, file_name, summary))
+                state['rows'] += summary.total - reported
+                state['channels_done'] += 1
+                _save_job(state, export_dir)
+            _write_summary(archive, state, entries)
+
+        os.replace(tmp_path, path)
+        state['status'] = 'done'
+        state['size_bytes'] = os.path.getsize(path)
+        _save_job(state, export_dir)
+        print(f"✅ Bulk export {state['job_id']}: {state['rows']} results from "
+              f"{state['channels_total']} channels ({state['size_bytes']} bytes)")
+    except Exception as e:
+        print(f"❌ Bulk export {state['job_id']} failed: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        state['status'] = 'failed'
+        state['error'] = str(e)
+        _save_job(state, export_dir)
+    return state
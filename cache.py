@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Thread-safe per-process cache with a time-to-live and LRU eviction.
+    Entries expire `ttl` seconds after being stored; once `maxsize` entries
+    are held the least recently used one is evicted."""
+
+    def __init__(self, maxsize=1024, ttl=60.0, name="cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default on a miss or expired entry"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entry if full"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Drop a single key"""
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Counters for monitoring endpoints"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+class SQLiteLRUCache:
+    """Persistent LRU cache of strings in an SQLite file, shared by every
+    process on the host. Once more than `maxsize` entries are stored the least
+    recently used ones are evicted (checked every 1% of maxsize writes, so the
+    file may briefly hold slightly more). A hit only rewrites an entry's
+    last-used time once it is `touch_interval` seconds old, so hot reads
+    rarely take the file's write lock. Counters are per process. A cache
+    that cannot be read or written behaves as a miss rather than failing."""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries (last_used);
+    """
+
+    def __init__(self, path, maxsize=10000, name="cache", touch_interval=60.0):
+        self.path = path
+        self.maxsize = maxsize
+        self.touch_interval = touch_interval
+        self.name = name
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _conn(self):
+        """This thread's connection (a connection inherited across fork is never reused)"""
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != pid:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self._SCHEMA)
+            self._local.conn = conn
+            self._local.pid = pid
+        return conn
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def get(self, key, default=None):
+        """Return the cached value for key (marking it recently used), or default"""
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, last_used FROM entries WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and now - row[1] >= self.touch_interval:
+                with conn:
+                    conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+        except Exception as e:
+            print(f"⚠️ {self.name} cache read failed: {e}")
+            self._count("errors")
+            row = None
+        if row is None:
+            self._count("misses")
+            return default
+        self._count("hits")
+        return row[0]
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries if full"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % max(1, self.maxsize // 100) == 0
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO entries (key, value, last_used) VALUES (?, ?, ?)",
+                             (key, value, time.time()))
+                if evict:
+                    evicted = conn.execute(
+                        "DELETE FROM entries WHERE key IN (SELECT key FROM entries "
+                        "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.maxsize,)
+                    ).rowcount
+                    self._count("evictions", evicted)
+        except Exception as e:
+            print(f"⚠️ {self.name} cache write failed: {e}")
+            self._count("errors")
+
+    def stats(self):
+        """Counters for monitoring endpoints"""
+        try:
+            with self._conn() as conn:
+                size = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        except Exception:
+            size = None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "path": self.path,
+                "size": size,
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "errors": self.errors
+            }
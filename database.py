@@ -1,166 +1,709 @@
 import os
-from pymongo import MongoClient
+import re
+import asyncio
+import functools
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING, TEXT
+from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime
-import bcrypt
 from dotenv import load_dotenv
 
 load_dotenv()
 
-class Database:
-    def __init__(self):
-        self.client = MongoClient(os.getenv('MONGODB_URI'))
-        self.db = self.client[os.getenv('DATABASE_NAME')]
-        self.users = self.db.users
-        self.channels = self.db.channels
-        self.monitoring_results = self.db.monitoring_results
-        self.alerts = self.db.alerts
-
-    def create_user(self, username, password, api_id, api_hash):
-        """Create a new user with hashed password"""
-        if self.users.find_one({"username": username}):
-            return False, "Username already exists"
-        
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        
-        user_doc = {
-            "username": username,
-            "password": hashed_password,
-            "api_id": api_id,
-            "api_hash": api_hash,
-            "telegram_linked": False,
-            "phone_number": None,
-            "created_at": datetime.utcnow()
-        }
-        
-        result = self.users.insert_one(user_doc)
-        return True, str(result.inserted_id)
-
-    def verify_user(self, username, password):
-        """Verify user login credentials"""
-        user = self.users.find_one({"username": username})
-        if user and bcrypt.checkpw(password.encode('utf-8'), user['password']):
-            return True, user
-        return False, None
-
-    def update_telegram_link(self, username, phone_number):
-        """Update user's Telegram linking status"""
-        self.users.update_one(
-            {"username": username},
-            {
-                "$set": {
-                    "telegram_linked": True,
-                    "phone_number": phone_number,
-                    "linked_at": datetime.utcnow()
-                }
-            }
-        )
+from detection import text_grams, text_words
+from storage import (StorageBackend, SEARCH_MAX_DEPTH, EXPORT_BATCH_SIZE, STATS_META_KEY,
+                     decode_cursor, clamp_page_size, page_key, page_with_cursor, parse_search_query)
+
+# MongoClient pool / timeout / compression settings
+MONGODB_MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '20'))
+MONGODB_MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', '10000'))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+MONGODB_SOCKET_TIMEOUT_MS = os.getenv('MONGODB_SOCKET_TIMEOUT_MS')
+MONGODB_COMPRESSORS = os.getenv('MONGODB_COMPRESSORS', 'zstd,snappy,zlib')
+
+# Result reads leave out the term index array
+RESULT_PROJECTION = {"term_keys": 0, "grams": 0}
+
+# Threads used by AsyncDatabase to run blocking driver calls off the event loop
+ASYNC_DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS', '4'))
+
+def _keyset_query(query, field, cursor):
+    """Restrict query to documents strictly after cursor in (field desc, _id desc) order.
+    The base filter is copied into both $or branches so each branch gets tight index
+    bounds and the page costs the same regardless of how deep the cursor is."""
+    if not cursor:
+        return query
+    timestamp, doc_id = decode_cursor(cursor)
+    return {"$or": [
+        dict(query, **{field: {"$lt": timestamp}}),
+        dict(query, **{field: timestamp, "_id": {"$lt": doc_id}})
+    ]}
+
+def _result_filters(query, prediction=None, min_confidence=None, date_from=None, date_to=None):
+    """Add the optional result filters shared by paging and search to query"""
+    if prediction:
+        query["prediction"] = prediction
+    if min_confidence is not None:
+        query["confidence"] = {"$gte": float(min_confidence)}
+    if date_from or date_to:
+        query["date"] = {}
+        if date_from:
+            query["date"]["$gte"] = date_from
+        if date_to:
+            query["date"]["$lt"] = date_to
+    return query
+
+def _available_compressors(requested):
+    """Filter requested wire compressors down to those whose libraries are installed"""
+    available = []
+    for name in [c.strip() for c in requested.split(',') if c.strip()]:
+        if name == 'zstd':
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                continue
+        elif name == 'snappy':
+            try:
+                import snappy  # noqa: F401
+            except ImportError:
+                continue
+        available.append(name)
+    return available
+
+def mongo_client_options():
+    """Keyword arguments for MongoClient built from the MONGODB_* settings"""
+    options = {
+        "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": MONGODB_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGODB_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+    }
+    if MONGODB_SOCKET_TIMEOUT_MS:
+        options["socketTimeoutMS"] = int(MONGODB_SOCKET_TIMEOUT_MS)
+    compressors = _available_compressors(MONGODB_COMPRESSORS)
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+class Database(StorageBackend):
+    """MongoDB storage backend. The MongoClient is created lazily on first use and
+    re-created in every forked process, so importing this module never opens a
+    connection and a gunicorn --preload master never shares sockets with workers."""
+
+    name = "mongo"
+
+    def __init__(self, uri=None, database_name=None):
+        super().__init__()
+        self.uri = uri or os.getenv('MONGODB_URI')
+        self.database_name = database_name or os.getenv('DATABASE_NAME')
+        self._client = None
+        self._pid = None
+        self._indexes_ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """MongoClient owned by the current process"""
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    # A client inherited across fork belongs to the parent; never reuse it
+                    self._client = MongoClient(self.uri, **mongo_client_options())
+                    self._pid = pid
+        return self._client
+
+    @property
+    def db(self):
+        database = self.client[self.database_name]
+        if not self._indexes_ready:
+            self._indexes_ready = True
+            self.ensure_indexes(database)
+        return database
+
+    @property
+    def users(self):
+        return self.db.users
+
+    @property
+    def channels(self):
+        return self.db.channels
+
+    @property
+    def monitoring_results(self):
+        return self.db.monitoring_results
+
+    @property
+    def alerts(self):
+        return self.db.alerts
+
+    @property
+    def channel_stats_hourly(self):
+        return self.db.channel_stats_hourly
+
+    @property
+    def known_images(self):
+        return self.db.known_images
+
+    @property
+    def meta(self):
+        return self.db.meta
+
+    @property
+    def term_words(self):
+        return self.db.term_words
 
-    def get_user_by_username(self, username):
-        """Get user document by username"""
+    def reset_after_fork(self):
+        """Drop state inherited from the parent process (call in the child after fork)"""
+        super().reset_after_fork()
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Close this process's client, if one was opened"""
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
+
+    def ping(self):
+        """Round-trip to the server"""
+        self.client.admin.command('ping')
+
+    def ensure_indexes(self, database):
+        """Create the indexes backing keyset pagination (idempotent)"""
+        try:
+            database.monitoring_results.create_index(
+                [("channel_id", ASCENDING), ("processed_at", DESCENDING), ("_id", DESCENDING)]
+            )
+            database.monitoring_results.create_index(
+                [("channel_id", ASCENDING), ("prediction", ASCENDING),
+                 ("processed_at", DESCENDING), ("_id", DESCENDING)]
+            )
+            # Date-filtered pages are keyed on (date, _id)
+            database.monitoring_results.create_index(
+                [("channel_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]
+            )
+            # Delta exports walk changes in (updated_at, _id) order
+            database.monitoring_results.create_index(
+                [("channel_id", ASCENDING), ("updated_at", ASCENDING), ("_id", ASCENDING)]
+            )
+            # Retention scans and the TTL that removes compacted stubs
+            database.monitoring_results.create_index([("processed_at", ASCENDING)])
+            database.monitoring_results.create_index("expires_at", expireAfterSeconds=0)
+            # Multikey term index for targeted rescoring; _id second so each
+            # term's candidates are read in _id order, page by page
+            database.monitoring_results.create_index([("term_keys", ASCENDING), ("_id", ASCENDING)])
+            # Replaced by term_keys; index_result_terms moves old results over
+            if "grams_1" in database.monitoring_results.index_information():
+                database.monitoring_results.drop_index("grams_1")
+            # Full-text search; no language so slang and transliterations aren't stemmed
+            database.monitoring_results.create_index([("message_text", TEXT)], default_language="none")
+            database.channel_stats_hourly.create_index(
+                [("channel_id", ASCENDING), ("hour", ASCENDING)], unique=True
+            )
+            database.known_images.create_index("sha256", unique=True)
+            database.known_images.create_index([("created_at", ASCENDING)])
+            database.alerts.create_index(
+                [("channel_id", ASCENDING), ("status", ASCENDING),
+                 ("created_at", DESCENDING), ("_id", DESCENDING)]
+            )
+            database.alerts.create_index(
+                [("username", ASCENDING), ("status", ASCENDING),
+                 ("created_at", DESCENDING), ("_id", DESCENDING)]
+            )
+        except Exception as e:
+            print(f"⚠️ Could not create indexes: {e}")
+        try:
+            # A database created empty has nothing for the rollups to miss
+            if database.meta.find_one({"_id": STATS_META_KEY}) is None and \
+                    database.monitoring_results.find_one({}, {"_id": 1}) is None:
+                database.meta.update_one(
+                    {"_id": STATS_META_KEY},
+                    {"$setOnInsert": {"complete": True, "updated_at": datetime.utcnow()}}, upsert=True
+                )
+        except Exception as e:
+            print(f"⚠️ Could not check rollup state: {e}")
+
+    def _find_user(self, username):
         return self.users.find_one({"username": username})
 
-    def add_channel(self, username, channel_link, channel_name=None):
-        """Add a channel to monitor"""
-        # Check if channel already exists for this user
-        existing = self.channels.find_one({
+    def _insert_user(self, user_doc):
+        return self.users.insert_one(user_doc).inserted_id
+
+    def _update_user(self, username, fields):
+        return self.users.update_one({"username": username}, {"$set": fields}).modified_count
+
+    def _find_channel_by_link(self, username, channel_link):
+        return self.channels.find_one({
             "username": username,
             "channel_link": channel_link
         })
-        
-        if existing:
-            return str(existing['_id'])
-        
-        # Extract channel name from link if not provided
-        if not channel_name:
-            channel_name = channel_link.split('/')[-1]
-            if channel_name.startswith('@'):
-                channel_name = channel_name[1:]
-        
-        channel_doc = {
-            "username": username,
-            "channel_link": channel_link,
-            "channel_name": channel_name,
-            "status": "active",
-            "added_at": datetime.utcnow(),
-            "last_monitored": None
-        }
-        
-        result = self.channels.insert_one(channel_doc)
-        return str(result.inserted_id)
+
+    def _insert_channel(self, channel_doc):
+        return self.channels.insert_one(channel_doc).inserted_id
+
+    def _insert_result(self, result_doc):
+        return self.monitoring_results.insert_one(result_doc).inserted_id
+
+    def _insert_alert(self, alert_doc):
+        return self.alerts.insert_one(alert_doc).inserted_id
+
+    def _insert_alerts(self, alert_docs):
+        return len(self.alerts.insert_many(alert_docs, ordered=False).inserted_ids)
+
+    def _inc_channel_stats(self, increments):
+        operations = [({"channel_id": channel_id, "hour": hour}, {"$inc": counters})
+                      for (channel_id, hour), counters in increments.items()]
+        if len(operations) == 1:
+            self.channel_stats_hourly.update_one(*operations[0], upsert=True)
+        else:
+            self.channel_stats_hourly.bulk_write(
+                [UpdateOne(query, update, upsert=True) for query, update in operations], ordered=False
+            )
+
+    def _find_channel_stats(self, channel_ids, start=None, end=None):
+        query = {"channel_id": {"$in": list(channel_ids)}}
+        if start or end:
+            query["hour"] = {}
+            if start:
+                query["hour"]["$gte"] = start
+            if end:
+                query["hour"]["$lt"] = end
+        for doc in self.channel_stats_hourly.find(query):
+            counters = {"total": doc.get("total", 0), "confidence_sum": doc.get("confidence_sum", 0.0)}
+            for group in ("predictions", "categories", "terms"):
+                for name, value in doc.get(group, {}).items():
+                    counters[f"{group}.{name}"] = value
+            yield doc["channel_id"], doc["hour"], counters
+
+    def clear_channel_stats(self):
+        return self.channel_stats_hourly.delete_many({}).deleted_count
+
+    def _add_term_words(self, words):
+        # The word is the _id, so the vocabulary needs no index of its own
+        now = datetime.utcnow()
+        self.term_words.bulk_write(
+            [UpdateOne({"_id": word}, {"$setOnInsert": {"added_at": now}}, upsert=True) for word in words],
+            ordered=False
+        )
+
+    def _find_term_words(self, word, limit):
+        # An unanchored regex walks the whole _id index, but never the documents
+        return [doc["_id"] for doc in self.term_words.find({"_id": {"$regex": re.escape(word)}}, {"_id": 1})
+                .limit(limit)]
+
+    def _get_meta(self, key):
+        return self.meta.find_one({"_id": key})
+
+    def _set_meta(self, key, doc):
+        self.meta.update_one({"_id": key}, {"$set": doc}, upsert=True)
+
+    def _insert_known_image(self, image_doc):
+        result = self.known_images.update_one(
+            {"sha256": image_doc["sha256"]}, {"$setOnInsert": image_doc}, upsert=True
+        )
+        if result.upserted_id is None:
+            return False
+        image_doc["_id"] = result.upserted_id
+        return True
+
+    def iter_known_images(self, since=None):
+        query = {"created_at": {"$gt": since}} if since else {}
+        yield from self.known_images.find(query).sort([("created_at", ASCENDING), ("_id", ASCENDING)])
 
     def get_user_channels(self, username):
         """Get all channels for a user"""
         return list(self.channels.find({"username": username}))
 
-    def save_monitoring_result(self, channel_id, message_data):
-        """Save monitoring results"""
-        result_doc = {
-            "channel_id": channel_id,
-            "message_id": message_data.get("message_id"),
-            "sender_id": message_data.get("sender_id"),
-            "date": message_data.get("date"),
-            "message_text": message_data.get("message_text"),
-            "prediction": message_data.get("prediction"),
-            "confidence": message_data.get("confidence"),
-            "is_suspicious": message_data.get("prediction") == "drug sale",
-            "processed_at": datetime.utcnow()
-        }
-        
-        result = self.monitoring_results.insert_one(result_doc)
-        
-        # Create alert if suspicious
-        if message_data.get("prediction") == "drug sale":
-            self.create_alert(channel_id, result_doc)
+    def get_channel(self, channel_id, username=None):
+        """Get a channel by id (optionally requiring an owner)"""
+        try:
+            query = {"_id": ObjectId(channel_id)}
+        except (InvalidId, TypeError):
+            return None
+        if username:
+            query["username"] = username
+        return self.channels.find_one(query)
+
+    def remove_channel(self, channel_id, username):
+        """Delete a user's channel together with its results and alerts"""
+        try:
+            result = self.channels.delete_one({'_id': ObjectId(channel_id), 'username': username})
+        except (InvalidId, TypeError):
+            return False
         
-        return str(result.inserted_id)
-
-    def create_alert(self, channel_id, message_data):
-        """Create an alert for suspicious activity"""
-        alert_doc = {
-            "channel_id": channel_id,
-            "message_id": message_data.get("message_id"),
-            "alert_type": "drug_sale_detected",
-            "confidence": message_data.get("confidence"),
-            "message_text": message_data.get("message_text"),
-            "status": "new",
-            "created_at": datetime.utcnow()
-        }
+        if result.deleted_count == 0:
+            return False
         
-        return self.alerts.insert_one(alert_doc)
+        self.monitoring_results.delete_many({'channel_id': channel_id})
+        self.alerts.delete_many({'channel_id': channel_id})
+        self.channel_stats_hourly.delete_many({'channel_id': channel_id})
+        self.channel_owner_cache.invalidate(channel_id)
+        return True
 
     def get_monitoring_results(self, channel_id, limit=100):
         """Get monitoring results for a channel"""
         return list(self.monitoring_results.find(
-            {"channel_id": channel_id}
+            {"channel_id": channel_id}, RESULT_PROJECTION
         ).sort("processed_at", -1).limit(limit))
 
     def get_all_monitoring_results(self, channel_id):
         """Get all monitoring results for a channel (no limit)"""
         return list(self.monitoring_results.find({
             "channel_id": channel_id
-        }).sort("processed_at", -1))
+        }, RESULT_PROJECTION).sort("processed_at", -1))
 
-    def get_alerts(self, username, status="new"):
-        """Get alerts for user's channels"""
-        user_channels = self.get_user_channels(username)
-        channel_ids = [str(channel['_id']) for channel in user_channels]
-        
-        query = {"channel_id": {"$in": channel_ids}}
+    def iter_monitoring_results(self, channel_id, fields=None, batch_size=EXPORT_BATCH_SIZE,
+                                date_from=None, date_to=None):
+        """Stream a channel's results newest first, fetching batch_size documents
+        at a time; fields limits each document to those top-level fields and
+        date_from/date_to filter on the message date as paging does"""
+        projection = {field: 1 for field in fields} if fields else RESULT_PROJECTION
+        query = _result_filters({"channel_id": channel_id}, date_from=date_from, date_to=date_to)
+        # Served in index order by the (channel_id, processed_at, _id) index, no in-memory sort
+        cursor = self.monitoring_results.find(query, projection).sort(
+            [("processed_at", DESCENDING), ("_id", DESCENDING)]
+        ).batch_size(batch_size)
+        try:
+            yield from cursor
+        finally:
+            # Release the server-side cursor if the consumer stops early
+            cursor.close()
+
+    def iter_changed_results(self, channel_id, since=None, until=None, fields=None,
+                             batch_size=EXPORT_BATCH_SIZE, date_from=None, date_to=None):
+        """Stream a channel's results added or changed after the (updated_at, _id)
+        position since and at or before until, oldest change first"""
+        projection = {field: 1 for field in fields} if fields else RESULT_PROJECTION
+        query = _result_filters({"channel_id": channel_id}, date_from=date_from, date_to=date_to)
+        if until:
+            query["updated_at"] = {"$lte": until}
+        if since:
+            timestamp, doc_id = since
+            query["$or"] = [{"updated_at": {"$gt": timestamp}},
+                            {"updated_at": timestamp, "_id": {"$gt": doc_id}}]
+        cursor = self.monitoring_results.find(query, projection).sort(
+            [("updated_at", ASCENDING), ("_id", ASCENDING)]
+        ).batch_size(batch_size)
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def backfill_result_updated_at(self):
+        """Give results saved before updated_at existed updated_at = processed_at;
+        returns the number updated"""
+        result = self.monitoring_results.update_many(
+            {"updated_at": {"$exists": False}}, [{"$set": {"updated_at": "$processed_at"}}]
+        )
+        return result.modified_count
+
+    def get_monitoring_results_page(self, channel_id, cursor=None, limit=None, prediction=None,
+                                    min_confidence=None, date_from=None, date_to=None):
+        """Get one page of results (newest first) using (processed_at, _id) keyset pagination,
+        or (date, _id) when filtered by date so the range is read from an index.
+        Returns (results, next_cursor); next_cursor is None on the last page."""
+        limit = clamp_page_size(limit)
+        key = page_key(date_from, date_to)
+        query = _result_filters({"channel_id": channel_id}, prediction, min_confidence, date_from, date_to)
+        query = _keyset_query(query, key, cursor)
+        results = list(self.monitoring_results.find(query, RESULT_PROJECTION)
+                       .sort([(key, DESCENDING), ("_id", DESCENDING)])
+                       .limit(limit + 1))
+        return page_with_cursor(results, limit, key)
+
+    def count_results(self, channel_id, prediction=None, compacted=None):
+        """Count a channel's results, optionally for a single prediction label
+        and only compacted stubs (compacted=True) or only full results (False)"""
+        query = {"channel_id": channel_id}
+        if prediction:
+            query["prediction"] = prediction
+        if compacted is not None:
+            query["compacted"] = True if compacted else {"$ne": True}
+        return self.monitoring_results.count_documents(query)
+
+    def search_results(self, query, channel_ids, prediction=None, min_confidence=None,
+                       date_from=None, date_to=None, offset=0, limit=None):
+        """$text search, ranked by textScore; every term is quoted so all must match"""
+        phrases = parse_search_query(query)
+        if not phrases or not channel_ids:
+            return [], False
+        limit = clamp_page_size(limit)
+        offset = max(0, min(int(offset or 0), SEARCH_MAX_DEPTH))
+
+        text_query = _result_filters({
+            "$text": {"$search": " ".join(f'"{phrase}"' for phrase in phrases)},
+            "channel_id": {"$in": list(channel_ids)}
+        }, prediction, min_confidence, date_from, date_to)
+        results = list(self.monitoring_results.find(
+            text_query, dict(RESULT_PROJECTION, score={"$meta": "textScore"})
+        ).sort([("score", {"$meta": "textScore"}), ("processed_at", DESCENDING)])
+         .skip(offset).limit(limit + 1))
+        return results[:limit], len(results) > limit
+
+    def compact_results(self, before, expires_at, prediction="normal"):
+        """Strip message text from old results with the given verdict, leaving expiring stubs"""
+        result = self.monitoring_results.update_many(
+            {"prediction": prediction, "processed_at": {"$lt": before}, "compacted": {"$ne": True}},
+            {"$set": {"compacted": True, "expires_at": expires_at},
+             "$unset": {"message_text": "", "term_keys": "", "grams": ""}}
+        )
+        return result.modified_count
+
+    def iter_results_before(self, before, exclude_prediction="normal", batch_size=1000):
+        """Stream results processed before a cutoff (oldest first), skipping one verdict"""
+        return self.monitoring_results.find(
+            {"processed_at": {"$lt": before}, "prediction": {"$ne": exclude_prediction}},
+            RESULT_PROJECTION
+        ).sort([("processed_at", ASCENDING), ("_id", ASCENDING)]).batch_size(batch_size)
+
+    def delete_results(self, result_ids):
+        """Delete results by id; returns the number removed"""
+        return self.monitoring_results.delete_many({"_id": {"$in": list(result_ids)}}).deleted_count
+
+    def purge_expired_results(self, now=None):
+        """Delete compacted stubs whose expires_at has passed (the TTL index does this too)"""
+        now = now or datetime.utcnow()
+        return self.monitoring_results.delete_many({"expires_at": {"$lt": now}}).deleted_count
+
+    def iter_result_batches(self, after_id=None, batch_size=1000):
+        """Stream every result in _id order as lists of up to batch_size documents"""
+        while True:
+            query = {"_id": {"$gt": after_id}} if after_id else {}
+            batch = list(self.monitoring_results.find(query, RESULT_PROJECTION)
+                         .sort("_id", ASCENDING).limit(batch_size))
+            if not batch:
+                return
+            yield batch
+            after_id = batch[-1]["_id"]
+
+    def iter_term_candidate_batches(self, terms, after_id=None, batch_size=1000):
+        """Results whose term keys could contain one of terms, in _id order"""
+        lookups = self._term_lookups(terms)
+        if lookups is None:
+            # A term the index cannot narrow down: every result is a candidate
+            yield from self.iter_result_batches(after_id, batch_size)
+            return
+        if not lookups:
+            return
+        while True:
+            # The _id bound sits in every branch, so each walks (term_keys, _id) from
+            # the last page on and the branches are merged in _id order without a sort
+            position = {"_id": {"$gt": after_id}} if after_id else {}
+            clauses = [dict(position, term_keys={"$all": keys}) for keys in lookups]
+            batch = list(self.monitoring_results.find({"$or": clauses}, RESULT_PROJECTION)
+                         .sort("_id", ASCENDING).limit(batch_size))
+            if not batch:
+                return
+            yield batch
+            after_id = batch[-1]["_id"]
+
+    def index_result_terms(self, batch_size=1000):
+        """Add term keys to results stored before the term index (or this version
+        of it) existed"""
+        indexed = 0
+        while True:
+            batch = list(self.monitoring_results.find(
+                {"term_keys": {"$exists": False}, "message_text": {"$type": "string"}},
+                {"message_text": 1}
+            ).limit(batch_size))
+            if not batch:
+                return indexed
+            self.add_term_words(set().union(*(text_words(doc["message_text"]) for doc in batch)))
+            result = self.monitoring_results.bulk_write([
+                UpdateOne({"_id": doc["_id"]}, {"$set": {"term_keys": text_grams(doc["message_text"])},
+                                                "$unset": {"grams": ""}})
+                for doc in batch
+            ], ordered=False)
+            indexed += result.modified_count
+
+    def estimated_result_count(self):
+        return self.monitoring_results.estimated_document_count()
+
+    def bulk_update_results(self, updates):
+        """Apply [(result_id, fields)] $set updates in one unordered bulk write"""
+        if not updates:
+            return 0
+        result = self.monitoring_results.bulk_write(
+            [UpdateOne({"_id": result_id}, {"$set": fields}) for result_id, fields in updates],
+            ordered=False
+        )
+        return result.modified_count
+
+    def delete_new_alerts(self, results):
+        """Delete still-new alerts raised for these result documents"""
+        if not results:
+            return 0
+        return self.alerts.delete_many({
+            "status": "new",
+            "$or": [{"channel_id": r["channel_id"], "message_id": r.get("message_id")} for r in results]
+        }).deleted_count
+
+    def _alerts_query(self, username, status):
+        """Build the alert filter for a user (served by the username/status/created_at index)"""
+        query = {"username": username}
         if status:
             query["status"] = status
-            
-        return list(self.alerts.find(query).sort("created_at", -1))
+        return query
+
+    def backfill_alert_usernames(self):
+        """Write the owning username onto alerts created before it was denormalized.
+        Issues one update per channel; returns the number of alerts updated."""
+        updated = 0
+        for channel in self.channels.find({}, {"username": 1}):
+            result = self.alerts.update_many(
+                {"channel_id": str(channel["_id"]), "username": {"$exists": False}},
+                {"$set": {"username": channel["username"]}}
+            )
+            updated += result.modified_count
+        return updated
+
+    def count_alerts_without_username(self):
+        return self.alerts.count_documents({"username": {"$exists": False}})
+
+    def get_alerts(self, username, status="new", limit=None):
+        """Get alerts for user's channels"""
+        cursor = self.alerts.find(self._alerts_query(username, status)).sort("created_at", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    def get_alerts_page(self, username, status="new", cursor=None, limit=None):
+        """Get one page of alerts (newest first) using (created_at, _id) keyset pagination.
+        Returns (alerts, next_cursor); next_cursor is None on the last page."""
+        limit = clamp_page_size(limit)
+        query = _keyset_query(self._alerts_query(username, status), "created_at", cursor)
+        alerts = list(self.alerts.find(query)
+                      .sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+                      .limit(limit + 1))
+        return page_with_cursor(alerts, limit, "created_at")
+
+    def dismiss_alert(self, alert_id):
+        """Mark an alert as dismissed"""
+        try:
+            result = self.alerts.update_one(
+                {'_id': ObjectId(alert_id)},
+                {'$set': {'status': 'dismissed', 'dismissed_at': datetime.utcnow()}}
+            )
+        except (InvalidId, TypeError):
+            return False
+        return result.matched_count > 0
+
+    def count_alerts(self, username, status="new"):
+        """Count alerts for user's channels"""
+        return self.alerts.count_documents(self._alerts_query(username, status))
+
+    def get_alert_summary(self, username):
+        """Summary counts over all of a user's alerts (by status, high confidence, channels)"""
+        pipeline = [
+            {"$match": self._alerts_query(username, None)},
+            {"$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "new": {"$sum": {"$cond": [{"$eq": ["$status", "new"]}, 1, 0]}},
+                "dismissed": {"$sum": {"$cond": [{"$eq": ["$status", "dismissed"]}, 1, 0]}},
+                "high_confidence": {"$sum": {"$cond": [{"$gt": ["$confidence", 0.8]}, 1, 0]}},
+                "channels": {"$addToSet": "$channel_id"}
+            }}
+        ]
+        rows = list(self.alerts.aggregate(pipeline))
+        if not rows:
+            return {"total": 0, "new": 0, "dismissed": 0, "high_confidence": 0, "channels": 0}
+        row = rows[0]
+        return {
+            "total": row["total"],
+            "new": row["new"],
+            "dismissed": row["dismissed"],
+            "high_confidence": row["high_confidence"],
+            "channels": len(row["channels"])
+        }
 
     def update_channel_status(self, channel_id, status, last_monitored=None):
         """Update channel monitoring status"""
         update_doc = {"status": status}
         if last_monitored:
             update_doc["last_monitored"] = last_monitored
+        
+        # Routes pass channel ids as strings; channels are keyed by ObjectId
+        if isinstance(channel_id, str) and ObjectId.is_valid(channel_id):
+            channel_id = ObjectId(channel_id)
             
         self.channels.update_one(
             {"_id": channel_id},
             {"$set": update_doc}
         )
 
-# Initialize database connection
-db = Database()
+def create_database(backend=None):
+    """Build the storage backend selected by STORAGE_BACKEND (mongo | sqlite).
+    SQLITE_PATH picks the SQLite file; ':memory:' gives a throwaway in-process store."""
+    backend = (backend or os.getenv('STORAGE_BACKEND', 'mongo')).lower()
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteDatabase
+        return SQLiteDatabase(os.getenv('SQLITE_PATH', 'trinetra.db'))
+    if backend == 'mongo':
+        return Database()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+class AsyncDatabase:
+    """Awaitable mirror of the storage API for coroutine code paths.
+    Every backend method is exposed as a coroutine that runs the blocking
+    driver call on a small shared thread pool, so the event loop keeps
+    serving Telegram I/O while writes are in flight."""
+
+    def __init__(self, database, max_workers=ASYNC_DB_WORKERS):
+        self._database = database
+        self._max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        """Create the worker pool on first use"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._max_workers,
+                        thread_name_prefix="async-db"
+                    )
+        return self._executor
+
+    def reset_after_fork(self):
+        """Forget the parent's worker threads (they do not survive fork)"""
+        self._executor = None
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args, **kwargs):
+        """Run any blocking callable on the database thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), functools.partial(func, *args, **kwargs)
+        )
+
+    def __getattr__(self, name):
+        attr = getattr(self._database, name)
+        if not inspect.ismethod(attr):
+            raise AttributeError(f"AsyncDatabase only mirrors storage methods, not '{name}'")
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        return method
+
+# Database handles (no connection is opened until first use)
+db = create_database()
+async_db = AsyncDatabase(db)
+
+def reset_connections_after_fork():
+    """Post-fork hook: give the child process its own client, caches and thread pool"""
+    db.reset_after_fork()
+    async_db.reset_after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_connections_after_fork)
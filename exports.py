@@ -0,0 +1,352 @@
+"""
+Streaming exports of monitoring results
+Rows come from a projected, batched cursor over a channel's live and archived
+results and are written out as they are read; the summary statistics are
+accumulated along the way. Memory stays flat however large the channel is
+and nothing is staged on disk, so the web app can send the stream directly
+as the response body.
+
+Formats: CSV (human-readable report), gzip NDJSON (one JSON result per line)
+and Parquet (typed columns for analytics; needs pyarrow). NDJSON and Parquet
+take an optional projection onto EXPORT_FIELDS.
+
+Every export can also be a delta: with since (an (updated_at, _id) position
+from export_watermark()) only live results added or changed after it are
+written, oldest change first, up to the bound snapshotted when the export
+started.
+"""
+
+import os
+import csv
+import io
+import json
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from retention import iter_channel_results
+from storage import encode_cursor
+
+# Parquet support is optional; without pyarrow only CSV and NDJSON are offered
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Changes newer than this are left to the next delta, so a write timestamped
+# just before an export started but committed after it is not skipped
+EXPORT_WATERMARK_LAG_SECONDS = int(os.getenv('EXPORT_WATERMARK_LAG_SECONDS', '5'))
+_MAX_OBJECT_ID = ObjectId('f' * 24)
+
+# Only these fields are read from each result
+CSV_FIELDS = ("message_id", "sender_id", "date", "message_text", "prediction",
+              "confidence", "keyword_matches", "features", "processed_at")
+
+CSV_HEADER = [
+    "Message ID", "Sender ID", "Date & Time (UTC)", "Message Text",
+    "Prediction", "Confidence (%)", "Keyword Matches", "Categories Matched",
+    "Message Length", "Processed At"
+]
+
+# Rows written per chunk handed to the client
+CSV_CHUNK_ROWS = 500
+
+def format_timestamp(value, missing=""):
+    """Readable UTC timestamp for datetimes, ISO strings and epoch numbers"""
+    if value is None:
+        return missing
+    try:
+        # Handle datetime objects
+        if hasattr(value, 'strftime'):
+            return value.strftime('%Y-%m-%d %H:%M:%S UTC')
+        # Handle string dates
+        if isinstance(value, str):
+            try:
+                parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+                return parsed.strftime('%Y-%m-%d %H:%M:%S UTC')
+            except ValueError:
+                return value  # Use original string if parsing fails
+        # Handle timestamp numbers
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S UTC')
+        return str(value)
+    except Exception as e:
+        print(f"⚠️ Date formatting error: {e}, using raw value")
+        return str(value)
+
+def csv_row(result):
+    """One export row for a result"""
+    # Clean message text (remove newlines that break CSV)
+    message_text = result.get("message_text") or ""
+    message_text = message_text.replace("\r\n", " ").replace("\n", " ").replace("\r", " ")
+
+    # Format confidence as percentage
+    confidence = result.get("confidence", 0)
+    confidence_pct = f"{confidence * 100:.1f}" if isinstance(confidence, (int, float)) else str(confidence)
+
+    # Analysis features stored with the result at detection time
+    keyword_matches = result.get("keyword_matches") or []
+    features = result.get("features")
+    categories_matched = bin(features["category_mask"]).count("1") if features else "N/A"
+
+    return [
+        result.get("message_id") or "N/A",
+        result.get("sender_id") or "N/A",
+        format_timestamp(result.get("date"), "No Date"),
+        message_text or "[No Text]",
+        result.get("prediction") or "unknown",
+        confidence_pct,
+        ", ".join(keyword_matches) if keyword_matches else "None",
+        categories_matched,
+        len(message_text),
+        format_timestamp(result.get("processed_at"), "Unknown")
+    ]
+
+class ExportSummary:
+    """Totals accumulated while rows are exported"""
+
+    def __init__(self):
+        self.total = 0
+        self.predictions = Counter()
+        self.confidence_sum = 0.0
+
+    def add(self, result):
+        self.total += 1
+        self.predictions[result.get("prediction") or "unknown"] += 1
+        confidence = result.get("confidence")
+        if isinstance(confidence, (int, float)):
+            self.confidence_sum += confidence
+
+    def merge(self, other):
+        """Fold another summary's totals into this one"""
+        self.total += other.total
+        self.predictions.update(other.predictions)
+        self.confidence_sum += other.confidence_sum
+
+    @property
+    def avg_confidence(self):
+        return self.confidence_sum / self.total if self.total else 0.0
+
+    def csv_rows(self):
+        """Summary block appended after the exported rows"""
+        percent_base = max(self.total, 1)
+        pad = [""] * (len(CSV_HEADER) - 2)
+        rows = [
+            [],
+            ["=== EXPORT SUMMARY ==="] + [""] * (len(CSV_HEADER) - 1),
+            ["Total Messages", self.total] + pad
+        ]
+        for label, prediction in (("Drug Sale Detected", "drug sale"), ("Normal Messages", "normal"),
+                                  ("Spam Messages", "spam"), ("Other Messages", "other")):
+            count = self.predictions.get(prediction, 0)
+            rows.append([label, count, f"({count / percent_base * 100:.1f}%)"] + pad[1:])
+        rows.extend([
+            ["Average Confidence", f"{self.avg_confidence * 100:.1f}%"] + pad,
+            ["Export Time", datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')] + pad,
+            ["Exported by", "Trinetra Drug Detection System"] + pad
+        ])
+        return rows
+
+def export_watermark(now=None):
+    """Upper bound for an export starting now, as (until, cursor). The cursor
+    is the since value for the next delta export."""
+    until = (now or datetime.utcnow()) - timedelta(seconds=EXPORT_WATERMARK_LAG_SECONDS)
+    return until, encode_cursor(until, _MAX_OBJECT_ID)
+
+def _results(store, channel_id, fields, archive_dir, date_from, date_to, since, until):
+    """Live and archived results newest first or, for a delta, live results
+    changed after since, oldest change first"""
+    if since or until:
+        return store.iter_changed_results(channel_id, since, until, fields,
+                                          date_from=date_from, date_to=date_to)
+    return iter_channel_results(store, channel_id, archive_dir, fields, date_from, date_to)
+
+def iter_csv(store, channel_id, summary=None, archive_dir=None, date_from=None, date_to=None,
+             since=None, until=None):
+    """CSV export of a channel as text chunks, summary last; pass an
+    ExportSummary to read the totals once the stream is exhausted"""
+    summary = summary if summary is not None else ExportSummary()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM so Excel on Windows opens the file as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(CSV_HEADER)
+
+    pending = 0
+    results = _results(store, channel_id, CSV_FIELDS, archive_dir, date_from, date_to, since, until)
+    for result in results:
+        writer.writerow(csv_row(result))
+        summary.add(result)
+        pending += 1
+        if pending >= CSV_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    writer.writerows(summary.csv_rows())
+    yield buffer.getvalue()
+
+# Fields the NDJSON and Parquet exports can project onto, in column order
+EXPORT_FIELDS = ("_id", "channel_id", "message_id", "sender_id", "date", "message_text",
+                 "prediction", "confidence", "is_suspicious", "keyword_matches", "features",
+                 "processed_at", "updated_at")
+
+# Lines compressed per step of a gzip NDJSON export
+NDJSON_CHUNK_ROWS = 500
+
+# Rows per Parquet row group; each group is sent once it is complete
+PARQUET_ROW_GROUP_ROWS = 10000
+
+def parse_export_fields(value):
+    """Field projection from a comma-separated list (all fields if empty)"""
+    if not value:
+        return EXPORT_FIELDS
+    requested = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in EXPORT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown export fields: {', '.join(unknown)}")
+    # Keep the canonical column order whatever order they were asked in
+    return tuple(field for field in EXPORT_FIELDS if field in requested)
+
+def _iter_records(store, channel_id, fields, archive_dir, date_from, date_to, summary, since, until):
+    stored = {field for field in fields if field != "_id"}
+    if summary is not None:
+        stored |= {"prediction", "confidence"}
+    for result in _results(store, channel_id, stored, archive_dir, date_from, date_to, since, until):
+        if summary is not None:
+            summary.add(result)
+        yield {field: result.get(field) for field in fields}
+
+def _ndjson_default(value):
+    if isinstance(value, datetime):
+        # Stored datetimes are naive UTC
+        return value.replace(tzinfo=timezone.utc).isoformat() if value.tzinfo is None else value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Cannot export {type(value).__name__}")
+
+def iter_ndjson_gz(store, channel_id, fields=EXPORT_FIELDS, archive_dir=None,
+                   date_from=None, date_to=None, summary=None, since=None, until=None):
+    """Gzip-compressed NDJSON export of a channel as byte chunks, newest first"""
+    # wbits=31 writes a gzip header and trailer, so the stream is a valid .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    lines = []
+    for record in _iter_records(store, channel_id, fields, archive_dir, date_from, date_to, summary,
+                                since, until):
+        lines.append(json.dumps(record, default=_ndjson_default, ensure_ascii=False))
+        if len(lines) >= NDJSON_CHUNK_ROWS:
+            data = compressor.compress(("\n".join(lines) + "\n").encode("utf-8"))
+            lines = []
+            if data:
+                yield data
+    if lines:
+        yield compressor.compress(("\n".join(lines) + "\n").encode("utf-8"))
+    yield compressor.flush()
+
+def parquet_schema(fields=EXPORT_FIELDS):
+    """Arrow schema for a Parquet export of the given fields"""
+    timestamp = pa.timestamp("us", tz="UTC")
+    types = {
+        "_id": pa.string(),
+        "channel_id": pa.string(),
+        "message_id": pa.int64(),
+        "sender_id": pa.int64(),
+        "date": timestamp,
+        "message_text": pa.string(),
+        "prediction": pa.string(),
+        "confidence": pa.float64(),
+        "is_suspicious": pa.bool_(),
+        "keyword_matches": pa.list_(pa.string()),
+        "features": pa.struct([
+            ("engine_version", pa.string()),
+            ("term_ids", pa.list_(pa.int64())),
+            ("term_positions", pa.list_(pa.int32())),
+            ("category_mask", pa.int32()),
+            ("label_scores", pa.map_(pa.string(), pa.float64()))
+        ]),
+        "processed_at": timestamp,
+        "updated_at": timestamp
+    }
+    return pa.schema([(field, types[field]) for field in fields])
+
+def _parquet_value(field, value):
+    """Coerce legacy value shapes to the column type (None if they don't fit)"""
+    if value is None:
+        return None
+    if field in ("_id", "channel_id"):
+        return str(value)
+    if field in ("message_id", "sender_id") and not isinstance(value, int):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    if field in ("date", "processed_at", "updated_at") and not isinstance(value, datetime):
+        try:
+            return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    return value
+
+class _ChunkSink:
+    """Write-only file object that collects what the Parquet writer emits"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def iter_parquet(store, channel_id, fields=EXPORT_FIELDS, archive_dir=None,
+                 date_from=None, date_to=None, summary=None, since=None, until=None):
+    """Parquet export of a channel as byte chunks, one row group at a time"""
+    if not PARQUET_AVAILABLE:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    schema = parquet_schema(fields)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+
+    def write_group(rows):
+        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        return sink.drain()
+
+    rows = []
+    for record in _iter_records(store, channel_id, fields, archive_dir, date_from, date_to, summary,
+                                since, until):
+        rows.append({field: _parquet_value(field, value) for field, value in record.items()})
+        if len(rows) >= PARQUET_ROW_GROUP_ROWS:
+            yield write_group(rows)
+            rows = []
+    if rows:
+        yield write_group(rows)
+    # The footer (schema and row group index) is written on close
+    writer.close()
+    yield sink.drain()
+
+# Projectable formats: (streaming function, file extension, mimetype)
+EXPORT_FORMATS = {
+    "ndjson": (iter_ndjson_gz, "jsonl.gz", "application/gzip"),
+    "parquet": (iter_parquet, "parquet", "application/vnd.apache.parquet")
+}
@@ -0,0 +1,23 @@
+"""
+Gunicorn configuration for Trinetra
+The app (and the NLP model) is loaded once in the master and workers are
+forked from it. Database connections are opened lazily, and the post_fork
+hook makes sure every worker builds its own MongoClient and starts probing
+Tesseract in the background, so /health never waits for it.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+accesslog = '-'
+errorlog = '-'
+
+def post_fork(server, worker):
+    """Drop any database state inherited from the master and probe Tesseract"""
+    from database import reset_connections_after_fork
+    from ocr import start_tesseract_probe
+    reset_connections_after_fork()
+    start_tesseract_probe()
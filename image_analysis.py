@@ -1,87 +1,214 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from PIL import Image
 import io
+import os
+import math
 import hashlib
 
+# Longest side images are analyzed at; JPEGs at least twice this size are
+# decoded at a reduced scale (draft mode) instead of in full
+ANALYSIS_MAX_SIZE = int(os.getenv('IMAGE_ANALYSIS_MAX_SIZE', '2048'))
+# Uploads with more pixels are rejected from their header, before decoding
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', str(60_000_000)))
 
-def _sha256_bytes(data: bytes) -> str:
+
+class ImageTooLargeError(ValueError):
+	pass
+
+
+def sha256_hex(data: bytes) -> str:
 	sha = hashlib.sha256()
 	sha.update(data)
 	return sha.hexdigest()
 
 
-def analyze_image_bytes(image_bytes: bytes, max_size: int = 2048) -> Dict[str, Any]:
+HIST_BINS = 16
+DOMINANT_COLORS = 5
+# Dominant colours are quantized from a thumbnail no larger than this
+DOMINANT_SAMPLE_SIZE = 128
+
+
+def _band_histograms(im: Image.Image, bins: int) -> List[List[int]]:
+	"""Per-band histograms with `bins` bins each, computed natively by Pillow"""
+	counts = im.histogram()
+	step = 256 // bins
+	return [
+		[sum(counts[band + i:band + i + step]) for i in range(0, 256, step)]
+		for band in range(0, len(counts), 256)
+	]
+
+
+def _dominant_colors(im: Image.Image, colors: int = DOMINANT_COLORS) -> List[Dict[str, Any]]:
+	"""Most common colours of an RGB image with their share of the pixels"""
+	sample = im.copy()
+	sample.thumbnail((DOMINANT_SAMPLE_SIZE, DOMINANT_SAMPLE_SIZE))
+	quantized = sample.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+	palette = quantized.getpalette()
+	total = sample.size[0] * sample.size[1]
+	dominant = []
+	for count, index in sorted(quantized.getcolors(colors), reverse=True):
+		r, g, b = palette[index * 3:index * 3 + 3]
+		dominant.append({"rgb": [r, g, b], "hex": f"#{r:02x}{g:02x}{b:02x}", "share": round(count / total, 4)})
+	return dominant
+
+
+# pHash: DCT of a 32x32 greyscale thumbnail, keeping the 8x8 lowest frequencies
+_PHASH_SIZE = 32
+_PHASH_BITS = 8
+_DCT_COS = [
+	[math.cos((2 * x + 1) * u * math.pi / (2 * _PHASH_SIZE)) for x in range(_PHASH_SIZE)]
+	for u in range(_PHASH_BITS)
+]
+
+
+def _grey_thumbnail(im: Image.Image, size) -> List[int]:
+	# Box-reduce in colour first, so the greyscale conversion touches only the thumbnail
+	return list(im.resize(size, Image.Resampling.BOX).convert("L").getdata())
+
+
+def dhash(im: Image.Image) -> str:
+	"""64-bit difference hash: does each pixel of a 9x8 thumbnail outshine its right neighbour"""
+	pixels = _grey_thumbnail(im, (9, 8))
+	value = 0
+	for row in range(8):
+		for col in range(8):
+			value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+	return f"{value:016x}"
+
+
+def phash(im: Image.Image) -> str:
+	"""64-bit perceptual hash: low-frequency DCT coefficients above or below their median"""
+	pixels = _grey_thumbnail(im, (_PHASH_SIZE, _PHASH_SIZE))
+	rows = [pixels[y * _PHASH_SIZE:(y + 1) * _PHASH_SIZE] for y in range(_PHASH_SIZE)]
+	# Separable DCT: transform the rows, then the columns, low frequencies only
+	row_dct = [[sum(p * c for p, c in zip(row, cos)) for cos in _DCT_COS] for row in rows]
+	coefficients = [
+		sum(row_dct[y][u] * cos[y] for y in range(_PHASH_SIZE))
+		for cos in _DCT_COS for u in range(_PHASH_BITS)
+	]
+	# The DC term is the mean brightness; leave it out of the median
+	median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+	value = 0
+	for coefficient in coefficients:
+		value = (value << 1) | (coefficient > median)
+	return f"{value:016x}"
+
+
+def perceptual_hashes(im: Image.Image) -> Dict[str, str]:
+	"""dHash and pHash as 16-digit hex strings; both survive re-encoding and resizing"""
+	return {"dhash": dhash(im), "phash": phash(im)}
+
+
+def load_image(image_bytes: bytes, max_size: Optional[int] = None) -> Image.Image:
 	"""
-	Analyze an image from raw bytes.
-	- Safely opens via Pillow
-	- Extracts format, size, mode
-	- Generates a content hash
-	- Computes a coarse color histogram (16-bin per channel if RGB)
-	- Optionally downsizes large images to control memory
+	Decode an upload once so every analysis stage can share the pixels.
+	- Rejects images over MAX_IMAGE_PIXELS before any pixel data is decoded
+	- With max_size, lets the JPEG decoder scale down by 1/2, 1/4 or 1/8
+	  while the result stays at least max_size on its longest side
+	  (im.info["original_size"] keeps the uploaded dimensions)
+	load() reads all image data and raises on truncated or corrupt files,
+	which is the check a separate verify() pass used to make.
 	"""
-	info: Dict[str, Any] = {
+	im = Image.open(io.BytesIO(image_bytes))
+	try:
+		width, height = im.size
+		if width * height > MAX_IMAGE_PIXELS:
+			raise ImageTooLargeError(
+				f"Image is {width}x{height}, over the {MAX_IMAGE_PIXELS:,} pixel limit")
+		im.info["original_size"] = im.size
+		if max_size and im.format == "JPEG" and max(im.size) >= 2 * max_size:
+			scale = max_size / float(max(im.size))
+			im.draft(im.mode, (max(1, int(width * scale)), max(1, int(height * scale))))
+		im.load()
+	except Exception:
+		im.close()
+		raise
+	return im
+
+
+def _empty_info(image_bytes: bytes) -> Dict[str, Any]:
+	return {
 		"ok": False,
 		"error": None,
 		"format": None,
 		"size": None,
 		"mode": None,
-		"sha256": None,
+		"sha256": sha256_hex(image_bytes),
+		"dhash": None,
+		"phash": None,
 		"histogram": None
 	}
+
+
+def analyze_image_bytes(image_bytes: bytes, max_size: int = ANALYSIS_MAX_SIZE) -> Dict[str, Any]:
+	"""
+	Analyze an image from raw bytes (decodes it, then see analyze_image).
+	"""
+	try:
+		im = load_image(image_bytes, max_size)
+	except Exception as e:
+		info = _empty_info(image_bytes)
+		info["error"] = str(e)
+		return info
+	with im:
+		return analyze_image(im, image_bytes, max_size)
+
+
+def analyze_image(im: Image.Image, image_bytes: bytes, max_size: int = ANALYSIS_MAX_SIZE,
+				  hashes: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+	"""
+	Analyze an already decoded image (see load_image).
+	- Extracts format, size (as uploaded), mode
+	- Generates a content hash of the original bytes, plus perceptual
+	  hashes (dHash/pHash) of the pixels unless they are passed in
+	- Computes a coarse color histogram (16-bin per channel if RGB),
+	  16-bin HSV histograms and the dominant colours
+	- Works on a downsized copy of large images to control memory;
+	  the shared image itself is left untouched
+	"""
+	info = _empty_info(image_bytes)
 	try:
-		info["sha256"] = _sha256_bytes(image_bytes)
-		with Image.open(io.BytesIO(image_bytes)) as im:
-			# Verify basic integrity
-			im.verify()
-		# Re-open since verify() leaves file in an unusable state for load
-		with Image.open(io.BytesIO(image_bytes)) as im2:
-			im2.load()
-			fmt = im2.format
-			size = im2.size
-			mode = im2.mode
-
-			# Downscale if very large
-			if max(size) > max_size:
-				scale = max_size / float(max(size))
-				new_size = (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
-				im2 = im2.resize(new_size)
-
-			# Compute histogram (coarse)
-			hist_summary: Optional[Dict[str, Any]] = None
-			if mode in ("RGB", "RGBA"):
-				if mode == "RGBA":
-					im3 = im2.convert("RGB")
-				else:
-					im3 = im2
-				# Reduce to 4 bits per channel (16 bins) per channel
-				# Build compact histogram: 16 bins for R,G,B each
-				bins = 16
-				step = 256 // bins
-				r_bins = [0] * bins
-				g_bins = [0] * bins
-				b_bins = [0] * bins
-				for r, g, b in im3.getdata():
-					r_bins[r // step] += 1
-					g_bins[g // step] += 1
-					b_bins[b // step] += 1
-				hist_summary = {
-					"bins": bins,
-					"r": r_bins,
-					"g": g_bins,
-					"b": b_bins
-				}
+		im2 = im
+		fmt = im.format
+		size = im.info.get("original_size", im.size)
+		mode = im.mode
+
+		# Downscale if very large (or still large after a draft decode)
+		if max(im.size) > max_size:
+			scale = max_size / float(max(im.size))
+			new_size = (max(1, int(im.size[0] * scale)), max(1, int(im.size[1] * scale)))
+			im2 = im.resize(new_size)
+
+		# Compute histogram (coarse)
+		hist_summary: Optional[Dict[str, Any]] = None
+		if mode in ("RGB", "RGBA"):
+			if mode == "RGBA":
+				im3 = im2.convert("RGB")
 			else:
-				# For other modes, fallback to global histogram length
-				h = im2.histogram()
-				hist_summary = {"length": len(h)}
-
-			info.update({
-				"ok": True,
-				"format": fmt,
-				"size": size,
-				"mode": mode,
-				"histogram": hist_summary
-			})
+				im3 = im2
+			# 16 bins per channel, summed from Pillow's native 256-bin histogram
+			r_bins, g_bins, b_bins = _band_histograms(im3, HIST_BINS)
+			hist_summary = {
+				"bins": HIST_BINS,
+				"r": r_bins,
+				"g": g_bins,
+				"b": b_bins,
+				"hsv": dict(zip(("h", "s", "v"), _band_histograms(im3.convert("HSV"), HIST_BINS))),
+				"dominant_colors": _dominant_colors(im3)
+			}
+		else:
+			# For other modes, fallback to global histogram length
+			h = im2.histogram()
+			hist_summary = {"length": len(h)}
+
+		info.update(hashes or perceptual_hashes(im))
+		info.update({
+			"ok": True,
+			"format": fmt,
+			"size": size,
+			"mode": mode,
+			"histogram": hist_summary
+		})
 	except Exception as e:
 		info["ok"] = False
 		info["error"] = str(e)
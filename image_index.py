@@ -0,0 +1,136 @@
+"""
+Perceptual-hash index of known drug advertisement images
+Sellers recycle the same product photos across channels, re-encoded, resized
+or lightly cropped, which changes their SHA-256 but barely moves their pHash.
+Known images are kept in the known_images collection and, per process, in a
+multi-index hash table keyed on pHash, so a lookup probes a few hundred
+buckets instead of comparing against every known image.
+
+Every process loads the collection on first use and picks up images added by
+other workers every KNOWN_IMAGE_REFRESH_SECONDS.
+"""
+
+import os
+import time
+import threading
+from datetime import timedelta
+
+KNOWN_IMAGE_MAX_DISTANCE = int(os.getenv('KNOWN_IMAGE_MAX_DISTANCE', '8'))
+KNOWN_IMAGE_REFRESH_SECONDS = float(os.getenv('KNOWN_IMAGE_REFRESH_SECONDS', '30'))
+
+# Re-read this far behind the newest image seen, for inserts that committed late
+_SYNC_OVERLAP = timedelta(seconds=60)
+
+def hamming(a, b):
+    """Number of differing bits between two integer hashes"""
+    return bin(a ^ b).count("1")
+
+class MultiIndexHashTable:
+    """Exact-radius Hamming search over 64-bit hashes (multi-index hashing).
+
+    Each hash is filed under its four 16-bit chunks. Two hashes within r bits
+    differ by at most r // 4 bits in at least one chunk, so probing every
+    chunk value within r // 4 bits of the query's finds all candidates,
+    which are then checked on the full hash.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self._tables = [{} for _ in range(self.CHUNKS)]
+        self._flip_masks = {}
+        self.size = 0
+
+    def _chunks(self, key):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(key >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def _masks(self, radius):
+        """Every chunk-sized mask with at most radius bits set"""
+        if radius not in self._flip_masks:
+            masks = {0}
+            for _ in range(radius):
+                masks |= {m | (1 << bit) for m in masks for bit in range(self.CHUNK_BITS)}
+            self._flip_masks[radius] = sorted(masks)
+        return self._flip_masks[radius]
+
+    def add(self, key, item):
+        self.size += 1
+        for table, chunk in zip(self._tables, self._chunks(key)):
+            table.setdefault(chunk, []).append((key, item))
+
+    def search(self, key, max_distance):
+        """[(distance, item)] for every item within max_distance, nearest first"""
+        masks = self._masks(max_distance // self.CHUNKS)
+        found = {}
+        for table, chunk in zip(self._tables, self._chunks(key)):
+            for mask in masks:
+                for candidate, item in table.get(chunk ^ mask, ()):
+                    if id(item) not in found:
+                        distance = hamming(key, candidate)
+                        if distance <= max_distance:
+                            found[id(item)] = (distance, item)
+        return sorted(found.values(), key=lambda match: match[0])
+
+class KnownImageIndex:
+    """Known advertisement images of one storage backend, searchable by pHash"""
+
+    def __init__(self, store, max_distance=KNOWN_IMAGE_MAX_DISTANCE,
+                 refresh_seconds=KNOWN_IMAGE_REFRESH_SECONDS):
+        self.store = store
+        self.max_distance = max_distance
+        self.refresh_seconds = refresh_seconds
+        self._table = MultiIndexHashTable()
+        self._sha256s = set()
+        self._synced_to = None
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    def _add_local(self, image_doc):
+        if image_doc["sha256"] in self._sha256s:
+            return
+        self._sha256s.add(image_doc["sha256"])
+        self._table.add(int(image_doc["phash"], 16), image_doc)
+
+    def _refresh(self):
+        """Load images added since the last sync (all of them the first time)"""
+        now = time.monotonic()
+        if self._synced_at is not None and now - self._synced_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if self._synced_at is not None and now - self._synced_at < self.refresh_seconds:
+                return
+            since = self._synced_to - _SYNC_OVERLAP if self._synced_to else None
+            for image_doc in self.store.iter_known_images(since):
+                self._add_local(image_doc)
+                self._synced_to = max(self._synced_to or image_doc["created_at"], image_doc["created_at"])
+            self._synced_at = now
+
+    def __len__(self):
+        self._refresh()
+        return self._table.size
+
+    def lookup(self, image_info):
+        """Known images within max_distance of an analyzed image's pHash, nearest first"""
+        self._refresh()
+        phash, dhash = int(image_info["phash"], 16), int(image_info["dhash"], 16)
+        with self._lock:
+            matches = self._table.search(phash, self.max_distance)
+        return [{
+            "id": str(image_doc["_id"]),
+            "sha256": image_doc["sha256"],
+            "label": image_doc.get("label"),
+            "distance": distance,
+            "dhash_distance": hamming(dhash, int(image_doc["dhash"], 16))
+        } for distance, image_doc in matches]
+
+    def add(self, image_info, label, confidence=None, source=None, username=None):
+        """Persist an analyzed image as known and index it in this process;
+        False if it was known already"""
+        image_doc = self.store.add_known_image(image_info, label, confidence, source, username)
+        if image_doc is None:
+            return False
+        with self._lock:
+            self._add_local(image_doc)
+        return True
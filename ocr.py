@@ -1,77 +1,382 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from PIL import Image
 import io
 import os
+import hashlib
+import subprocess
 import sys
+import time
+import threading
+
+from cache import SQLiteLRUCache
+import ocr_preprocess
+
+# Tesseract processes per web worker; each job runs one as a subprocess
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '2'))
+# Jobs allowed to wait for a worker; beyond that submissions are rejected
+OCR_QUEUE_SIZE = int(os.getenv('OCR_QUEUE_SIZE', '8'))
+# A job (queue wait included) is abandoned this long after it was submitted
+OCR_TIMEOUT_SECONDS = float(os.getenv('OCR_TIMEOUT_SECONDS', '30'))
+
+# OCR results by (image sha256, language, preprocessing version, decoded size); empty path disables
+OCR_CACHE_PATH = os.getenv('OCR_CACHE_PATH', os.path.join('temp', 'ocr_cache.db'))
+OCR_CACHE_SIZE = int(os.getenv('OCR_CACHE_SIZE', '50000'))
+# Greyscale, rescale, binarize and OCR only text-like regions (see ocr_preprocess).
+# benchmark_ocr.py: same word recall as whole-image OCR, under half the Tesseract time
+OCR_PREPROCESS = os.getenv('OCR_PREPROCESS', 'true').lower() == 'true'
+# Part of every cache key, so changing preprocessing never serves stale text
+OCR_PREPROCESS_VERSION = ocr_preprocess.VERSION if OCR_PREPROCESS else 1
+
+ocr_cache = SQLiteLRUCache(OCR_CACHE_PATH, OCR_CACHE_SIZE, name="ocr") if OCR_CACHE_PATH else None
 
 try:
 	import pytesseract
-	_TESS_AVAILABLE = True
-	
-	# Configure Tesseract for cross-platform compatibility
-	try:
-		# Check if we're running on Windows or Linux
-		if os.name == 'nt':  # Windows
-			# Try local Windows tesseract.exe first
-			candidates = [
-				os.path.join(os.getcwd(), 'tesseract.exe'),
-				os.path.join(os.getcwd(), 'Tesseract-OCR', 'tesseract.exe'),
-				os.path.join(os.getcwd(), 'bin', 'tesseract.exe')
-			]
-			for candidate in candidates:
-				if os.path.exists(candidate):
-					pytesseract.pytesseract.tesseract_cmd = candidate
-					print(f"✅ Found Windows Tesseract binary at: {candidate}")
-					break
-			else:
-				print("⚠️ No local tesseract.exe found, using system PATH")
-		else:  # Linux/Unix (Docker/Render)
-			# On Linux, tesseract should be available via system PATH
-			try:
-				# Test if tesseract is available
-				import subprocess
-				result = subprocess.run(['tesseract', '--version'], 
-				                      capture_output=True, text=True, timeout=10)
-				if result.returncode == 0:
-					print(f"✅ Found system Tesseract: {result.stdout.split()[1] if result.stdout else 'Unknown version'}")
-					# Set TESSDATA_PREFIX if available
-					tessdata_prefix = os.environ.get('TESSDATA_PREFIX')
-					if tessdata_prefix:
-						print(f"✅ Using TESSDATA_PREFIX: {tessdata_prefix}")
-				else:
-					print("❌ System tesseract not working properly")
-					_TESS_AVAILABLE = False
-			except (subprocess.TimeoutExpired, subprocess.CalledProcessError, FileNotFoundError) as e:
-				print(f"❌ Tesseract not found on system: {e}")
-				_TESS_AVAILABLE = False
-	except Exception as e:
-		print(f"⚠️ Tesseract configuration error: {e}")
-		pass
 except Exception as e:
 	print(f"❌ Failed to import pytesseract: {e}")
-	_TESS_AVAILABLE = False
+	pytesseract = None
+
+# Seconds each `tesseract --version` / `--list-langs` call of the engine probe may take
+TESSERACT_PROBE_TIMEOUT = 10
+TESSERACT_NOT_FOUND = "Tesseract binary not found. Install Tesseract and ensure it's in PATH or place tesseract.exe in project root/Tesseract-OCR/."
+
+# Filled by the first tesseract_info() call, not at import: workers and scripts
+# that never OCR do not pay for starting tesseract
+_tesseract_info: Optional[Dict[str, Any]] = None
+_probe_lock = threading.Lock()
+# Process that started the background probe (see start_tesseract_probe)
+_probe_started_pid: Optional[int] = None
+
+
+def _local_windows_tesseract() -> Optional[str]:
+	candidates = [
+		os.path.join(os.getcwd(), 'tesseract.exe'),
+		os.path.join(os.getcwd(), 'Tesseract-OCR', 'tesseract.exe'),
+		os.path.join(os.getcwd(), 'bin', 'tesseract.exe')
+	]
+	for candidate in candidates:
+		if os.path.exists(candidate):
+			return candidate
+	return None
+
+
+def _probe_tesseract() -> Dict[str, Any]:
+	info = {
+		"available": False,
+		"pytesseract": pytesseract is not None,
+		"binary": None,
+		"version": None,
+		"languages": [],
+		"tessdata_prefix": os.environ.get('TESSDATA_PREFIX'),
+		"error": None
+	}
+	if pytesseract is None:
+		info["error"] = "pytesseract not installed"
+		return info
+	# On Windows a tesseract.exe shipped next to the app wins over PATH
+	if os.name == 'nt':
+		local = _local_windows_tesseract()
+		if local:
+			pytesseract.pytesseract.tesseract_cmd = local
+	info["binary"] = pytesseract.pytesseract.tesseract_cmd
+	try:
+		version = subprocess.run([info["binary"], '--version'], capture_output=True, text=True,
+								 timeout=TESSERACT_PROBE_TIMEOUT)
+		if version.returncode != 0:
+			info["error"] = f"tesseract --version exited with {version.returncode}"
+			return info
+		# Tesseract 3 prints its version to stderr
+		words = (version.stdout or version.stderr).split()
+		info["version"] = words[1] if len(words) > 1 else None
+		languages = subprocess.run([info["binary"], '--list-langs'], capture_output=True, text=True,
+								   timeout=TESSERACT_PROBE_TIMEOUT)
+		# First line is "List of available languages in ... (N):"
+		lines = (languages.stdout or languages.stderr).splitlines()[1:]
+		info["languages"] = sorted(line.strip() for line in lines if line.strip())
+		info["available"] = True
+	except FileNotFoundError:
+		info["error"] = TESSERACT_NOT_FOUND
+	except subprocess.TimeoutExpired:
+		info["error"] = f"tesseract did not answer within {TESSERACT_PROBE_TIMEOUT}s"
+	except OSError as e:
+		info["error"] = str(e)
+	return info
+
+
+def tesseract_info() -> Dict[str, Any]:
+	"""
+	What this process can OCR with: available, binary, version, installed
+	languages (and the error if Tesseract is unusable). Tesseract is probed
+	once, on the first call, and the report is reused afterwards.
+	"""
+	global _tesseract_info
+	if _tesseract_info is None:
+		with _probe_lock:
+			if _tesseract_info is None:
+				t0 = time.perf_counter()
+				info = _probe_tesseract()
+				info["probe_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+				if info["available"]:
+					print(f"✅ Found Tesseract {info['version']} at {info['binary']} "
+						  f"({len(info['languages'])} languages)")
+				else:
+					print(f"❌ Tesseract unavailable: {info['error']}")
+				_tesseract_info = info
+	return _tesseract_info
+
+
+def start_tesseract_probe() -> None:
+	"""Probe Tesseract in a background thread, once per process"""
+	global _probe_started_pid
+	if _tesseract_info is not None or _probe_started_pid == os.getpid():
+		return
+	_probe_started_pid = os.getpid()
+	threading.Thread(target=tesseract_info, name='tesseract-probe', daemon=True).start()
+
+
+def tesseract_status() -> Dict[str, Any]:
+	"""
+	tesseract_info() once the probe has finished, else {"status": "probing"}
+	after starting it in the background. Never waits on tesseract, so health
+	checks stay fast.
+	"""
+	if _tesseract_info is not None:
+		return _tesseract_info
+	start_tesseract_probe()
+	return {"status": "probing"}
+
+
+def _engine() -> Dict[str, bool]:
+	# Result flags only report what is known; they never start the probe themselves
+	if _tesseract_info is not None:
+		return {"pytesseract": _tesseract_info["available"]}
+	return {"pytesseract": pytesseract is not None}
+
+
+def _cache_key(sha256: str, lang: str, size: Tuple[int, int]) -> str:
+	# The same upload OCRs differently when draft-decoded at a smaller size
+	return f"{sha256}:{lang}:{OCR_PREPROCESS_VERSION}:{size[0]}x{size[1]}"
+
+
+def _cached_result(sha256: Optional[str], lang: str, size: Tuple[int, int]) -> Optional[Dict[str, Any]]:
+	if ocr_cache is None or not sha256:
+		return None
+	text = ocr_cache.get(_cache_key(sha256, lang, size))
+	if text is None:
+		return None
+	return {"ok": True, "text": text, "error": None, "engine": _engine(), "cached": True}
+
+
+def _store_result(sha256: Optional[str], lang: str, size: Tuple[int, int], result: Dict[str, Any]) -> None:
+	# Only successful runs: a missing binary or a broken image is not a property of the image
+	if ocr_cache is not None and sha256 and result["ok"]:
+		ocr_cache.set(_cache_key(sha256, lang, size), result["text"])
 
 
 def extract_text_from_image_bytes(image_bytes: bytes, lang: str = 'eng') -> Dict[str, Any]:
 	"""
 	Extract text from image bytes using Tesseract OCR via pytesseract.
 	Returns dict with ok, text, error, engine flags. Gracefully handles missing tesseract binary.
+	Repeated images are answered from the OCR cache after reading only their
+	header; others are decoded at full size and wait for a slot in the OCR pool.
+	"""
+	from image_analysis import load_image
+	sha256 = hashlib.sha256(image_bytes).hexdigest()
+	try:
+		# Opening reads the header only; full decodes are cached under the image's own size
+		with Image.open(io.BytesIO(image_bytes)) as header:
+			size = header.size
+		cached = _cached_result(sha256, lang, size)
+		if cached is not None:
+			return cached
+		with load_image(image_bytes) as im:
+			return extract_text_from_image(im, lang, sha256)
+	except Exception as e:
+		return _error_result(str(e))
+
+
+def extract_text_from_image(im: Image.Image, lang: str = 'eng', sha256: Optional[str] = None) -> Dict[str, Any]:
+	"""
+	OCR an already decoded image (same result dict as extract_text_from_image_bytes),
+	waiting for a slot in the OCR pool. The image is only read, so it can be
+	shared with other analysis stages. Pass the upload's sha256 to use the OCR cache.
 	"""
-	result: Dict[str, Any] = {"ok": False, "text": "", "error": None, "engine": {"pytesseract": _TESS_AVAILABLE}}
-	if not _TESS_AVAILABLE:
-		result["error"] = "pytesseract not installed"
+	try:
+		return ocr_pool.submit(im, lang, sha256, block=True).result()
+	except OCRQueueFullError as e:
+		return _error_result(str(e))
+
+
+def _error_result(error: str) -> Dict[str, Any]:
+	return {"ok": False, "text": "", "error": error, "engine": _engine()}
+
+
+def _run_tesseract(im: Image.Image, lang: str, timeout: float = 0) -> Dict[str, Any]:
+	engine = tesseract_info()
+	result = _error_result(engine["error"])
+	if not engine["available"]:
 		return result
 	try:
-		with Image.open(io.BytesIO(image_bytes)) as im:
-			# Convert to RGB to normalize
-			img = im.convert('RGB')
-			text = pytesseract.image_to_string(img, lang=lang)
-			result["ok"] = True
-			result["text"] = text.strip()
-			return result
+		jobs = ocr_preprocess.ocr_plan(im) if OCR_PREPROCESS else []
+		if OCR_PREPROCESS:
+			result["regions"] = len(jobs)
+		if not jobs:
+			# No preprocessing, or no block looked like text (low contrast, very large
+			# glyphs): OCR the whole image rather than drop what the detector missed
+			jobs = [(im if im.mode == 'RGB' else im.convert('RGB'), None)]
+		deadline = time.perf_counter() + timeout if timeout else None
+		texts = []
+		for image, psm in jobs:
+			remaining = deadline - time.perf_counter() if deadline else 0
+			if deadline and remaining <= 0:
+				raise RuntimeError("Tesseract process timeout")
+			# pytesseract kills the tesseract process once the time left runs out
+			text = pytesseract.image_to_string(image, lang=lang, config=f'--psm {psm}' if psm else '',
+											   timeout=remaining)
+			if text.strip():
+				texts.append(text.strip())
+		result["ok"] = True
+		result["text"] = "\n".join(texts)
+		return result
 	except pytesseract.TesseractNotFoundError:
-		result["error"] = "Tesseract binary not found. Install Tesseract and ensure it's in PATH or place tesseract.exe in project root/Tesseract-OCR/."
+		result["error"] = TESSERACT_NOT_FOUND
+		return result
+	except RuntimeError as e:
+		result["error"] = "OCR timed out" if "timeout" in str(e).lower() else str(e)
 		return result
 	except Exception as e:
 		result["error"] = str(e)
 		return result
+
+
+class OCRQueueFullError(RuntimeError):
+	pass
+
+
+def _percentiles(samples) -> Dict[str, float]:
+	if not samples:
+		return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+	ordered = sorted(samples)
+	return {
+		"avg": round(sum(ordered) / len(ordered), 1),
+		"p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+		"max": round(ordered[-1], 1)
+	}
+
+
+class OCRPool:
+	"""
+	Fixed pool of OCR threads with a bounded queue.
+	- At most workers + queue_size jobs are in flight; further submissions are
+	  rejected (OCRQueueFullError) or, with block=True, wait for a slot
+	- Every job must finish within timeout seconds of its submission: queue
+	  wait counts against it, and tesseract is killed when the rest runs out
+	- Queue-wait and run-time metrics over the last 1000 jobs, for sizing
+	  OCR_WORKERS to the host's cores
+	Threads are started lazily, so forked web workers each get their own.
+	"""
+
+	def __init__(self, workers: int = OCR_WORKERS, queue_size: int = OCR_QUEUE_SIZE,
+				 timeout: float = OCR_TIMEOUT_SECONDS):
+		self.workers = workers
+		self.queue_size = queue_size
+		self.timeout = timeout
+		self._lock = threading.Lock()
+		self._executor = None
+		self._slots = None
+		self._pid = None
+		self._queue_waits = deque(maxlen=1000)
+		self._run_times = deque(maxlen=1000)
+		self.in_flight = 0
+		self.counters = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "timeouts": 0}
+
+	def _get_executor(self):
+		with self._lock:
+			if self._executor is None or self._pid != os.getpid():
+				self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocr')
+				self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+				self._pid = os.getpid()
+				self.in_flight = 0
+			return self._executor, self._slots
+
+	def _count(self, counter: str) -> None:
+		with self._lock:
+			self.counters[counter] += 1
+
+	def _acquired(self, slots, amount: int) -> None:
+		with self._lock:
+			self.in_flight += amount
+		if amount < 0:
+			slots.release()
+
+	def submit(self, im: Image.Image, lang: str = 'eng', sha256: Optional[str] = None,
+			   block: bool = False) -> Future:
+		"""
+		OCR im in the background; the future's result is the usual result dict
+		plus queue_wait_ms and elapsed_ms. Cached images resolve immediately
+		without taking a slot.
+		"""
+		cached = _cached_result(sha256, lang, im.size)
+		if cached is not None:
+			future: Future = Future()
+			future.set_result(dict(cached, queue_wait_ms=0.0, elapsed_ms=0.0))
+			return future
+
+		executor, slots = self._get_executor()
+		if not slots.acquire(blocking=block, timeout=self.timeout if block else None):
+			self._count("rejected")
+			raise OCRQueueFullError(f"OCR queue full ({self.workers} running, {self.queue_size} waiting)")
+		self._count("submitted")
+		self._acquired(slots, 1)
+		try:
+			future = executor.submit(self._job, im, lang, sha256, time.perf_counter())
+		except Exception:
+			self._acquired(slots, -1)
+			raise
+		# Also frees the slot of a job cancelled while it was still queued
+		future.add_done_callback(lambda _: self._acquired(slots, -1))
+		return future
+
+	def _job(self, im: Image.Image, lang: str, sha256: Optional[str], submitted_at: float) -> Dict[str, Any]:
+		started = time.perf_counter()
+		remaining = self.timeout - (started - submitted_at)
+		if remaining <= 0:
+			result = _error_result("OCR timed out")
+		else:
+			result = _run_tesseract(im, lang, remaining)
+			_store_result(sha256, lang, im.size, result)
+		finished = time.perf_counter()
+
+		with self._lock:
+			self._queue_waits.append((started - submitted_at) * 1000)
+			self._run_times.append((finished - started) * 1000)
+			if result["ok"]:
+				self.counters["completed"] += 1
+			elif result["error"] == "OCR timed out":
+				self.counters["timeouts"] += 1
+			else:
+				self.counters["failed"] += 1
+		result["queue_wait_ms"] = round((started - submitted_at) * 1000, 1)
+		result["elapsed_ms"] = round((finished - started) * 1000, 1)
+		return result
+
+	def stats(self) -> Dict[str, Any]:
+		"""Counters and recent queue-wait / run-time distributions for monitoring endpoints"""
+		with self._lock:
+			return dict(self.counters, **{
+				"workers": self.workers,
+				"queue_size": self.queue_size,
+				"timeout_seconds": self.timeout,
+				"in_flight": self.in_flight,
+				"queue_wait_ms": _percentiles(self._queue_waits),
+				"run_ms": _percentiles(self._run_times)
+			})
+
+
+ocr_pool = OCRPool()
+
+
+def submit_ocr(im: Image.Image, lang: str = 'eng', sha256: Optional[str] = None) -> Future:
+	"""Submit to the shared OCR pool without waiting for a slot (see OCRPool.submit)"""
+	return ocr_pool.submit(im, lang, sha256)
@@ -0,0 +1,177 @@
+"""
+OCR preprocessing: greyscale, rescale, binarize and find text regions.
+Tesseract's run time grows with the pixels it is given, and most of a
+product photo is not text. Each image is brought to a size where typical
+text lands near Tesseract's preferred ~300 DPI glyph height, binarized with
+Otsu's threshold, and split into the blocks whose edge density looks like
+text. Only those blocks are OCRed: a single block with a page segmentation
+mode that fits its shape, several stacked into one image so Tesseract starts
+once.
+"""
+
+import os
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Part of the OCR cache key: bump whenever the output of ocr_plan changes
+VERSION = 4
+
+# Longest side an image is scaled to before OCR (screenshots up, photos down)
+OCR_MIN_SIDE = int(os.getenv('OCR_MIN_SIDE', '1200'))
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', '2500'))
+
+# Text blocks are found on a grid of CELL x CELL pixel cells
+CELL = 16
+# Brightness step between neighbouring pixels that counts as an edge
+EDGE_STEP = 40
+# Share of a cell's pixels that must be edges for the cell to look like text
+EDGE_DENSITY = 0.06
+# Blocks smaller than this many cells are noise
+MIN_REGION_CELLS = 3
+# If text blocks cover more than this share of the image, OCR it as one page
+FULL_PAGE_SHARE = 0.6
+
+# Tesseract page segmentation modes
+PSM_AUTO = 3
+PSM_COLUMN = 4
+PSM_BLOCK = 6
+PSM_LINE = 7
+
+
+def rescale(grey: Image.Image) -> Image.Image:
+	"""Scale so the longest side is within OCR_MIN_SIDE..OCR_MAX_SIDE"""
+	longest = max(grey.size)
+	if OCR_MIN_SIDE <= longest <= OCR_MAX_SIDE:
+		return grey
+	target = OCR_MIN_SIDE if longest < OCR_MIN_SIDE else OCR_MAX_SIDE
+	scale = target / float(longest)
+	size = (max(1, round(grey.size[0] * scale)), max(1, round(grey.size[1] * scale)))
+	return grey.resize(size, Image.Resampling.LANCZOS if scale > 1 else Image.Resampling.BOX)
+
+
+def otsu_threshold(pixels: np.ndarray) -> int:
+	"""Grey level that best separates the histogram into two classes"""
+	histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+	levels = np.arange(256)
+	weight = np.cumsum(histogram)
+	mean = np.cumsum(histogram * levels)
+	total_weight, total_mean = weight[-1], mean[-1]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		between = (total_mean * weight - mean * total_weight) ** 2 / (weight * (total_weight - weight))
+	return int(np.nanargmax(between))
+
+
+def binarize(pixels: np.ndarray) -> np.ndarray:
+	"""Black text on white: Otsu threshold, inverted if the background came out dark"""
+	ink = pixels <= otsu_threshold(pixels)
+	# Text covers less of a region than its background
+	if ink.mean() > 0.5:
+		ink = ~ink
+	return np.where(ink, 0, 255).astype(np.uint8)
+
+
+def _dilate(mask: np.ndarray, dx: int, dy: int) -> np.ndarray:
+	"""Grow mask by dx cells left/right and dy cells up/down"""
+	grown = mask.copy()
+	for shift in range(1, dx + 1):
+		grown[:, shift:] |= mask[:, :-shift]
+		grown[:, :-shift] |= mask[:, shift:]
+	rows = grown.copy()
+	for shift in range(1, dy + 1):
+		grown[shift:, :] |= rows[:-shift, :]
+		grown[:-shift, :] |= rows[shift:, :]
+	return grown
+
+
+def text_cells(pixels: np.ndarray) -> np.ndarray:
+	"""Boolean grid of CELL x CELL cells dense in edges (glyph strokes). Strokes
+	turn, so a cell also needs edges in both directions: the straight borders of
+	chat bubbles, buttons and tables would otherwise join the text blocks and
+	leave their outside in the crop, where it splits Otsu's threshold"""
+	signed = pixels.astype(np.int16)
+	across = np.zeros(pixels.shape, dtype=bool)
+	down = np.zeros(pixels.shape, dtype=bool)
+	across[:, 1:] = np.abs(np.diff(signed, axis=1)) > EDGE_STEP
+	down[1:, :] = np.abs(np.diff(signed, axis=0)) > EDGE_STEP
+	rows, cols = pixels.shape[0] // CELL, pixels.shape[1] // CELL
+	if not rows or not cols:
+		return np.zeros((rows, cols), dtype=bool)
+
+	def density(edges):
+		return edges[:rows * CELL, :cols * CELL].reshape(rows, CELL, cols, CELL).mean(axis=(1, 3))
+
+	across, down = density(across), density(down)
+	return (np.maximum(across, down) > EDGE_DENSITY) & (np.minimum(across, down) > EDGE_DENSITY / 4)
+
+
+def text_regions(pixels: np.ndarray) -> List[Tuple[int, int, int, int]]:
+	"""Pixel boxes (left, top, right, bottom) of text-like blocks, in reading order"""
+	cells = text_cells(pixels)
+	# Close the gaps between characters and words so a line becomes one block
+	grown = _dilate(cells, 2, 1)
+	seen = np.zeros(grown.shape, dtype=bool)
+	boxes = []
+	for start in zip(*np.nonzero(grown)):
+		if seen[start]:
+			continue
+		seen[start] = True
+		queue = deque([start])
+		top, left, bottom, right = start[0], start[1], start[0], start[1]
+		dense = 0
+		while queue:
+			row, col = queue.popleft()
+			dense += cells[row, col]
+			top, bottom = min(top, row), max(bottom, row)
+			left, right = min(left, col), max(right, col)
+			for r, c in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+				if 0 <= r < grown.shape[0] and 0 <= c < grown.shape[1] and grown[r, c] and not seen[r, c]:
+					seen[r, c] = True
+					queue.append((r, c))
+		if dense >= MIN_REGION_CELLS:
+			boxes.append((left * CELL, top * CELL,
+						  min(pixels.shape[1], (right + 1) * CELL), min(pixels.shape[0], (bottom + 1) * CELL)))
+	return sorted(boxes, key=lambda box: (box[1], box[0]))
+
+
+def page_segmentation_mode(box: Tuple[int, int, int, int]) -> int:
+	"""A single line for short wide blocks, a uniform block otherwise"""
+	width, height = box[2] - box[0], box[3] - box[1]
+	# One line of text plus the cell of padding above and below it
+	return PSM_LINE if height <= 6 * CELL and width >= 4 * height else PSM_BLOCK
+
+
+def ocr_plan(im: Image.Image) -> List[Tuple[Image.Image, Optional[int]]]:
+	"""
+	(binarized image, page segmentation mode) pairs to hand to Tesseract.
+	- No text-like blocks: empty (the caller OCRs the original image instead)
+	- Blocks covering most of the image: the whole page, automatic layout
+	- One block: its crop; several: their crops stacked into one image
+	"""
+	grey = rescale(im.convert('L'))
+	pixels = np.asarray(grey)
+	boxes = text_regions(pixels)
+	if not boxes:
+		return []
+	area = sum((box[2] - box[0]) * (box[3] - box[1]) for box in boxes)
+	if area > FULL_PAGE_SHARE * pixels.size:
+		return [(Image.fromarray(binarize(pixels)), PSM_AUTO)]
+	crops = [binarize(pixels[top:bottom, left:right]) for left, top, right, bottom in boxes]
+	if len(crops) == 1:
+		return [(Image.fromarray(crops[0]), page_segmentation_mode(boxes[0]))]
+	return [(Image.fromarray(stack(crops)), PSM_COLUMN)]
+
+
+def stack(crops: List[np.ndarray]) -> np.ndarray:
+	"""Binarized crops one below the other on white, CELL apart, so a single
+	Tesseract process reads them all (starting one costs more than OCRing a block)"""
+	width = max(crop.shape[1] for crop in crops)
+	canvas = np.full((sum(crop.shape[0] for crop in crops) + CELL * (len(crops) + 1), width + 2 * CELL),
+					 255, dtype=np.uint8)
+	top = CELL
+	for crop in crops:
+		canvas[top:top + crop.shape[0], CELL:CELL + crop.shape[1]] = crop
+		top += crop.shape[0] + CELL
+	return canvas
@@ -4,7 +4,7 @@ from telethon import TelegramClient
 from transformers import pipeline
 from datetime import datetime
 import os
-from database import db
+from database import db, async_db
 from bson import ObjectId
 import re
 
@@ -95,7 +95,7 @@ class RealTelegramMonitor:
                         results.append(message_data)
                         
                         # Save to database
-                        db.save_monitoring_result(channel_id, message_data)
+                        await async_db.save_monitoring_result(channel_id, message_data)
                         
                         # Print suspicious messages
                         if analysis_result["prediction"] == "drug sale":
@@ -106,7 +106,7 @@ class RealTelegramMonitor:
                 print(f"✅ Analysis complete: {message_count} messages processed, {suspicious_count} suspicious")
                 
                 # Update channel status
-                db.update_channel_status(channel_id, "monitored", datetime.utcnow())
+                await async_db.update_channel_status(channel_id, "monitored", datetime.utcnow())
                 
             except Exception as channel_error:
                 print(f"❌ Channel access error: {channel_error}")
@@ -117,7 +117,7 @@ class RealTelegramMonitor:
                 
         except Exception as e:
             print(f"❌ Error monitoring channel: {str(e)}")
-            db.update_channel_status(channel_id, "error")
+            await async_db.update_channel_status(channel_id, "error")
             # Don't create dummy data if real monitoring fails
             raise e
         
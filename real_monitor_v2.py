@@ -5,7 +5,7 @@ from telethon.errors import UsernameInvalidError, ChannelInvalidError
 from transformers import pipeline
 from datetime import datetime
 import os
-from database import db
+from database import db, async_db
 from bson import ObjectId
 import re
 
@@ -124,7 +124,7 @@ class RealTelegramMonitorV2:
                         results.append(message_data)
                         
                         # Save to database
-                        db.save_monitoring_result(channel_id, message_data)
+                        await async_db.save_monitoring_result(channel_id, message_data)
                         
                         # Print suspicious messages
                         if analysis_result["prediction"] == "drug sale":
@@ -135,7 +135,7 @@ class RealTelegramMonitorV2:
                 print(f"✅ Analysis complete: {message_count} messages processed, {suspicious_count} suspicious")
                 
                 # Update channel status
-                db.update_channel_status(channel_id, "monitored", datetime.utcnow())
+                await async_db.update_channel_status(channel_id, "monitored", datetime.utcnow())
             
             await client.disconnect()
                 
@@ -159,7 +159,7 @@ class RealTelegramMonitorV2:
             demo_results = self.create_demo_data(channel_id)
             results.extend(demo_results)
             
-            db.update_channel_status(channel_id, "error")
+            await async_db.update_channel_status(channel_id, "error")
         
         return results
 
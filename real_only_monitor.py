@@ -5,7 +5,7 @@ from telethon.errors import UsernameInvalidError, ChannelInvalidError
 from transformers import pipeline
 from datetime import datetime
 import os
-from database import db
+from database import db, async_db
 from bson import ObjectId
 import re
 
@@ -136,7 +136,7 @@ class RealOnlyTelegramMonitor:
                     results.append(message_data)
                     
                     # Save to database
-                    db.save_monitoring_result(channel_id, message_data)
+                    await async_db.save_monitoring_result(channel_id, message_data)
                     
                     # Log suspicious messages
                     if analysis_result["prediction"] == "drug sale":
@@ -152,12 +152,12 @@ class RealOnlyTelegramMonitor:
             print(f"📈 Detection rate: {(suspicious_count/message_count*100) if message_count > 0 else 0:.1f}%")
             
             # Update channel status
-            db.update_channel_status(channel_id, "monitored", datetime.utcnow())
+            await async_db.update_channel_status(channel_id, "monitored", datetime.utcnow())
             
         except Exception as e:
             print(f"❌ REAL MONITORING FAILED: {e}")
             # NO DEMO DATA FALLBACK - REAL DATA ONLY!
-            db.update_channel_status(channel_id, "error")
+            await async_db.update_channel_status(channel_id, "error")
             raise e  # Re-raise the error so user knows it failed
         
         finally:
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Rebuild the channel_stats_hourly rollups from stored results
+Results saved before rollups existed are not counted until this has been run
+once; until then stats are counted from the live results on every request.
+Live results and archived ones (see retention.py) are both counted;
+compacted stubs already purged by their TTL are gone and cannot be.
+Run it before the first rescore so rescoring adjusts complete rollups.
+"""
+
+import os
+from database import db
+from retention import ARCHIVE_DIR, iter_archived_results
+
+BATCH_SIZE = 1000
+
+def archived_channel_ids(archive_dir=ARCHIVE_DIR):
+    """Channel ids that have archive partitions"""
+    root = os.path.join(archive_dir, 'monitoring_results')
+    if not os.path.isdir(root):
+        return []
+    return [name.split('=', 1)[1] for name in sorted(os.listdir(root)) if name.startswith('channel_id=')]
+
+def rebuild():
+    """Recount every live and archived result into fresh rollups"""
+    print("🔄 Rebuilding hourly channel statistics...")
+    # Readers count live results until the rollups are whole again
+    db.set_stats_complete(False)
+    cleared = db.clear_channel_stats()
+    print(f"🗑️ Cleared {cleared} rollup buckets")
+    
+    live = 0
+    for batch in db.iter_result_batches(batch_size=BATCH_SIZE):
+        db.add_results_to_stats(batch)
+        live += len(batch)
+    print(f"📊 Counted {live} live results")
+    
+    archived = 0
+    for channel_id in archived_channel_ids():
+        batch = []
+        for result in iter_archived_results(channel_id):
+            batch.append(result)
+            if len(batch) >= BATCH_SIZE:
+                db.add_results_to_stats(batch)
+                archived += len(batch)
+                batch = []
+        if batch:
+            db.add_results_to_stats(batch)
+            archived += len(batch)
+    print(f"📦 Counted {archived} archived results")
+    db.set_stats_complete(True)
+    print("✅ Rollups rebuilt")
+
+if __name__ == "__main__":
+    rebuild()
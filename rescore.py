@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Rescore stored monitoring results with the current detection engine
+Streams monitoring_results in _id order, re-runs detection on the stored
+message text in a process pool and bulk-writes changed verdicts, features and
+alerts back, so lexicon or classifier changes reach old data without
+re-fetching anything from Telegram.
+
+Progress is checkpointed after every batch; re-running resumes where the last
+run stopped. Rows already scored by the current engine version are skipped,
+and compacted stubs (no message text) cannot be rescored. Archived results
+are left as they are.
+
+After a lexicon-only change, --targeted compares DRUG_KEYWORDS with the
+lexicon snapshot saved by the last completed run and rescores only the rows
+the term index says may contain an added, removed or re-categorized term.
+Classifier or scoring changes (an ENGINE_VERSION bump) need a full run.
+
+Usage: python rescore.py [--targeted] [--reset] [--force] [--dry-run]
+  --targeted only rescore rows containing terms changed since the last run
+  --reset    ignore the checkpoint and start from the first result
+  --force    rescore rows even if they already carry the current engine version
+  --dry-run  score and report flips without writing anything
+"""
+
+import os
+import sys
+import json
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from bson import ObjectId
+from detection import DetectionEngine, DRUG_KEYWORDS, ENGINE_VERSION, lexicon_diff
+
+RESCORE_BATCH_SIZE = int(os.getenv('RESCORE_BATCH_SIZE', '2000'))
+RESCORE_WORKERS = int(os.getenv('RESCORE_WORKERS', str(os.cpu_count() or 2)))
+RESCORE_CHECKPOINT = os.getenv('RESCORE_CHECKPOINT', os.path.join('temp', 'rescore_checkpoint.json'))
+LEXICON_SNAPSHOT = os.getenv('RESCORE_LEXICON_SNAPSHOT', os.path.join('temp', 'lexicon_snapshot.json'))
+
+# Texts per task sent to a worker; large enough to amortize pickling
+CHUNK_SIZE = 250
+
+_engine = None
+
+def _init_worker():
+    """Build one engine per worker process"""
+    global _engine
+    try:
+        from nlp_simple import SimpleNLPClassifier
+        classifier = SimpleNLPClassifier()
+    except Exception as e:
+        print(f"⚠️ NLP init failed in rescore worker: {e}. Falling back to keyword-only.")
+        classifier = None
+    _engine = DetectionEngine(classifier)
+
+def _analyze_chunk(texts):
+    return _engine.analyze_batch(texts)
+
+def _load_checkpoint(path, engine_version, scope, reset=False):
+    """Resume state for this engine version and scope (anything else starts over)"""
+    if not reset and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get("engine_version") == engine_version and state.get("scope") == scope:
+            return state
+    return {
+        "engine_version": engine_version,
+        "scope": scope,
+        "corpus_size": None,
+        "last_id": None,
+        "completed": False,
+        "scanned": 0,
+        "rescored": 0,
+        "skipped": 0,
+        "updated": 0,
+        "flips": {},
+        "alerts_created": 0,
+        "alerts_removed": 0,
+        "elapsed_seconds": 0.0
+    }
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def changed_terms(snapshot_path=LEXICON_SNAPSHOT, keywords=None):
+    """Terms changed since the last completed rescore, or None if a full rescore
+    is needed (no snapshot, or the scoring logic itself changed)"""
+    if not os.path.exists(snapshot_path):
+        return None
+    with open(snapshot_path, encoding='utf-8') as f:
+        snapshot = json.load(f)
+    if snapshot.get("engine_version", "").split("+")[0] != ENGINE_VERSION:
+        return None
+    return lexicon_diff(snapshot["keywords"], keywords or DRUG_KEYWORDS)
+
+def _changed_fields(doc, analysis, now):
+    """Fields to $set if the new analysis differs from what is stored, else None"""
+    fields = {
+        "prediction": analysis["prediction"],
+        "confidence": analysis["confidence"],
+        "is_suspicious": analysis["prediction"] == "drug sale",
+        "keyword_matches": analysis["keyword_matches"],
+        "features": analysis["features"]
+    }
+    if all(doc.get(key) == value for key, value in fields.items()):
+        return None
+    fields["updated_at"] = now
+    return fields
+
+def _apply_batch(store, batch, analyses, state, dry_run):
+    """Diff one scored batch against the stored rows and write the changes back"""
+    now = datetime.utcnow()
+    updates = []
+    raised = []
+    cleared = []
+    # Each changed row's hourly rollup contribution moves to its new verdict
+    stats_changes = []
+    flips = Counter(state["flips"])
+
+    for doc, analysis in zip(batch, analyses):
+        fields = _changed_fields(doc, analysis, now)
+        if fields is None:
+            continue
+        updates.append((doc["_id"], fields))
+        stats_changes.extend([(doc, -1), (dict(doc, **fields), 1)])
+
+        old, new = doc.get("prediction"), fields["prediction"]
+        if old != new:
+            flips[f"{old} -> {new}"] += 1
+            if new == "drug sale":
+                raised.append(dict(doc, **fields))
+            elif old == "drug sale":
+                cleared.append(doc)
+
+    if not dry_run:
+        store.bulk_update_results(updates)
+        store.update_stats(stats_changes)
+        state["alerts_created"] += store.create_alerts(raised)
+        state["alerts_removed"] += store.delete_new_alerts(cleared)
+    state["updated"] += len(updates)
+    state["flips"] = dict(flips)
+
+def rescore(store, checkpoint_path=RESCORE_CHECKPOINT, batch_size=RESCORE_BATCH_SIZE,
+            workers=RESCORE_WORKERS, reset=False, force=False, dry_run=False,
+            terms=None, snapshot_path=LEXICON_SNAPSHOT):
+    """Rescore every stored result, or with terms only those the term index says
+    may contain one of them; returns the (checkpointed) run state"""
+    engine = DetectionEngine()
+    engine_version = engine.version
+    scope = "all" if terms is None else sorted(terms)
+    state = _load_checkpoint(checkpoint_path, engine_version, scope, reset)
+    if state["completed"]:
+        if not force:
+            return state
+        state = _load_checkpoint(checkpoint_path, engine_version, scope, reset=True)
+
+    after_id = ObjectId(state["last_id"]) if state["last_id"] else None
+    started = time.perf_counter() - state["elapsed_seconds"]
+    state["corpus_size"] = store.estimated_result_count()
+    if terms is None:
+        batches = store.iter_result_batches(after_id, batch_size)
+    else:
+        batches = store.iter_term_candidate_batches(terms, after_id, batch_size)
+
+    def finish(batch, futures):
+        # Skipped rows have no future; scored rows keep their batch order
+        scored = [doc for doc in batch if _needs_rescore(doc, engine_version, force)]
+        analyses = [analysis for future in futures for analysis in future.result()]
+        _apply_batch(store, scored, analyses, state, dry_run)
+        state["rescored"] += len(scored)
+        state["skipped"] += len(batch) - len(scored)
+        state["scanned"] += len(batch)
+        state["last_id"] = str(batch[-1]["_id"])
+        state["elapsed_seconds"] = time.perf_counter() - started
+        if not dry_run:
+            _write_json(checkpoint_path, state)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        pending = None
+        for batch in batches:
+            texts = [doc["message_text"] for doc in batch if _needs_rescore(doc, engine_version, force)]
+            futures = [pool.submit(_analyze_chunk, texts[i:i + CHUNK_SIZE])
+                       for i in range(0, len(texts), CHUNK_SIZE)]
+            # Write the previous batch back while the workers score this one
+            if pending:
+                finish(*pending)
+            pending = (batch, futures)
+        if pending:
+            finish(*pending)
+
+    state["completed"] = True
+    state["elapsed_seconds"] = time.perf_counter() - started
+    if not dry_run:
+        _write_json(checkpoint_path, state)
+        # Stored verdicts now reflect this lexicon; the next --targeted run diffs against it
+        _write_json(snapshot_path, {"engine_version": engine_version, "keywords": engine.keywords})
+    return state
+
+def _needs_rescore(doc, engine_version, force):
+    if not doc.get("message_text"):
+        return False
+    if force:
+        return True
+    return (doc.get("features") or {}).get("engine_version") != engine_version
+
+def print_summary(state, dry_run=False):
+    elapsed = state["elapsed_seconds"] or 1e-9
+    print("📊 RESCORE SUMMARY" + (" (dry run, nothing written)" if dry_run else ""))
+    print("=" * 60)
+    print(f"Engine version:      {state['engine_version']}")
+    if state["scope"] != "all":
+        corpus = state["corpus_size"] or 0
+        share = state["scanned"] / corpus * 100 if corpus else 0.0
+        print(f"Changed terms:       {', '.join(state['scope']) or 'none'}")
+        print(f"Candidate rows:      {state['scanned']:,} of ~{corpus:,} ({share:.2f}% of a full rescore)")
+    print(f"Scanned:             {state['scanned']:,} rows in {elapsed:.1f}s "
+          f"({state['scanned'] / elapsed:,.0f} rows/s)")
+    print(f"Rescored:            {state['rescored']:,} ({state['skipped']:,} skipped: "
+          f"current version or no text)")
+    print(f"Updated:             {state['updated']:,}")
+    print(f"Alerts:              +{state['alerts_created']:,} / -{state['alerts_removed']:,}")
+    if state["flips"]:
+        print("Flipped verdicts:")
+        for flip, count in sorted(state["flips"].items(), key=lambda item: -item[1]):
+            print(f"  {flip:<30} {count:,}")
+    else:
+        print("Flipped verdicts:    none")
+
+if __name__ == "__main__":
+    from database import db
+
+    dry_run = '--dry-run' in sys.argv
+    terms = None
+    if '--targeted' in sys.argv:
+        terms = changed_terms()
+        if terms is None:
+            print("⚠️ No lexicon snapshot for this engine version, running a full rescore")
+        elif not terms:
+            print("✅ Lexicon unchanged since the last rescore, nothing to do")
+            sys.exit(0)
+        else:
+            indexed = db.index_result_terms()
+            if indexed:
+                print(f"🗂️ Added {indexed:,} older results to the term index")
+
+    print(f"🔁 Rescoring {'all' if terms is None else 'candidate'} results ({db.name}) with "
+          f"{RESCORE_WORKERS} workers, batches of {RESCORE_BATCH_SIZE}")
+    state = rescore(db, reset='--reset' in sys.argv, force='--force' in sys.argv,
+                    dry_run=dry_run, terms=terms)
+    print_summary(state, dry_run)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Retention tiers for monitoring results
+
+- normal results older than RETENTION_NORMAL_DAYS are compacted to verdict-only
+  stubs (message text dropped) that expire STUB_TTL_DAYS later via a TTL index
+- every other result older than RETENTION_ARCHIVE_DAYS is moved out of the
+  database into gzip-compressed JSONL files on the mounted disk, partitioned
+  as ARCHIVE_DIR/monitoring_results/channel_id=<id>/date=<YYYY-MM-DD>/
+
+iter_channel_results() reads live and archived results as one stream, so
+exports keep working after data has been archived.
+
+Usage (e.g. from a daily cron job): python retention.py [--dry-run]
+"""
+
+import os
+import sys
+import gzip
+import json
+import heapq
+import shutil
+from datetime import datetime, timedelta
+from storage import json_default, json_object_hook, project_fields
+
+RETENTION_NORMAL_DAYS = int(os.getenv('RETENTION_NORMAL_DAYS', '30'))
+RETENTION_ARCHIVE_DAYS = int(os.getenv('RETENTION_ARCHIVE_DAYS', '90'))
+STUB_TTL_DAYS = int(os.getenv('STUB_TTL_DAYS', '365'))
+# render.yaml mounts the persistent disk at /app/temp
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join('temp', 'archive'))
+ARCHIVE_BATCH_SIZE = 1000
+
+def _partition_dir(channel_id, day, archive_dir=None):
+    return os.path.join(
+        archive_dir or ARCHIVE_DIR, 'monitoring_results',
+        f'channel_id={channel_id}', f'date={day.isoformat()}'
+    )
+
+def _part_files(directory):
+    return [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.jsonl.gz')]
+
+def _write_partition(channel_id, day, docs, archive_dir=None):
+    """Write one batch of documents as a part file; returns its path"""
+    directory = _partition_dir(channel_id, day, archive_dir)
+    os.makedirs(directory, exist_ok=True)
+    # Named after the batch, so a run that crashed after archiving but before
+    # deleting rewrites the same file rather than adding a second copy
+    path = os.path.join(directory, f"part-{docs[0]['_id']}-{docs[-1]['_id']}.jsonl.gz")
+
+    # Write to a temp name and rename so readers never see a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for doc in docs:
+            f.write(json.dumps(doc, default=json_default, ensure_ascii=False))
+            f.write('\n')
+    os.replace(tmp_path, path)
+    return path
+
+def _flush(store, batch, archive_dir):
+    """Archive a batch grouped by partition, then delete it from the database"""
+    partitions = {}
+    for doc in batch:
+        key = (doc['channel_id'], doc['processed_at'].date())
+        partitions.setdefault(key, []).append(doc)
+    for (channel_id, day), docs in partitions.items():
+        _write_partition(channel_id, day, docs, archive_dir)
+    return store.delete_results([doc['_id'] for doc in batch])
+
+def archive_results(store, before, archive_dir=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move non-normal results processed before `before` into archive files"""
+    archived = 0
+    batch = []
+    # Only rows already read are deleted, so the oldest-first scan is unaffected
+    for doc in store.iter_results_before(before, exclude_prediction='normal', batch_size=batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            archived += _flush(store, batch, archive_dir)
+            batch = []
+    if batch:
+        archived += _flush(store, batch, archive_dir)
+    return archived
+
+def apply_retention(store, now=None, archive_dir=None, dry_run=False):
+    """Run every retention tier once; returns counts per tier"""
+    now = now or datetime.utcnow()
+    compact_before = now - timedelta(days=RETENTION_NORMAL_DAYS)
+    archive_before = now - timedelta(days=RETENTION_ARCHIVE_DAYS)
+
+    if dry_run:
+        pending = sum(1 for _ in store.iter_results_before(archive_before, exclude_prediction='normal'))
+        return {'compacted': 0, 'archived': 0, 'purged': 0, 'pending_archive': pending}
+
+    try:
+        return {
+            'compacted': store.compact_results(compact_before, now + timedelta(days=STUB_TTL_DAYS)),
+            'archived': archive_results(store, archive_before, archive_dir),
+            # MongoDB's TTL monitor does this on its own; SQLite needs the explicit sweep
+            'purged': store.purge_expired_results(now)
+        }
+    finally:
+        # Recorded even if a tier failed part-way, so cached exports built
+        # before the run are never reused (see bulk_export.results_watermark)
+        store.set_retention_run()
+
+def remove_archived_results(channel_id, archive_dir=None):
+    """Delete every archive partition of a removed channel"""
+    shutil.rmtree(os.path.join(archive_dir or ARCHIVE_DIR, 'monitoring_results', f'channel_id={channel_id}'),
+                  ignore_errors=True)
+
+def _read_part(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line, object_hook=json_object_hook)
+
+def iter_archived_results(channel_id, archive_dir=None, date_from=None, date_to=None):
+    """Archived results for a channel, newest first, optionally limited to
+    message dates in [date_from, date_to)"""
+    channel_dir = os.path.join(archive_dir or ARCHIVE_DIR, 'monitoring_results', f'channel_id={channel_id}')
+    if not os.path.isdir(channel_dir):
+        return
+    # Messages are processed after they are sent, so partitions (processing
+    # days) older than date_from hold nothing in range; a day of slack covers clock skew
+    oldest_day = (date_from - timedelta(days=1)).date().isoformat() if date_from else None
+    for partition in sorted(os.listdir(channel_dir), reverse=True):
+        if oldest_day and partition.split('=', 1)[-1] < oldest_day:
+            break
+        docs = {}
+        for path in _part_files(os.path.join(channel_dir, partition)):
+            # Keyed by _id: a rerun that archives a batch split differently
+            # (or older, timestamp-named parts) may hold a result twice
+            docs.update((str(doc['_id']), doc) for doc in _read_part(path)
+                        if _in_date_range(doc, date_from, date_to))
+        docs = list(docs.values())
+        # Partitions are one day each, so sorting within a partition is enough
+        docs.sort(key=_newest_first_key, reverse=True)
+        yield from docs
+
+def _in_date_range(doc, date_from, date_to):
+    if not (date_from or date_to):
+        return True
+    date = doc.get('date')
+    if not isinstance(date, datetime):
+        return False
+    return (not date_from or date >= date_from) and (not date_to or date < date_to)
+
+def _newest_first_key(doc):
+    return doc.get('processed_at') or datetime.min, str(doc.get('_id'))
+
+def iter_channel_results(store, channel_id, archive_dir=None, fields=None, date_from=None, date_to=None):
+    """All results for a channel, live and archived, newest first. Both sides
+    are streamed, so memory stays flat however large the channel is."""
+    if fields:
+        # The merge orders on these
+        fields = set(fields) | {'processed_at'}
+    archived = (project_fields(doc, fields)
+                for doc in iter_archived_results(channel_id, archive_dir, date_from, date_to))
+    return heapq.merge(
+        store.iter_monitoring_results(channel_id, fields, date_from=date_from, date_to=date_to),
+        archived,
+        key=_newest_first_key, reverse=True
+    )
+
+if __name__ == "__main__":
+    from database import db
+
+    dry_run = '--dry-run' in sys.argv
+    print(f"🗄️ Applying retention ({db.name}): compact normal > {RETENTION_NORMAL_DAYS}d, "
+          f"archive > {RETENTION_ARCHIVE_DAYS}d to {ARCHIVE_DIR}")
+    counts = apply_retention(db, dry_run=dry_run)
+    for tier, count in counts.items():
+        print(f"  {tier}: {count}")
+    print("✅ Retention complete" if not dry_run else "✅ Dry run complete (nothing changed)")
@@ -4,7 +4,7 @@ from telethon import TelegramClient
 from transformers import pipeline
 from datetime import datetime
 import os
-from database import db
+from database import db, async_db
 from bson import ObjectId
 import re
 
@@ -75,21 +75,21 @@ class SimpleMonitor:
                         results.append(message_data)
                         
                         # Save to database
-                        db.save_monitoring_result(channel_id, message_data)
+                        await async_db.save_monitoring_result(channel_id, message_data)
                         
                         # Print suspicious messages for debugging
                         if analysis_result["prediction"] == "drug sale":
                             print(f"🚨 Drug-related message: {text[:80]}... (conf {analysis_result['confidence']:.2f})")
                 
                 # Update channel last monitored time
-                db.update_channel_status(channel_id, "monitored", datetime.utcnow())
+                await async_db.update_channel_status(channel_id, "monitored", datetime.utcnow())
                 
             except Exception as e:
                 print(f"Channel access error: {e}")
                 # If channel access fails, create sample analysis for demo
                 sample_results = await self.create_demo_analysis(channel_id)
                 results.extend(sample_results)
-                db.update_channel_status(channel_id, "demo_analyzed", datetime.utcnow())
+                await async_db.update_channel_status(channel_id, "demo_analyzed", datetime.utcnow())
             
             await client.disconnect()
                 
@@ -98,7 +98,7 @@ class SimpleMonitor:
             # Create demo results even if connection fails
             sample_results = await self.create_demo_analysis(channel_id)
             results.extend(sample_results)
-            db.update_channel_status(channel_id, "demo_mode", datetime.utcnow())
+            await async_db.update_channel_status(channel_id, "demo_mode", datetime.utcnow())
         
         return results
 
@@ -136,7 +136,7 @@ class SimpleMonitor:
             results.append(message_data)
             
             # Save to database
-            db.save_monitoring_result(channel_id, message_data)
+            await async_db.save_monitoring_result(channel_id, message_data)
             
             # Print suspicious messages
             if analysis_result["prediction"] == "drug sale":
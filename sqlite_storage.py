@@ -0,0 +1,828 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from bson import ObjectId
+from detection import text_grams, text_words
+from storage import (StorageBackend, SEARCH_MAX_DEPTH, EXPORT_BATCH_SIZE, STATS_META_KEY, clamp_page_size,
+                     decode_cursor, page_key, page_with_cursor, parse_search_query, project_fields,
+                     to_utc_naive, json_default, json_object_hook)
+
+# Indexed columns mirrored out of each table's JSON document
+_COLUMNS = {
+    "users": ("username",),
+    "channels": ("username", "channel_link"),
+    "monitoring_results": ("channel_id", "prediction", "confidence", "date", "processed_at", "updated_at"),
+    "alerts": ("channel_id", "username", "status", "confidence", "created_at"),
+    "known_images": ("sha256", "created_at"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channels (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    channel_link TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_channels_user_link ON channels (username, channel_link);
+CREATE TABLE IF NOT EXISTS monitoring_results (
+    id TEXT PRIMARY KEY,
+    channel_id TEXT NOT NULL,
+    prediction TEXT,
+    confidence REAL,
+    date TEXT,
+    processed_at TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_results_channel_processed
+    ON monitoring_results (channel_id, processed_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_results_channel_date
+    ON monitoring_results (channel_id, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_results_channel_prediction
+    ON monitoring_results (channel_id, prediction, processed_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_results_processed ON monitoring_results (processed_at);
+CREATE TABLE IF NOT EXISTS result_term_keys (
+    term_key TEXT NOT NULL,
+    result_id TEXT NOT NULL,
+    PRIMARY KEY (term_key, result_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_result_term_keys_result ON result_term_keys (result_id);
+CREATE TABLE IF NOT EXISTS term_words (word TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS trg_results_delete_term_keys AFTER DELETE ON monitoring_results
+BEGIN
+    DELETE FROM result_term_keys WHERE result_id = old.id;
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS results_fts
+    USING fts5(message_text, tokenize = 'unicode61 remove_diacritics 2');
+CREATE TRIGGER IF NOT EXISTS trg_results_fts_insert AFTER INSERT ON monitoring_results
+WHEN json_extract(new.doc, '$.message_text') IS NOT NULL
+BEGIN
+    INSERT INTO results_fts (rowid, message_text) VALUES (new.rowid, json_extract(new.doc, '$.message_text'));
+END;
+CREATE TRIGGER IF NOT EXISTS trg_results_fts_delete AFTER DELETE ON monitoring_results
+BEGIN
+    DELETE FROM results_fts WHERE rowid = old.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_results_fts_update AFTER UPDATE OF doc ON monitoring_results
+WHEN json_extract(old.doc, '$.message_text') IS NOT json_extract(new.doc, '$.message_text')
+BEGIN
+    DELETE FROM results_fts WHERE rowid = old.rowid;
+    INSERT INTO results_fts (rowid, message_text)
+        SELECT new.rowid, json_extract(new.doc, '$.message_text')
+        WHERE json_extract(new.doc, '$.message_text') IS NOT NULL;
+END;
+CREATE TABLE IF NOT EXISTS channel_stats_hourly (
+    channel_id TEXT NOT NULL,
+    hour TEXT NOT NULL,
+    counter TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (channel_id, hour, counter)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS alerts (
+    id TEXT PRIMARY KEY,
+    channel_id TEXT NOT NULL,
+    username TEXT,
+    status TEXT NOT NULL,
+    confidence REAL,
+    created_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_user_status_created
+    ON alerts (username, status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_alerts_channel ON alerts (channel_id);
+CREATE TABLE IF NOT EXISTS known_images (
+    id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_known_images_created ON known_images (created_at, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+"""
+
+# Results saved before updated_at existed count as changed when they were processed
+_BACKFILL_UPDATED_AT = (
+    "UPDATE monitoring_results SET updated_at = processed_at, "
+    "doc = json_set(doc, '$.updated_at', json_object('$date', processed_at)) "
+    "WHERE updated_at IS NULL"
+)
+
+def _migrate(conn):
+    """Bring database files created by older versions up to the current schema"""
+    def result_columns():
+        return {row["name"] for row in conn.execute("PRAGMA table_info(monitoring_results)")}
+
+    if "updated_at" not in result_columns():
+        with conn:
+            # Another process may be migrating the same file; check again under the write lock
+            conn.execute("BEGIN IMMEDIATE")
+            if "updated_at" not in result_columns():
+                conn.execute("ALTER TABLE monitoring_results ADD COLUMN updated_at TEXT")
+                conn.execute(_BACKFILL_UPDATED_AT)
+    # Created here rather than in _SCHEMA, which runs before the column is added
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_results_channel_updated "
+                 "ON monitoring_results (channel_id, updated_at, id)")
+    # Every trigram per result, replaced by result_term_keys (refilled by index_result_terms)
+    conn.execute("DROP TRIGGER IF EXISTS trg_results_delete_grams")
+    conn.execute("DROP TABLE IF EXISTS result_grams")
+    # A file created empty has nothing for the rollups to miss
+    with conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO meta (key, doc) SELECT ?, ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM monitoring_results)",
+            (STATS_META_KEY, _dumps({"complete": True, "updated_at": datetime.utcnow()}))
+        )
+
+def _result_filters(where, params, prediction=None, min_confidence=None, date_from=None, date_to=None):
+    """Append the optional result filters shared by paging and search"""
+    if prediction:
+        where.append("prediction = ?")
+        params.append(prediction)
+    if min_confidence is not None:
+        where.append("confidence >= ?")
+        params.append(float(min_confidence))
+    if date_from:
+        where.append("date >= ?")
+        params.append(_ts(date_from))
+    if date_to:
+        where.append("date < ?")
+        params.append(_ts(date_to))
+
+def _ts(value):
+    """Sortable text form of a datetime column"""
+    if value is None:
+        return None
+    return to_utc_naive(value).isoformat(timespec='microseconds')
+
+def _dumps(doc):
+    return json.dumps({k: v for k, v in doc.items() if k != "_id"}, default=json_default, ensure_ascii=False)
+
+def _column_value(value):
+    return _ts(value) if isinstance(value, datetime) else value
+
+def _row_to_doc(row):
+    if row is None:
+        return None
+    doc = json.loads(row["doc"], object_hook=json_object_hook)
+    doc["_id"] = ObjectId(row["id"])
+    return doc
+
+class SQLiteDatabase(StorageBackend):
+    """Embedded SQLite storage backend for load tests, benchmarks and air-gapped
+    single-node deployments. Each document is stored as JSON next to the columns
+    that are filtered or sorted on, which carry the same indexes as MongoDB.
+    File databases run in WAL mode with one connection per thread; ':memory:'
+    uses a single shared connection and does not survive fork."""
+
+    name = "sqlite"
+
+    def __init__(self, path='trinetra.db'):
+        super().__init__()
+        self.path = path
+        self.in_memory = path == ':memory:'
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._shared = None
+        self._pid = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=not self.in_memory)
+        conn.row_factory = sqlite3.Row
+        if not self.in_memory:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _migrate(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Yield a connection inside a transaction (committed on success)"""
+        pid = os.getpid()
+        if self.in_memory:
+            with self._lock:
+                if self._shared is None or self._pid != pid:
+                    self._shared = self._connect()
+                    self._pid = pid
+                with self._shared:
+                    yield self._shared
+        else:
+            conn = getattr(self._local, "conn", None)
+            if conn is None or getattr(self._local, "pid", None) != pid:
+                conn = self._connect()
+                self._local.conn = conn
+                self._local.pid = pid
+            with conn:
+                yield conn
+
+    def reset_after_fork(self):
+        """Drop connections inherited from the parent process"""
+        super().reset_after_fork()
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._shared = None
+        self._pid = None
+
+    def close(self):
+        """Close this thread's connection (or the shared in-memory one)"""
+        with self._lock:
+            if self._shared is not None:
+                self._shared.close()
+                self._shared = None
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def ping(self):
+        """Check the database file is usable"""
+        with self._transaction() as conn:
+            conn.execute("SELECT 1")
+
+    def _insert(self, conn, table, doc):
+        """Insert doc into table, assigning an ObjectId _id like MongoDB does"""
+        doc["_id"] = doc.get("_id") or ObjectId()
+        columns = _COLUMNS[table]
+        conn.execute(
+            f"INSERT INTO {table} (id, {', '.join(columns)}, doc) VALUES (?, {', '.join('?' for _ in columns)}, ?)",
+            [str(doc["_id"])] + [_column_value(doc.get(c)) for c in columns] + [_dumps(doc)]
+        )
+        return doc["_id"]
+
+    def _set_fields(self, conn, table, where, params, fields, unset=()):
+        """$set/$unset-style update of every matching document; returns the number matched"""
+        rows = conn.execute(f"SELECT id, doc FROM {table} WHERE {where}", params).fetchall()
+        columns = [c for c in _COLUMNS[table] if c in fields]
+        assignments = ", ".join(["doc = ?"] + [f"{c} = ?" for c in columns])
+        for row in rows:
+            doc = _row_to_doc(row)
+            doc.update(fields)
+            for key in unset:
+                doc.pop(key, None)
+            conn.execute(
+                f"UPDATE {table} SET {assignments} WHERE id = ?",
+                [_dumps(doc)] + [_column_value(fields[c]) for c in columns] + [row["id"]]
+            )
+        return len(rows)
+
+    def _find_user(self, username):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT id, doc FROM users WHERE username = ?", (username,)).fetchone()
+        return _row_to_doc(row)
+
+    def _insert_user(self, user_doc):
+        with self._transaction() as conn:
+            return self._insert(conn, "users", user_doc)
+
+    def _update_user(self, username, fields):
+        with self._transaction() as conn:
+            return self._set_fields(conn, "users", "username = ?", (username,), fields)
+
+    def _find_channel_by_link(self, username, channel_link):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, doc FROM channels WHERE username = ? AND channel_link = ?",
+                (username, channel_link)
+            ).fetchone()
+        return _row_to_doc(row)
+
+    def _insert_channel(self, channel_doc):
+        with self._transaction() as conn:
+            return self._insert(conn, "channels", channel_doc)
+
+    def _insert_result(self, result_doc):
+        # Term keys live in result_term_keys rather than the JSON document
+        term_keys = result_doc.pop("term_keys", None) or []
+        with self._transaction() as conn:
+            result_id = self._insert(conn, "monitoring_results", result_doc)
+            self._insert_term_keys(conn, result_id, term_keys)
+        return result_id
+
+    def _insert_term_keys(self, conn, result_id, term_keys):
+        # Texts too short for any key get the empty key (never looked up), which
+        # marks them as indexed for index_result_terms
+        conn.executemany(
+            "INSERT OR IGNORE INTO result_term_keys (term_key, result_id) VALUES (?, ?)",
+            [(term_key, str(result_id)) for term_key in term_keys or [""]]
+        )
+
+    def _add_term_words(self, words):
+        with self._transaction() as conn:
+            self._insert_term_words(conn, words)
+
+    def _insert_term_words(self, conn, words):
+        conn.executemany("INSERT OR IGNORE INTO term_words (word) VALUES (?)", [(word,) for word in words])
+
+    def _find_term_words(self, word, limit):
+        with self._transaction() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT word FROM term_words WHERE instr(word, ?) > 0 LIMIT ?", (word, limit)
+            )]
+
+    def _insert_alert(self, alert_doc):
+        with self._transaction() as conn:
+            return self._insert(conn, "alerts", alert_doc)
+
+    def _insert_alerts(self, alert_docs):
+        with self._transaction() as conn:
+            for alert_doc in alert_docs:
+                self._insert(conn, "alerts", alert_doc)
+        return len(alert_docs)
+
+    def _inc_channel_stats(self, increments):
+        # One row per counter, so $inc becomes an upsert adding to the stored value
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO channel_stats_hourly (channel_id, hour, counter, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (channel_id, hour, counter) DO UPDATE SET value = value + excluded.value",
+                [(channel_id, _ts(hour), counter, value)
+                 for (channel_id, hour), counters in increments.items()
+                 for counter, value in counters.items()]
+            )
+
+    def _find_channel_stats(self, channel_ids, start=None, end=None):
+        where = [f"channel_id IN ({', '.join('?' for _ in channel_ids)})"]
+        params = list(channel_ids)
+        if start:
+            where.append("hour >= ?")
+            params.append(_ts(start))
+        if end:
+            where.append("hour < ?")
+            params.append(_ts(end))
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT channel_id, hour, counter, value FROM channel_stats_hourly "
+                f"WHERE {' AND '.join(where)} ORDER BY channel_id, hour", params
+            ).fetchall()
+
+        bucket, counters = None, {}
+        for row in rows:
+            if (row["channel_id"], row["hour"]) != bucket:
+                if bucket:
+                    yield bucket[0], datetime.fromisoformat(bucket[1]), counters
+                bucket, counters = (row["channel_id"], row["hour"]), {}
+            counters[row["counter"]] = row["value"]
+        if bucket:
+            yield bucket[0], datetime.fromisoformat(bucket[1]), counters
+
+    def clear_channel_stats(self):
+        with self._transaction() as conn:
+            buckets = conn.execute(
+                "SELECT COUNT(*) FROM (SELECT DISTINCT channel_id, hour FROM channel_stats_hourly)"
+            ).fetchone()[0]
+            conn.execute("DELETE FROM channel_stats_hourly")
+        return buckets
+
+    def _get_meta(self, key):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT doc FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["doc"], object_hook=json_object_hook) if row else None
+
+    def _set_meta(self, key, doc):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO meta (key, doc) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET doc = excluded.doc",
+                (key, _dumps(doc))
+            )
+
+    def _insert_known_image(self, image_doc):
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM known_images WHERE sha256 = ?", (image_doc["sha256"],)).fetchone():
+                return False
+            self._insert(conn, "known_images", image_doc)
+        return True
+
+    def iter_known_images(self, since=None):
+        where, params = "", []
+        if since:
+            where, params = "WHERE created_at > ?", [_ts(since)]
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT id, doc FROM known_images {where} ORDER BY created_at, id", params
+            ).fetchall()
+        for row in rows:
+            yield _row_to_doc(row)
+
+    def get_user_channels(self, username):
+        """Get all channels for a user"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, doc FROM channels WHERE username = ? ORDER BY rowid", (username,)
+            ).fetchall()
+        return [_row_to_doc(r) for r in rows]
+
+    def get_channel(self, channel_id, username=None):
+        """Get a channel by id (optionally requiring an owner)"""
+        if not ObjectId.is_valid(channel_id):
+            return None
+        sql, params = "SELECT id, doc FROM channels WHERE id = ?", [str(channel_id)]
+        if username:
+            sql += " AND username = ?"
+            params.append(username)
+        with self._transaction() as conn:
+            return _row_to_doc(conn.execute(sql, params).fetchone())
+
+    def remove_channel(self, channel_id, username):
+        """Delete a user's channel together with its results and alerts"""
+        if not ObjectId.is_valid(channel_id):
+            return False
+        with self._transaction() as conn:
+            deleted = conn.execute(
+                "DELETE FROM channels WHERE id = ? AND username = ?", (str(channel_id), username)
+            ).rowcount
+            if not deleted:
+                return False
+            conn.execute("DELETE FROM monitoring_results WHERE channel_id = ?", (channel_id,))
+            conn.execute("DELETE FROM alerts WHERE channel_id = ?", (channel_id,))
+            conn.execute("DELETE FROM channel_stats_hourly WHERE channel_id = ?", (channel_id,))
+        self.channel_owner_cache.invalidate(channel_id)
+        return True
+
+    def update_channel_status(self, channel_id, status, last_monitored=None):
+        """Update channel monitoring status"""
+        fields = {"status": status}
+        if last_monitored:
+            fields["last_monitored"] = last_monitored
+        with self._transaction() as conn:
+            self._set_fields(conn, "channels", "id = ?", (str(channel_id),), fields)
+
+    def get_monitoring_results(self, channel_id, limit=100):
+        """Get monitoring results for a channel"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, doc FROM monitoring_results WHERE channel_id = ? "
+                "ORDER BY processed_at DESC, id DESC LIMIT ?", (channel_id, limit)
+            ).fetchall()
+        return [_row_to_doc(r) for r in rows]
+
+    def get_all_monitoring_results(self, channel_id):
+        """Get all monitoring results for a channel (no limit)"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, doc FROM monitoring_results WHERE channel_id = ? "
+                "ORDER BY processed_at DESC, id DESC", (channel_id,)
+            ).fetchall()
+        return [_row_to_doc(r) for r in rows]
+
+    def iter_monitoring_results(self, channel_id, fields=None, batch_size=EXPORT_BATCH_SIZE,
+                                date_from=None, date_to=None):
+        """Stream a channel's results newest first, fetching batch_size documents
+        at a time; fields limits each document to those top-level fields and
+        date_from/date_to filter on the message date as paging does"""
+        where, params = ["channel_id = ?"], [channel_id]
+        _result_filters(where, params, date_from=date_from, date_to=date_to)
+        position = []
+        while True:
+            # One short read per batch, so a slow consumer never pins a WAL snapshot
+            with self._transaction() as conn:
+                rows = conn.execute(
+                    f"SELECT id, processed_at, doc FROM monitoring_results WHERE {' AND '.join(where)} "
+                    "ORDER BY processed_at DESC, id DESC LIMIT ?", params + position + [batch_size]
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield project_fields(_row_to_doc(row), fields)
+            if not position:
+                where.append("(processed_at, id) < (?, ?)")
+            position = [rows[-1]["processed_at"], rows[-1]["id"]]
+
+    def iter_changed_results(self, channel_id, since=None, until=None, fields=None,
+                             batch_size=EXPORT_BATCH_SIZE, date_from=None, date_to=None):
+        """Stream a channel's results added or changed after the (updated_at, _id)
+        position since and at or before until, oldest change first"""
+        where, params = ["channel_id = ?", "updated_at IS NOT NULL"], [channel_id]
+        _result_filters(where, params, date_from=date_from, date_to=date_to)
+        if until:
+            where.append("updated_at <= ?")
+            params.append(_ts(until))
+        where.append("(updated_at, id) > (?, ?)")
+        position = [_ts(since[0]), str(since[1])] if since else ["", ""]
+        while True:
+            with self._transaction() as conn:
+                rows = conn.execute(
+                    f"SELECT id, updated_at, doc FROM monitoring_results WHERE {' AND '.join(where)} "
+                    "ORDER BY updated_at, id LIMIT ?", params + position + [batch_size]
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield project_fields(_row_to_doc(row), fields)
+            position = [rows[-1]["updated_at"], rows[-1]["id"]]
+
+    def backfill_result_updated_at(self):
+        """Give results saved before updated_at existed updated_at = processed_at;
+        returns the number updated (normally none: opening an older file already does this)"""
+        with self._transaction() as conn:
+            return conn.execute(_BACKFILL_UPDATED_AT).rowcount
+
+    def get_monitoring_results_page(self, channel_id, cursor=None, limit=None, prediction=None,
+                                    min_confidence=None, date_from=None, date_to=None):
+        """Get one page of results (newest first) using (processed_at, _id) keyset pagination,
+        or (date, _id) when filtered by date so the range is read from an index.
+        Returns (results, next_cursor); next_cursor is None on the last page."""
+        limit = clamp_page_size(limit)
+        key = page_key(date_from, date_to)
+        where, params = ["channel_id = ?"], [channel_id]
+        _result_filters(where, params, prediction, min_confidence, date_from, date_to)
+        if cursor:
+            timestamp, doc_id = decode_cursor(cursor)
+            where.append(f"({key}, id) < (?, ?)")
+            params.extend([_ts(timestamp), str(doc_id)])
+
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT id, doc FROM monitoring_results WHERE {' AND '.join(where)} "
+                f"ORDER BY {key} DESC, id DESC LIMIT ?", params + [limit + 1]
+            ).fetchall()
+        return page_with_cursor([_row_to_doc(r) for r in rows], limit, key)
+
+    def count_results(self, channel_id, prediction=None, compacted=None):
+        """Count a channel's results, optionally for a single prediction label
+        and only compacted stubs (compacted=True) or only full results (False)"""
+        sql, params = "SELECT COUNT(*) FROM monitoring_results WHERE channel_id = ?", [channel_id]
+        if prediction:
+            sql += " AND prediction = ?"
+            params.append(prediction)
+        if compacted is not None:
+            sql += f" AND json_extract(doc, '$.compacted') IS {'' if compacted else 'NOT '}1"
+        with self._transaction() as conn:
+            return conn.execute(sql, params).fetchone()[0]
+
+    def search_results(self, query, channel_ids, prediction=None, min_confidence=None,
+                       date_from=None, date_to=None, offset=0, limit=None):
+        """FTS5 search ranked by bm25; every phrase is quoted so all must match"""
+        phrases = parse_search_query(query)
+        if not phrases or not channel_ids:
+            return [], False
+        limit = clamp_page_size(limit)
+        offset = max(0, min(int(offset or 0), SEARCH_MAX_DEPTH))
+
+        where = ["results_fts MATCH ?", f"channel_id IN ({', '.join('?' for _ in channel_ids)})"]
+        params = [" ".join('"' + phrase.replace('"', '""') + '"' for phrase in phrases)] + list(channel_ids)
+        _result_filters(where, params, prediction, min_confidence, date_from, date_to)
+
+        # results_fts rows share the result's rowid (nothing here runs VACUUM,
+        # which could renumber them; rebuild_search_index() repairs that)
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT r.id, r.doc, bm25(results_fts) AS rank FROM results_fts "
+                "JOIN monitoring_results r ON r.rowid = results_fts.rowid "
+                f"WHERE {' AND '.join(where)} ORDER BY rank, r.processed_at DESC LIMIT ? OFFSET ?",
+                params + [limit + 1, offset]
+            ).fetchall()
+        results = []
+        for row in rows[:limit]:
+            doc = _row_to_doc(row)
+            # bm25 is lower-is-better; flip it so higher scores rank first like textScore
+            doc["score"] = -row["rank"]
+            results.append(doc)
+        return results, len(rows) > limit
+
+    def rebuild_search_index(self):
+        """Re-create the full-text index from the stored documents"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM results_fts")
+            conn.execute(
+                "INSERT INTO results_fts (rowid, message_text) "
+                "SELECT rowid, json_extract(doc, '$.message_text') FROM monitoring_results "
+                "WHERE json_extract(doc, '$.message_text') IS NOT NULL"
+            )
+
+    def compact_results(self, before, expires_at, prediction="normal"):
+        """Strip message text from old results with the given verdict, leaving expiring stubs"""
+        where = "prediction = ? AND processed_at < ? AND json_extract(doc, '$.compacted') IS NOT 1"
+        params = (prediction, _ts(before))
+        with self._transaction() as conn:
+            # Stubs have no text left to index
+            conn.execute(
+                f"DELETE FROM result_term_keys WHERE result_id IN (SELECT id FROM monitoring_results WHERE {where})",
+                params
+            )
+            return self._set_fields(
+                conn, "monitoring_results", where, params,
+                {"compacted": True, "expires_at": expires_at},
+                unset=("message_text",)
+            )
+
+    def iter_results_before(self, before, exclude_prediction="normal", batch_size=1000):
+        """Stream results processed before a cutoff (oldest first), skipping one verdict"""
+        last = ("", "")
+        while True:
+            with self._transaction() as conn:
+                rows = conn.execute(
+                    "SELECT id, processed_at, doc FROM monitoring_results "
+                    "WHERE processed_at < ? AND prediction IS NOT ? AND (processed_at, id) > (?, ?) "
+                    "ORDER BY processed_at, id LIMIT ?",
+                    (_ts(before), exclude_prediction, last[0], last[1], batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield _row_to_doc(row)
+            last = (rows[-1]["processed_at"], rows[-1]["id"])
+
+    def delete_results(self, result_ids):
+        """Delete results by id; returns the number removed"""
+        ids = [str(i) for i in result_ids]
+        deleted = 0
+        with self._transaction() as conn:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                deleted += conn.execute(
+                    f"DELETE FROM monitoring_results WHERE id IN ({', '.join('?' for _ in chunk)})", chunk
+                ).rowcount
+        return deleted
+
+    def purge_expired_results(self, now=None):
+        """Delete compacted stubs whose expires_at has passed"""
+        now = now or datetime.utcnow()
+        with self._transaction() as conn:
+            return conn.execute(
+                "DELETE FROM monitoring_results "
+                "WHERE json_extract(doc, '$.expires_at.\"$date\"') < ?", (_ts(now),)
+            ).rowcount
+
+    def iter_result_batches(self, after_id=None, batch_size=1000):
+        """Stream every result in _id order as lists of up to batch_size documents"""
+        # Hex ObjectIds sort the same way as the ids themselves
+        last = str(after_id) if after_id else ""
+        while True:
+            with self._transaction() as conn:
+                rows = conn.execute(
+                    "SELECT id, doc FROM monitoring_results WHERE id > ? ORDER BY id LIMIT ?",
+                    (last, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield [_row_to_doc(r) for r in rows]
+            last = rows[-1]["id"]
+
+    def bulk_update_results(self, updates):
+        """Apply [(result_id, fields)] $set updates in one transaction"""
+        modified = 0
+        with self._transaction() as conn:
+            for result_id, fields in updates:
+                modified += self._set_fields(conn, "monitoring_results", "id = ?", (str(result_id),), fields)
+        return modified
+
+    def iter_term_candidate_batches(self, terms, after_id=None, batch_size=1000):
+        """Results whose term keys could contain one of terms, in _id order"""
+        lookups = self._term_lookups(terms)
+        if lookups is None:
+            # A term the index cannot narrow down: every result is a candidate
+            yield from self.iter_result_batches(after_id, batch_size)
+            return
+        if not lookups:
+            return
+
+        last = str(after_id) if after_id else ""
+        while True:
+            with self._transaction() as conn:
+                # The next page of each term walks (term_key, result_id) from the last
+                # id on; the smallest batch_size ids of their union are the next page
+                ids = set()
+                for keys in lookups:
+                    also = "".join(" AND EXISTS (SELECT 1 FROM result_term_keys o "
+                                   "WHERE o.term_key = ? AND o.result_id = k.result_id)" for _ in keys[1:])
+                    ids.update(row[0] for row in conn.execute(
+                        f"SELECT k.result_id FROM result_term_keys k WHERE k.term_key = ? AND k.result_id > ?{also} "
+                        "ORDER BY k.result_id LIMIT ?", [keys[0], last] + keys[1:] + [batch_size]
+                    ))
+                page = sorted(ids)[:batch_size]
+                if not page:
+                    return
+                rows = conn.execute(
+                    f"SELECT id, doc FROM monitoring_results WHERE id IN ({', '.join('?' for _ in page)}) ORDER BY id",
+                    page
+                ).fetchall()
+            if rows:
+                yield [_row_to_doc(r) for r in rows]
+            last = page[-1]
+
+    def index_result_terms(self, batch_size=1000):
+        """Add term keys for results stored before the term index (or this version
+        of it) existed"""
+        indexed = 0
+        while True:
+            with self._transaction() as conn:
+                rows = conn.execute(
+                    "SELECT id, json_extract(doc, '$.message_text') AS text FROM monitoring_results r "
+                    "WHERE json_extract(doc, '$.message_text') <> '' "
+                    "AND NOT EXISTS (SELECT 1 FROM result_term_keys k WHERE k.result_id = r.id) LIMIT ?",
+                    (batch_size,)
+                ).fetchall()
+                for row in rows:
+                    self._insert_term_words(conn, text_words(row["text"]))
+                    self._insert_term_keys(conn, row["id"], text_grams(row["text"]))
+            if not rows:
+                return indexed
+            indexed += len(rows)
+
+    def estimated_result_count(self):
+        with self._transaction() as conn:
+            return conn.execute("SELECT COUNT(*) FROM monitoring_results").fetchone()[0]
+
+    def delete_new_alerts(self, results):
+        """Delete still-new alerts raised for these result documents"""
+        deleted = 0
+        with self._transaction() as conn:
+            for r in results:
+                deleted += conn.execute(
+                    "DELETE FROM alerts WHERE channel_id = ? AND status = 'new' "
+                    "AND json_extract(doc, '$.message_id') IS ?", (r["channel_id"], r.get("message_id"))
+                ).rowcount
+        return deleted
+
+    def _alerts_where(self, username, status):
+        where, params = ["username = ?"], [username]
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        return where, params
+
+    def get_alerts(self, username, status="new", limit=None):
+        """Get alerts for user's channels"""
+        where, params = self._alerts_where(username, status)
+        sql = f"SELECT id, doc FROM alerts WHERE {' AND '.join(where)} ORDER BY created_at DESC, id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._transaction() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [_row_to_doc(r) for r in rows]
+
+    def get_alerts_page(self, username, status="new", cursor=None, limit=None):
+        """Get one page of alerts (newest first) using (created_at, _id) keyset pagination.
+        Returns (alerts, next_cursor); next_cursor is None on the last page."""
+        limit = clamp_page_size(limit)
+        where, params = self._alerts_where(username, status)
+        if cursor:
+            timestamp, doc_id = decode_cursor(cursor)
+            where.append("(created_at, id) < (?, ?)")
+            params.extend([_ts(timestamp), str(doc_id)])
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT id, doc FROM alerts WHERE {' AND '.join(where)} "
+                "ORDER BY created_at DESC, id DESC LIMIT ?", params + [limit + 1]
+            ).fetchall()
+        return page_with_cursor([_row_to_doc(r) for r in rows], limit, "created_at")
+
+    def dismiss_alert(self, alert_id):
+        """Mark an alert as dismissed"""
+        if not ObjectId.is_valid(alert_id):
+            return False
+        with self._transaction() as conn:
+            matched = self._set_fields(conn, "alerts", "id = ?", (str(alert_id),),
+                                       {"status": "dismissed", "dismissed_at": datetime.utcnow()})
+        return matched > 0
+
+    def count_alerts(self, username, status="new"):
+        """Count alerts for user's channels"""
+        where, params = self._alerts_where(username, status)
+        with self._transaction() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM alerts WHERE {' AND '.join(where)}", params).fetchone()[0]
+
+    def get_alert_summary(self, username):
+        """Summary counts over all of a user's alerts (by status, high confidence, channels)"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*), "
+                "COALESCE(SUM(status = 'new'), 0), "
+                "COALESCE(SUM(status = 'dismissed'), 0), "
+                "COALESCE(SUM(confidence > 0.8), 0), "
+                "COUNT(DISTINCT channel_id) "
+                "FROM alerts WHERE username = ?", (username,)
+            ).fetchone()
+        return {
+            "total": row[0],
+            "new": row[1],
+            "dismissed": row[2],
+            "high_confidence": row[3],
+            "channels": row[4]
+        }
+
+    def backfill_alert_usernames(self):
+        """Write the owning username onto alerts that lack it"""
+        updated = 0
+        with self._transaction() as conn:
+            channels = conn.execute("SELECT id, username FROM channels").fetchall()
+            for channel in channels:
+                updated += self._set_fields(conn, "alerts", "channel_id = ? AND username IS NULL",
+                                            (channel["id"],), {"username": channel["username"]})
+        return updated
+
+    def count_alerts_without_username(self):
+        with self._transaction() as conn:
+            return conn.execute("SELECT COUNT(*) FROM alerts WHERE username IS NULL").fetchone()[0]
@@ -0,0 +1,659 @@
+import os
+import re
+import base64
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+import bcrypt
+from bson import ObjectId
+from bson.errors import InvalidId
+from cache import TTLCache
+from detection import text_grams, text_words, term_grams, term_word, categories_from_mask
+
+# Per-process user document cache
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '30'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+
+# Keyset pagination defaults
+DEFAULT_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = 500
+
+# Documents per round trip when streaming whole channels (exports)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+# Vocabulary words a short term may expand to before a targeted rescore
+# gives up narrowing it down and scans every result
+TERM_WORD_LIMIT = int(os.getenv('TERM_WORD_LIMIT', '1000'))
+
+# Meta key recording whether channel_stats_hourly counts every stored result
+STATS_META_KEY = "channel_stats"
+
+# Meta key recording when retention last compacted, archived or purged results
+RETENTION_META_KEY = "retention"
+
+# Ranked search results page by offset, so paging depth is capped
+SEARCH_MAX_DEPTH = int(os.getenv('SEARCH_MAX_DEPTH', '1000'))
+
+def parse_search_query(query):
+    """Split a search string into lowercase phrases: "quoted text" stays one
+    phrase, every other word is its own. A result must match all of them."""
+    phrases = []
+    for quoted, word in re.findall(r'"([^"]*)"|(\S+)', query or ''):
+        phrase = ' '.join((quoted or word.replace('"', '')).split()).lower()
+        if phrase:
+            phrases.append(phrase)
+    return phrases
+
+def project_fields(doc, fields):
+    """Keep only the given top-level fields (and _id) of a document"""
+    if not fields:
+        return doc
+    return {key: value for key, value in doc.items() if key == "_id" or key in fields}
+
+def encode_cursor(timestamp, doc_id):
+    """Encode a (timestamp, _id) position as an opaque URL-safe cursor"""
+    raw = f"{timestamp.isoformat()}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor into (datetime, ObjectId)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        timestamp, doc_id = raw.split('|', 1)
+        return datetime.fromisoformat(timestamp), ObjectId(doc_id)
+    except (ValueError, InvalidId, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def clamp_page_size(limit):
+    """Keep requested page sizes within sane bounds"""
+    if not limit:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+def page_key(date_from=None, date_to=None):
+    """Field result pages are keyed on: the message date when the page is
+    filtered by date (so the range is an index range), else processed_at"""
+    return "date" if date_from or date_to else "processed_at"
+
+def page_with_cursor(docs, limit, field):
+    """Trim a limit+1 fetch to one page and build the cursor for the next one"""
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        return docs, encode_cursor(last[field], last["_id"])
+    return docs, None
+
+def to_utc_naive(value):
+    """Normalize datetimes the way PyMongo returns them (naive UTC)"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def json_default(value):
+    """json.dumps hook for document values JSON can't represent natively"""
+    if isinstance(value, datetime):
+        return {"$date": to_utc_naive(value).isoformat(timespec='microseconds')}
+    if isinstance(value, bytes):
+        return {"$bytes": base64.b64encode(value).decode('ascii')}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"Cannot serialize {type(value).__name__} in a stored document")
+
+def json_object_hook(obj):
+    """json.loads hook reversing json_default"""
+    if len(obj) == 1:
+        if "$date" in obj:
+            return datetime.fromisoformat(obj["$date"])
+        if "$bytes" in obj:
+            return base64.b64decode(obj["$bytes"])
+        if "$oid" in obj:
+            return ObjectId(obj["$oid"])
+    return obj
+
+def stats_hour(result_doc):
+    """Hour bucket a result is counted in (message time, else processing time)"""
+    when = result_doc.get("date")
+    if not isinstance(when, datetime):
+        when = result_doc["processed_at"]
+    return to_utc_naive(when).replace(minute=0, second=0, microsecond=0)
+
+def stats_increments(result_doc, sign=1):
+    """Rollup counters one result contributes, keyed "total", "confidence_sum"
+    or "<group>.<name>" for the predictions/categories/terms groups"""
+    increments = {
+        "total": sign,
+        f"predictions.{result_doc.get('prediction') or 'unknown'}": sign,
+        "confidence_sum": sign * float(result_doc.get("confidence") or 0)
+    }
+    features = result_doc.get("features") or {}
+    for category in categories_from_mask(features.get("category_mask", 0)):
+        increments[f"categories.{category}"] = sign
+    for tid in features.get("term_ids", []):
+        increments[f"terms.{tid}"] = sign
+    return increments
+
+def empty_stats():
+    return {"total": 0, "predictions": {}, "categories": {}, "terms": {}, "confidence_sum": 0.0}
+
+def add_stats(summary, counters):
+    """Add flat rollup counters (as produced by stats_increments) into a summary"""
+    for key, value in counters.items():
+        if "." in key:
+            group, name = key.split(".", 1)
+            summary[group][name] = summary[group].get(name, 0) + int(value)
+        elif key == "confidence_sum":
+            summary[key] += value
+        else:
+            summary[key] += int(value)
+    return summary
+
+def finish_stats(summary):
+    summary["avg_confidence"] = summary["confidence_sum"] / summary["total"] if summary["total"] else 0.0
+    return summary
+
+class StorageBackend(ABC):
+    """Storage interface for users, channels, monitoring results and alerts.
+
+    Document shapes, validation and caching live here; subclasses only
+    implement the primitive reads and writes (abstract, so a backend missing
+    one fails when it is instantiated). Documents are plain dicts keyed
+    like the MongoDB collections, with ObjectId `_id` values and naive UTC
+    datetimes, whichever backend produced them. Backends: `database.Database`
+    (MongoDB) and `sqlite_storage.SQLiteDatabase` (embedded SQLite / in-memory),
+    chosen by `database.create_database()`.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self._init_caches()
+
+    def _init_caches(self):
+        self.user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, name="users")
+        # Channel ownership never changes, so owners can be cached for a long time
+        self.channel_owner_cache = TTLCache(maxsize=4096, ttl=3600, name="channel_owners")
+        # Words known to be in the term vocabulary, so saves rarely write it
+        self.term_word_cache = TTLCache(maxsize=100000, ttl=3600, name="term_words")
+        self._warned_incomplete_stats = False
+
+    def reset_after_fork(self):
+        """Drop state inherited from the parent process (call in the child after fork)"""
+        self._init_caches()
+
+    def create_user(self, username, password, api_id, api_hash):
+        """Create a new user with hashed password"""
+        if self._find_user(username):
+            return False, "Username already exists"
+
+        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+        user_doc = {
+            "username": username,
+            "password": hashed_password,
+            "api_id": api_id,
+            "api_hash": api_hash,
+            "telegram_linked": False,
+            "phone_number": None,
+            "created_at": datetime.utcnow()
+        }
+
+        inserted_id = self._insert_user(user_doc)
+        self.user_cache.invalidate(username)
+        return True, str(inserted_id)
+
+    def verify_user(self, username, password):
+        """Verify user login credentials"""
+        user = self._find_user(username)
+        if user and bcrypt.checkpw(password.encode('utf-8'), user['password']):
+            return True, user
+        return False, None
+
+    def update_telegram_link(self, username, phone_number):
+        """Update user's Telegram linking status"""
+        modified = self._update_user(username, {
+            "telegram_linked": True,
+            "phone_number": phone_number,
+            "linked_at": datetime.utcnow()
+        })
+        self.user_cache.invalidate(username)
+        return modified
+
+    def clear_telegram_link(self, username):
+        """Reset user's Telegram linking status (used on logout)"""
+        modified = self._update_user(username, {"telegram_linked": False, "phone_number": None})
+        self.user_cache.invalidate(username)
+        return modified
+
+    def update_credentials(self, username, api_id, api_hash):
+        """Replace user's Telegram API credentials"""
+        modified = self._update_user(username, {
+            "api_id": api_id,
+            "api_hash": api_hash,
+            "credentials_updated_at": datetime.utcnow()
+        })
+        self.user_cache.invalidate(username)
+        return modified
+
+    def get_user_by_username(self, username):
+        """Get user document by username (read-through cached per process)"""
+        user = self.user_cache.get(username)
+        if user is None:
+            user = self._find_user(username)
+            if user is None:
+                return None
+            self.user_cache.set(username, user)
+        # Hand out a copy so callers can't mutate the cached document
+        return dict(user)
+
+    def add_channel(self, username, channel_link, channel_name=None):
+        """Add a channel to monitor"""
+        # Check if channel already exists for this user
+        existing = self._find_channel_by_link(username, channel_link)
+
+        if existing:
+            return str(existing['_id'])
+
+        # Extract channel name from link if not provided
+        if not channel_name:
+            channel_name = channel_link.split('/')[-1]
+            if channel_name.startswith('@'):
+                channel_name = channel_name[1:]
+
+        channel_doc = {
+            "username": username,
+            "channel_link": channel_link,
+            "channel_name": channel_name,
+            "status": "active",
+            "added_at": datetime.utcnow(),
+            "last_monitored": None
+        }
+
+        return str(self._insert_channel(channel_doc))
+
+    def get_channel_owner(self, channel_id):
+        """Get the username owning a channel (cached)"""
+        owner = self.channel_owner_cache.get(channel_id)
+        if owner is None:
+            channel = self.get_channel(channel_id)
+            if not channel:
+                return None
+            owner = channel["username"]
+            self.channel_owner_cache.set(channel_id, owner)
+        return owner
+
+    def save_monitoring_result(self, channel_id, message_data, username=None):
+        """Save monitoring results"""
+        now = datetime.utcnow()
+        result_doc = {
+            "channel_id": channel_id,
+            "message_id": message_data.get("message_id"),
+            "sender_id": message_data.get("sender_id"),
+            "date": message_data.get("date"),
+            "message_text": message_data.get("message_text"),
+            "prediction": message_data.get("prediction"),
+            "confidence": message_data.get("confidence"),
+            "is_suspicious": message_data.get("prediction") == "drug sale",
+            # Detection output kept so exports and views don't re-scan the text
+            "keyword_matches": message_data.get("keyword_matches") or [],
+            "features": message_data.get("features"),
+            "processed_at": now,
+            # Bumped whenever the verdict changes (rescore); delta exports key on it
+            "updated_at": now,
+            # Term index entries, used to find rows affected by lexicon changes
+            "term_keys": text_grams(message_data.get("message_text"))
+        }
+
+        # Vocabulary first: a result must never hold a word lookups can't reach
+        self.add_term_words(text_words(message_data.get("message_text")))
+        inserted_id = self._insert_result(result_doc)
+        self.add_results_to_stats([result_doc])
+
+        # Create alert if suspicious
+        if message_data.get("prediction") == "drug sale":
+            self.create_alert(channel_id, result_doc, username)
+
+        return str(inserted_id)
+
+    def create_alert(self, channel_id, message_data, username=None):
+        """Create an alert for suspicious activity"""
+        return str(self._insert_alert(self._alert_doc(channel_id, message_data, username)))
+
+    def create_alerts(self, results):
+        """Create alerts for a batch of result documents in a single write"""
+        if not results:
+            return 0
+        return self._insert_alerts([self._alert_doc(r["channel_id"], r) for r in results])
+
+    def _alert_doc(self, channel_id, message_data, username=None):
+        return {
+            "channel_id": channel_id,
+            # Denormalized so a user's alerts are a single indexed range scan
+            "username": username or self.get_channel_owner(channel_id),
+            "message_id": message_data.get("message_id"),
+            "alert_type": "drug_sale_detected",
+            "confidence": message_data.get("confidence"),
+            "message_text": message_data.get("message_text"),
+            "status": "new",
+            "created_at": datetime.utcnow()
+        }
+
+    def add_known_image(self, image_info, label, confidence=None, source=None, username=None):
+        """Add an analyzed image (see image_analysis) to the known-advertisement
+        index and return its document; None if the same sha256 is already there"""
+        image_doc = {
+            "sha256": image_info["sha256"],
+            "dhash": image_info["dhash"],
+            "phash": image_info["phash"],
+            "label": label,
+            "confidence": confidence,
+            "source": source,
+            "username": username,
+            "created_at": datetime.utcnow()
+        }
+        return image_doc if self._insert_known_image(image_doc) else None
+
+    def add_results_to_stats(self, results, sign=1):
+        """Count results into channel_stats_hourly (sign=-1 takes them back out)"""
+        self.update_stats([(result, sign) for result in results])
+
+    def update_stats(self, changes):
+        """Apply [(result_doc, sign)] to the hourly rollups in one batched write"""
+        increments = {}
+        for result, sign in changes:
+            bucket = increments.setdefault((result["channel_id"], stats_hour(result)), {})
+            for key, value in stats_increments(result, sign).items():
+                bucket[key] = bucket.get(key, 0) + value
+        if increments:
+            self._inc_channel_stats(increments)
+
+    def add_term_words(self, words):
+        """Add words of indexed results to the term vocabulary"""
+        new_words = sorted(word for word in words if self.term_word_cache.get(word) is None)
+        if new_words:
+            self._add_term_words(new_words)
+            for word in new_words:
+                self.term_word_cache.set(word, True)
+
+    def _term_lookups(self, terms):
+        """Key sets for iter_term_candidate_batches: a result is a candidate if it
+        has every key of one of them. Single-word terms expand to one set per
+        vocabulary word containing them (far more selective than a trigram or
+        two); other terms use their winnowed trigrams. None if a term can't be
+        narrowed down."""
+        lookups = []
+        for term in terms:
+            word = term_word(term)
+            if word is not None:
+                words = self._find_term_words(word, TERM_WORD_LIMIT + 1)
+                if len(words) <= TERM_WORD_LIMIT:
+                    lookups.extend([w] for w in words)
+                    continue
+            keys = term_grams(term)
+            if keys is None:
+                return None
+            lookups.append(keys)
+        return lookups
+
+    def stats_complete(self):
+        """True once the rollups count every stored result: set when a store is
+        created empty and by rebuild_channel_stats.py on existing ones"""
+        return bool((self._get_meta(STATS_META_KEY) or {}).get("complete"))
+
+    def set_stats_complete(self, complete=True):
+        self._set_meta(STATS_META_KEY, {"complete": complete, "updated_at": datetime.utcnow()})
+
+    def last_retention_run(self):
+        """When apply_retention last ran against this store (None if never); its
+        compaction, archiving and purges don't move updated_at"""
+        return (self._get_meta(RETENTION_META_KEY) or {}).get("ran_at")
+
+    def set_retention_run(self, ran_at=None):
+        self._set_meta(RETENTION_META_KEY, {"ran_at": ran_at or datetime.utcnow()})
+
+    def _stats_rows(self, channel_ids, start=None, end=None):
+        """(channel_id, hour, counters) from the rollups, or counted from the live
+        results while rollups are incomplete (results saved before they existed)"""
+        if self.stats_complete():
+            return self._find_channel_stats(channel_ids, start, end)
+        if not self._warned_incomplete_stats:
+            self._warned_incomplete_stats = True
+            print("⚠️ Hourly rollups are incomplete; counting results instead (run rebuild_channel_stats.py)")
+        return self._count_live_stats(channel_ids, start, end)
+
+    def _count_live_stats(self, channel_ids, start=None, end=None):
+        fields = ["channel_id", "date", "processed_at", "prediction", "confidence", "features"]
+        for channel_id in channel_ids:
+            for result in self.iter_changed_results(channel_id, fields=fields):
+                hour = stats_hour(result)
+                if (start is None or hour >= start) and (end is None or hour < end):
+                    yield channel_id, hour, stats_increments(result)
+
+    def get_channel_stats(self, channel_ids, start=None, end=None):
+        """Summed hourly rollups per channel over [start, end):
+        {channel_id: {total, predictions, categories, terms, confidence_sum, avg_confidence}}.
+        Rollups outlive retention, so counts include compacted and archived results."""
+        stats = {channel_id: empty_stats() for channel_id in channel_ids}
+        for channel_id, _, counters in self._stats_rows(channel_ids, start, end):
+            add_stats(stats[channel_id], counters)
+        return {channel_id: finish_stats(summary) for channel_id, summary in stats.items()}
+
+    def get_stats_series(self, channel_ids, start=None, end=None, bucket="day"):
+        """Rollups across channels summed per hour or day, oldest first (for trend charts)"""
+        series = {}
+        for _, hour, counters in self._stats_rows(channel_ids, start, end):
+            period = hour if bucket == "hour" else hour.replace(hour=0)
+            add_stats(series.setdefault(period, empty_stats()), counters)
+        return [dict(finish_stats(summary), period=period) for period, summary in sorted(series.items())]
+
+    # Primitive reads and writes implemented by each backend
+
+    @abstractmethod
+    def _find_user(self, username):
+        """User document for username, or None"""
+
+    @abstractmethod
+    def _insert_user(self, user_doc):
+        """Insert a user document and return its id"""
+
+    @abstractmethod
+    def _update_user(self, username, fields):
+        """$set fields on a user and return the number of documents modified"""
+
+    @abstractmethod
+    def _find_channel_by_link(self, username, channel_link):
+        """A user's channel document with this link, or None"""
+
+    @abstractmethod
+    def _insert_channel(self, channel_doc):
+        """Insert a channel document and return its id"""
+
+    @abstractmethod
+    def _insert_result(self, result_doc):
+        """Insert a result document, set its `_id` and return it"""
+
+    @abstractmethod
+    def _insert_alert(self, alert_doc):
+        """Insert an alert document and return its id"""
+
+    @abstractmethod
+    def _insert_alerts(self, alert_docs):
+        """Insert several alert documents and return how many were written"""
+
+    @abstractmethod
+    def _inc_channel_stats(self, increments):
+        """Upsert-increment rollups: {(channel_id, hour): {counter: amount}}"""
+
+    @abstractmethod
+    def _find_channel_stats(self, channel_ids, start=None, end=None):
+        """Yield (channel_id, hour, flat counters) for rollups with start <= hour < end"""
+
+    @abstractmethod
+    def clear_channel_stats(self):
+        """Drop every rollup (before a rebuild); returns the number of buckets removed"""
+
+    @abstractmethod
+    def _add_term_words(self, words):
+        """Insert words into the term vocabulary, skipping those already there"""
+
+    @abstractmethod
+    def _find_term_words(self, word, limit):
+        """Up to limit vocabulary words containing word"""
+
+    @abstractmethod
+    def _get_meta(self, key):
+        """Stored bookkeeping document for key (e.g. rollup state), or None"""
+
+    @abstractmethod
+    def _set_meta(self, key, doc):
+        """Store the bookkeeping document for key, replacing any previous one"""
+
+    @abstractmethod
+    def _insert_known_image(self, image_doc):
+        """Insert a known image unless its sha256 exists; True if inserted (and `_id` set)"""
+
+    @abstractmethod
+    def iter_known_images(self, since=None):
+        """Yield known images oldest first, only those created after since if given"""
+
+    @abstractmethod
+    def get_user_channels(self, username):
+        """Get all channels for a user"""
+
+    @abstractmethod
+    def get_channel(self, channel_id, username=None):
+        """Get a channel by id (optionally requiring an owner); None if missing or malformed"""
+
+    @abstractmethod
+    def remove_channel(self, channel_id, username):
+        """Delete a user's channel with its results and alerts; True if it existed"""
+
+    @abstractmethod
+    def update_channel_status(self, channel_id, status, last_monitored=None):
+        """Update channel monitoring status"""
+
+    @abstractmethod
+    def get_monitoring_results(self, channel_id, limit=100):
+        """Get the newest monitoring results for a channel"""
+
+    @abstractmethod
+    def get_all_monitoring_results(self, channel_id):
+        """Get all monitoring results for a channel (no limit)"""
+
+    @abstractmethod
+    def iter_monitoring_results(self, channel_id, fields=None, batch_size=EXPORT_BATCH_SIZE,
+                                date_from=None, date_to=None):
+        """Stream a channel's results newest first, fetching batch_size documents
+        at a time; fields limits each document to those top-level fields and
+        date_from/date_to filter on the message date as paging does"""
+
+    @abstractmethod
+    def iter_changed_results(self, channel_id, since=None, until=None, fields=None,
+                             batch_size=EXPORT_BATCH_SIZE, date_from=None, date_to=None):
+        """Stream a channel's results added or changed after the (updated_at, _id)
+        position since and at or before until, oldest change first. Compaction
+        and archiving don't count as changes."""
+
+    @abstractmethod
+    def backfill_result_updated_at(self):
+        """Give results saved before updated_at existed updated_at = processed_at;
+        returns the number updated"""
+
+    @abstractmethod
+    def get_monitoring_results_page(self, channel_id, cursor=None, limit=None, prediction=None,
+                                    min_confidence=None, date_from=None, date_to=None):
+        """Get one page of results (newest first) using (processed_at, _id) keyset pagination,
+        or (date, _id) when filtered by date (see page_key).
+        Returns (results, next_cursor); next_cursor is None on the last page."""
+
+    @abstractmethod
+    def count_results(self, channel_id, prediction=None, compacted=None):
+        """Count a channel's results, optionally for a single prediction label
+        and only compacted stubs (compacted=True) or only full results (False)"""
+
+    @abstractmethod
+    def search_results(self, query, channel_ids, prediction=None, min_confidence=None,
+                       date_from=None, date_to=None, offset=0, limit=None):
+        """Full-text search over message text in the given channels, best match
+        first (ties newest first). query follows parse_search_query; each result
+        carries a backend-specific relevance `score`. Returns (results, has_more)."""
+
+    @abstractmethod
+    def compact_results(self, before, expires_at, prediction="normal"):
+        """Strip message text from results with this verdict processed before `before`,
+        marking them compacted and expiring at `expires_at`; returns the number compacted"""
+
+    @abstractmethod
+    def iter_results_before(self, before, exclude_prediction="normal", batch_size=1000):
+        """Stream results processed before a cutoff (oldest first), skipping one verdict"""
+
+    @abstractmethod
+    def delete_results(self, result_ids):
+        """Delete results by id; returns the number removed"""
+
+    @abstractmethod
+    def purge_expired_results(self, now=None):
+        """Delete compacted stubs whose expires_at has passed; returns the number removed"""
+
+    @abstractmethod
+    def iter_result_batches(self, after_id=None, batch_size=1000):
+        """Stream every result in _id order as lists of up to batch_size documents,
+        starting after after_id (for resumable full scans)"""
+
+    @abstractmethod
+    def bulk_update_results(self, updates):
+        """Apply [(result_id, fields)] $set updates in one batch; returns the number modified"""
+
+    @abstractmethod
+    def iter_term_candidate_batches(self, terms, after_id=None, batch_size=1000):
+        """Like iter_result_batches, but only results whose text may contain one of
+        terms according to the term index (a superset: callers re-check the text)"""
+
+    @abstractmethod
+    def index_result_terms(self, batch_size=1000):
+        """Add term index entries for results stored before the index existed;
+        returns the number of results indexed"""
+
+    @abstractmethod
+    def estimated_result_count(self):
+        """Approximate number of stored results across all channels"""
+
+    @abstractmethod
+    def delete_new_alerts(self, results):
+        """Delete still-new alerts raised for these result documents; returns the number removed"""
+
+    @abstractmethod
+    def get_alerts(self, username, status="new", limit=None):
+        """Get a user's alerts, newest first"""
+
+    @abstractmethod
+    def get_alerts_page(self, username, status="new", cursor=None, limit=None):
+        """Get one page of alerts (newest first) using (created_at, _id) keyset pagination.
+        Returns (alerts, next_cursor); next_cursor is None on the last page."""
+
+    @abstractmethod
+    def count_alerts(self, username, status="new"):
+        """Count a user's alerts"""
+
+    @abstractmethod
+    def get_alert_summary(self, username):
+        """Summary counts over all of a user's alerts (by status, high confidence, channels)"""
+
+    @abstractmethod
+    def dismiss_alert(self, alert_id):
+        """Mark an alert as dismissed; True if it existed"""
+
+    @abstractmethod
+    def backfill_alert_usernames(self):
+        """Write the owning username onto alerts that lack it; returns the number updated"""
+
+    @abstractmethod
+    def count_alerts_without_username(self):
+        """Alerts that have no owning username yet (see backfill_alert_usernames)"""
+
+    @abstractmethod
+    def ping(self):
+        """Raise if the backend is unreachable"""
+
+    @abstractmethod
+    def close(self):
+        """Release connections held by this process"""
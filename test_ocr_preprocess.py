@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+OCR preprocessing tests
+Checks thresholding, text-region detection and page segmentation modes on
+synthetic images, and that an image without text-like regions still reaches
+Tesseract as a whole (Tesseract itself is replaced by a recorder).
+"""
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+import ocr
+import ocr_preprocess
+from ocr_preprocess import (CELL, PSM_AUTO, PSM_BLOCK, PSM_COLUMN, PSM_LINE, ocr_plan, otsu_threshold,
+                            page_segmentation_mode, text_regions)
+
+def _font(size):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default()
+
+def _photo_with_caption():
+    """A text-free blurred photo with one caption line drawn near the top"""
+    photo = Image.effect_noise((1600, 1000), 30).convert("L").filter(ImageFilter.GaussianBlur(3))
+    ImageDraw.Draw(photo).text((100, 120), "PREMIUM QUALITY DM FOR PRICE", font=_font(48), fill=255)
+    return photo
+
+def check_otsu_threshold():
+    # Two well-separated grey levels: the threshold falls between them
+    pixels = np.array([40] * 500 + [200] * 300, dtype=np.uint8)
+    threshold = otsu_threshold(pixels)
+    assert 40 <= threshold < 200
+    assert (pixels <= threshold).sum() == 500
+
+def check_text_regions():
+    pixels = np.asarray(_photo_with_caption())
+    boxes = text_regions(pixels)
+    assert len(boxes) == 1
+    left, top, right, bottom = boxes[0]
+    # The caption's box, on the cell grid
+    assert left <= 100 < right and top <= 120 < bottom
+    assert bottom - top <= 6 * CELL
+    assert left % CELL == 0 and top % CELL == 0
+
+    blank = np.asarray(Image.effect_noise((800, 600), 30).convert("L").filter(ImageFilter.GaussianBlur(3)))
+    assert text_regions(blank) == []
+
+    # Straight borders (chat bubbles, buttons) are not text
+    bubble = Image.new("L", (1080, 600), 18)
+    ImageDraw.Draw(bubble).rounded_rectangle((40, 200, 1000, 380), 30, fill=74)
+    assert text_regions(np.asarray(bubble)) == []
+
+def check_page_segmentation_mode():
+    assert page_segmentation_mode((0, 0, 800, 64)) == PSM_LINE
+    # Too tall for one line, or too narrow for its height
+    assert page_segmentation_mode((0, 0, 800, 400)) == PSM_BLOCK
+    assert page_segmentation_mode((0, 0, 120, 64)) == PSM_BLOCK
+
+def check_ocr_plan():
+    plan = ocr_plan(_photo_with_caption())
+    assert [psm for _, psm in plan] == [PSM_LINE]
+    crop = np.asarray(plan[0][0])
+    # Binarized, black text on white
+    assert set(np.unique(crop)) <= {0, 255}
+    assert (crop == 255).mean() > 0.5
+
+    page = Image.new("L", (1240, 1754), 255)
+    draw = ImageDraw.Draw(page)
+    for row in range(30):
+        draw.text((40, 40 + 56 * row), "cash on delivery bulk discount for resellers " * 2, font=_font(32), fill=0)
+    assert [psm for _, psm in ocr_plan(page)] == [PSM_AUTO]
+
+    # Several blocks: stacked into one image, so Tesseract starts once
+    dark = Image.new("RGB", (1080, 1200), (18, 18, 24))
+    draw = ImageDraw.Draw(dark)
+    for row in range(2):
+        draw.rounded_rectangle((40, 200 + 400 * row, 1000, 380 + 400 * row), 30, fill=(43, 82, 120))
+        draw.text((80, 260 + 400 * row), "stealth shipping all india", font=_font(44), fill=(235, 235, 235))
+    plan = ocr_plan(dark)
+    assert [psm for _, psm in plan] == [PSM_COLUMN]
+    stacked = np.asarray(plan[0][0])
+    assert set(np.unique(stacked)) <= {0, 255} and (stacked == 255).mean() > 0.5
+
+class _RecordingTesseract:
+    """Stands in for pytesseract and records what it was asked to OCR"""
+
+    class TesseractNotFoundError(Exception):
+        pass
+
+    def __init__(self):
+        self.calls = []
+
+    def image_to_string(self, image, lang='eng', config='', timeout=0):
+        self.calls.append((image.size, image.mode, config))
+        return "text"
+
+def _run_with_recorder(im, preprocess):
+    saved = ocr.pytesseract, ocr._tesseract_info, ocr.OCR_PREPROCESS
+    recorder = _RecordingTesseract()
+    ocr.pytesseract, ocr._tesseract_info = recorder, {"available": True, "error": None}
+    ocr.OCR_PREPROCESS = preprocess
+    try:
+        return ocr._run_tesseract(im, "eng"), recorder.calls
+    finally:
+        ocr.pytesseract, ocr._tesseract_info, ocr.OCR_PREPROCESS = saved
+
+def check_empty_plan_falls_back_to_whole_image():
+    blank = Image.new("RGB", (900, 700), (200, 200, 200))
+    assert ocr_plan(blank) == []
+    result, calls = _run_with_recorder(blank, preprocess=True)
+    assert result["ok"] and result["text"] == "text" and result["regions"] == 0
+    assert calls == [((900, 700), "RGB", "")]
+
+    result, calls = _run_with_recorder(_photo_with_caption(), preprocess=True)
+    assert result["regions"] == 1
+    assert len(calls) == 1 and calls[0][1] == "L" and calls[0][2] == f"--psm {PSM_LINE}"
+
+    result, calls = _run_with_recorder(_photo_with_caption(), preprocess=False)
+    assert "regions" not in result
+    assert calls == [((1600, 1000), "RGB", "")]
+
+def test_otsu_threshold():
+    check_otsu_threshold()
+
+def test_text_regions():
+    check_text_regions()
+
+def test_page_segmentation_mode():
+    check_page_segmentation_mode()
+
+def test_ocr_plan():
+    check_ocr_plan()
+
+def test_empty_plan_falls_back_to_whole_image():
+    check_empty_plan_falls_back_to_whole_image()
+
+if __name__ == "__main__":
+    checks = [check_otsu_threshold, check_text_regions, check_page_segmentation_mode, check_ocr_plan,
+              check_empty_plan_falls_back_to_whole_image]
+    failures = 0
+    print(f"🔎 OCR preprocessing (version {ocr_preprocess.VERSION})")
+    for check in checks:
+        try:
+            check()
+            print(f"  ✅ {check.__name__}")
+        except Exception as e:
+            failures += 1
+            print(f"  ❌ {check.__name__}: {e!r}")
+    print("✅ All OCR preprocessing checks passed" if not failures else f"❌ {failures} checks failed")
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Storage backend contract tests
+Runs the same checks against every backend: the embedded SQLite store
+always, and MongoDB as well when MONGODB_URI is set (a scratch database is
+created for the run and dropped afterwards).
+"""
+
+import os
+import json
+import gzip
+import uuid
+from datetime import datetime, timedelta
+
+def _backends():
+    """Yield a fresh, empty store for each available backend"""
+    from sqlite_storage import SQLiteDatabase
+    store = SQLiteDatabase(':memory:')
+    try:
+        yield store
+    finally:
+        store.close()
+
+    if os.getenv('MONGODB_URI'):
+        from database import Database
+        name = f"trinetra_contract_{uuid.uuid4().hex[:8]}"
+        store = Database(database_name=name)
+        try:
+            yield store
+        finally:
+            store.client.drop_database(name)
+            store.close()
+
+def _add_results(store, channel_id, count, start=datetime(2024, 1, 1)):
+    """Insert count results, every third one a drug sale"""
+    for i in range(count):
+        store.save_monitoring_result(channel_id, {
+            "message_id": i,
+            "sender_id": 42,
+            "date": start + timedelta(hours=i),
+            "message_text": f"message {i}",
+            "prediction": "drug sale" if i % 3 == 0 else "normal",
+            "confidence": 0.9 if i % 3 == 0 else 0.4
+        })
+
+def check_users(store):
+    ok, user_id = store.create_user("alice", "secret1", 123, "hash")
+    assert ok and user_id
+    assert store.create_user("alice", "other", 1, "x") == (False, "Username already exists")
+
+    assert store.verify_user("alice", "secret1")[0]
+    assert store.verify_user("alice", "wrong") == (False, None)
+    assert store.verify_user("nobody", "secret1") == (False, None)
+
+    user = store.get_user_by_username("alice")
+    assert user["api_id"] == 123 and user["telegram_linked"] is False
+    user["api_id"] = 999
+    assert store.get_user_by_username("alice")["api_id"] == 123
+
+    store.update_telegram_link("alice", "+919876543210")
+    user = store.get_user_by_username("alice")
+    assert user["telegram_linked"] is True and user["phone_number"] == "+919876543210"
+
+    store.clear_telegram_link("alice")
+    assert store.get_user_by_username("alice")["telegram_linked"] is False
+
+    store.update_credentials("alice", 456, "newhash")
+    assert store.get_user_by_username("alice")["api_hash"] == "newhash"
+    assert store.get_user_by_username("nobody") is None
+
+def check_channels(store):
+    channel_id = store.add_channel("bob", "https://t.me/somechannel")
+    assert store.add_channel("bob", "https://t.me/somechannel") == channel_id
+    other_id = store.add_channel("carol", "https://t.me/somechannel")
+    assert other_id != channel_id
+
+    channel = store.get_channel(channel_id, "bob")
+    assert channel["channel_name"] == "somechannel" and str(channel["_id"]) == channel_id
+    assert store.get_channel(channel_id, "carol") is None
+    assert store.get_channel("not-an-id") is None
+    assert store.get_channel_owner(channel_id) == "bob"
+    assert [str(c["_id"]) for c in store.get_user_channels("bob")] == [channel_id]
+
+    monitored_at = datetime(2024, 2, 1, 12, 0)
+    store.update_channel_status(channel_id, "monitored", monitored_at)
+    channel = store.get_channel(channel_id)
+    assert channel["status"] == "monitored" and channel["last_monitored"] == monitored_at
+
+    _add_results(store, channel_id, 3)
+    assert not store.remove_channel(channel_id, "carol")
+    assert store.remove_channel(channel_id, "bob")
+    assert store.get_channel(channel_id) is None
+    assert store.count_results(channel_id) == 0
+    assert store.count_alerts("bob", None) == 0
+
+def check_results_pagination(store):
+    channel_id = store.add_channel("dave", "https://t.me/pages")
+    _add_results(store, channel_id, 25)
+
+    assert store.count_results(channel_id) == 25
+    assert store.count_results(channel_id, "drug sale") == 9
+    assert len(store.get_monitoring_results(channel_id, limit=10)) == 10
+    assert len(store.get_all_monitoring_results(channel_id)) == 25
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.get_monitoring_results_page(channel_id, cursor=cursor, limit=7)
+        seen.extend(page)
+        if not cursor:
+            break
+    assert len(seen) == 25 and len({r["_id"] for r in seen}) == 25
+    keys = [(r["processed_at"], r["_id"]) for r in seen]
+    assert keys == sorted(keys, reverse=True)
+
+    streamed = list(store.iter_monitoring_results(channel_id, fields=("prediction", "processed_at"), batch_size=4))
+    assert [(r["processed_at"], r["_id"]) for r in streamed] == keys
+    assert all(set(r) == {"_id", "prediction", "processed_at"} for r in streamed)
+
+    page, cursor = store.get_monitoring_results_page(channel_id, prediction="drug sale", limit=100)
+    assert len(page) == 9 and cursor is None
+    page, _ = store.get_monitoring_results_page(channel_id, min_confidence=0.5, limit=100)
+    assert len(page) == 9
+    page, _ = store.get_monitoring_results_page(
+        channel_id, date_from=datetime(2024, 1, 1, 5), date_to=datetime(2024, 1, 1, 10), limit=100
+    )
+    assert sorted(r["message_id"] for r in page) == [5, 6, 7, 8, 9]
+    # Date-filtered pages are keyed on the message date
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.get_monitoring_results_page(
+            channel_id, cursor=cursor, date_from=datetime(2024, 1, 1, 5), date_to=datetime(2024, 1, 1, 10), limit=2
+        )
+        seen.extend(page)
+        if not cursor:
+            break
+    assert [r["message_id"] for r in seen] == [9, 8, 7, 6, 5]
+    streamed = store.iter_monitoring_results(
+        channel_id, date_from=datetime(2024, 1, 1, 5), date_to=datetime(2024, 1, 1, 10), batch_size=2
+    )
+    assert sorted(r["message_id"] for r in streamed) == [5, 6, 7, 8, 9]
+
+    features = {"engine_version": "1+test", "term_ids": [7, 9], "term_positions": [0, 4],
+                "category_mask": 5, "label_scores": {"drug sale": 0.8}}
+    store.save_monitoring_result(channel_id, {
+        "message_id": 99, "date": datetime(2024, 1, 1), "message_text": "mdma dm",
+        "prediction": "normal", "confidence": 0.5, "keyword_matches": ["mdma"], "features": features
+    })
+    stored = store.get_monitoring_results(channel_id, limit=1)[0]
+    assert stored["features"] == features and stored["keyword_matches"] == ["mdma"]
+
+    try:
+        store.get_monitoring_results_page(channel_id, cursor="garbage")
+        assert False, "invalid cursor accepted"
+    except ValueError:
+        pass
+
+def check_alerts(store):
+    channel_id = store.add_channel("erin", "https://t.me/alerts")
+    _add_results(store, channel_id, 12)
+
+    assert store.count_alerts("erin") == 4
+    alerts = store.get_alerts("erin")
+    assert len(alerts) == 4 and all(a["username"] == "erin" for a in alerts)
+    assert len(store.get_alerts("erin", limit=2)) == 2
+
+    first, cursor = store.get_alerts_page("erin", limit=3)
+    rest, last_cursor = store.get_alerts_page("erin", cursor=cursor, limit=3)
+    assert len(first) == 3 and len(rest) == 1 and last_cursor is None
+
+    assert store.dismiss_alert(str(alerts[0]["_id"]))
+    assert not store.dismiss_alert("not-an-id")
+    assert store.count_alerts("erin", "new") == 3
+    assert store.count_alerts("erin", "dismissed") == 1
+    assert store.count_alerts("erin", None) == 4
+
+    summary = store.get_alert_summary("erin")
+    assert summary == {"total": 4, "new": 3, "dismissed": 1, "high_confidence": 4, "channels": 1}
+    assert store.get_alert_summary("nobody")["total"] == 0
+    assert store.backfill_alert_usernames() == 0
+    assert store.count_alerts_without_username() == 0
+
+def check_bulk_rescore(store):
+    channel_id = store.add_channel("gina", "https://t.me/rescore")
+    _add_results(store, channel_id, 10)
+
+    batches = list(store.iter_result_batches(batch_size=4))
+    assert [len(b) for b in batches] == [4, 4, 2]
+    ids = [r["_id"] for b in batches for r in b]
+    assert ids == sorted(ids)
+    assert [r["_id"] for b in store.iter_result_batches(after_id=ids[5]) for r in b] == ids[6:]
+
+    normal = [r for b in batches for r in b if r["prediction"] == "normal"][:2]
+    updated_at = datetime(2024, 3, 1)
+    assert store.bulk_update_results(
+        [(r["_id"], {"prediction": "drug sale", "updated_at": updated_at}) for r in normal]
+    ) == 2
+    assert store.count_results(channel_id, "drug sale") == 6
+    assert store.create_alerts([dict(r, prediction="drug sale") for r in normal]) == 2
+    assert store.count_alerts("gina") == 6
+
+    flagged = [r for b in batches for r in b if r["prediction"] == "drug sale"][:1]
+    assert store.delete_new_alerts(flagged) == 1
+    assert store.count_alerts("gina") == 5
+
+def check_changed_results(store):
+    channel_id = store.add_channel("iris", "https://t.me/delta")
+    _add_results(store, channel_id, 6)
+
+    everything = list(store.iter_changed_results(channel_id, batch_size=4))
+    assert len(everything) == 6
+    keys = [(r["updated_at"], r["_id"]) for r in everything]
+    assert keys == sorted(keys) and all(r["updated_at"] == r["processed_at"] for r in everything)
+
+    watermark = keys[-1]
+    assert list(store.iter_changed_results(channel_id, since=watermark)) == []
+    later = watermark[0] + timedelta(minutes=1)
+    store.bulk_update_results([(everything[3]["_id"], {"prediction": "spam", "updated_at": later}),
+                               (everything[1]["_id"], {"prediction": "spam", "updated_at": later})])
+    changed = list(store.iter_changed_results(channel_id, since=watermark, batch_size=1))
+    assert [r["_id"] for r in changed] == sorted([everything[1]["_id"], everything[3]["_id"]])
+    assert list(store.iter_changed_results(channel_id, since=watermark, until=later - timedelta(seconds=1))) == []
+    assert store.backfill_result_updated_at() == 0
+
+def check_term_index(store):
+    channel_id = store.add_channel("hank", "https://t.me/terms")
+    for i, text in enumerate(["fresh chitta in stock", "spot the difference", "party 🍁 tonight", "hello"]):
+        store.save_monitoring_result(channel_id, {"message_id": i, "message_text": text, "prediction": "normal"})
+
+    def candidates(terms, batch_size=1000):
+        return sorted(r["message_id"] for b in store.iter_term_candidate_batches(terms, batch_size=batch_size)
+                      for r in b)
+
+    assert candidates(["chitta"]) == [0]
+    assert candidates(["IFFEREN"]) == [1]
+    assert candidates(["🍁", "chitta"]) == [0, 2]
+    assert candidates(["🍁", "chitta", "differ"], batch_size=1) == [0, 1, 2]
+    assert candidates(["absent"]) == []
+    # Shorter than a winnowing window: looked up through the words containing it
+    assert candidates(["Pot"]) == [1]
+    assert candidates(["ell", "🍁"]) == [2, 3]
+    assert candidates(["tta", "diff"], batch_size=1) == [0, 1]
+    assert candidates(["zzz"]) == []
+    # Too short for a word, or not only letters: every result is a candidate
+    assert candidates(["ch"]) == [0, 1, 2, 3]
+    assert candidates(["n s"]) == [0, 1, 2, 3]
+    assert all("term_keys" not in r for r in store.get_all_monitoring_results(channel_id))
+    assert store.index_result_terms() == 0
+    assert store.estimated_result_count() >= 4
+
+def check_known_images(store):
+    def image(sha256, phash):
+        return {"sha256": sha256, "phash": phash, "dhash": "00000000000000ff"}
+
+    first = store.add_known_image(image("a" * 64, "0f0f0f0f0f0f0f0f"), "drug sale", 0.9, "analyze_image", "jack")
+    assert first and first["_id"] and first["created_at"]
+    assert store.add_known_image(image("a" * 64, "ffffffffffffffff"), "drug sale") is None
+    second = store.add_known_image(image("b" * 64, "0f0f0f0f0f0f0f0e"), "drug sale")
+
+    known = list(store.iter_known_images())
+    assert [doc["sha256"] for doc in known] == ["a" * 64, "b" * 64]
+    assert known[0]["phash"] == "0f0f0f0f0f0f0f0f" and known[0]["username"] == "jack"
+    since = first["created_at"] - timedelta(seconds=1)
+    assert [doc["_id"] for doc in store.iter_known_images(since=since)] == [first["_id"], second["_id"]]
+    assert list(store.iter_known_images(since=datetime.utcnow() + timedelta(seconds=1))) == []
+
+    from image_index import KnownImageIndex
+    index = KnownImageIndex(store, max_distance=4)
+    matches = index.lookup(image("c" * 64, "0f0f0f0f0f0f0f0d"))
+    assert [(m["sha256"], m["distance"]) for m in matches] == [("a" * 64, 1), ("b" * 64, 2)]
+    assert index.add(image("c" * 64, "f0f0f0f0f0f0f0f0"), "drug sale")
+    assert index.lookup(image("d" * 64, "f0f0f0f0f0f0f0f0"))[0]["sha256"] == "c" * 64
+    assert not index.add(image("c" * 64, "f0f0f0f0f0f0f0f0"), "drug sale") and len(index) == 3
+
+def check_search(store):
+    channel_id = store.add_channel("ivan", "https://t.me/search")
+    other_id = store.add_channel("ivan", "https://t.me/search2")
+    texts = ["Crystal meth available, dm", "crystal clear water", "meth and crystal candy", "selling Crystal Meth cheap"]
+    for i, text in enumerate(texts):
+        store.save_monitoring_result(channel_id if i < 3 else other_id, {
+            "message_id": i, "date": datetime(2024, 1, 1 + i), "message_text": text,
+            "prediction": "drug sale" if "meth" in text.lower() else "normal", "confidence": 0.9
+        })
+
+    def ids(query, channels=(channel_id, other_id), **filters):
+        results, _ = store.search_results(query, list(channels), **filters)
+        return sorted(r["message_id"] for r in results)
+
+    assert ids('"crystal meth"') == [0, 3]
+    assert ids("crystal meth") == [0, 2, 3]
+    assert ids("crystal", channels=[channel_id]) == [0, 1, 2]
+    assert ids("crystal", prediction="normal") == [1]
+    assert ids("crystal", date_from=datetime(2024, 1, 3)) == [2, 3]
+    assert ids("nothing") == [] and ids("") == [] and ids("crystal", channels=[]) == []
+
+    page, has_more = store.search_results("crystal", [channel_id, other_id], limit=3)
+    rest, last = store.search_results("crystal", [channel_id, other_id], offset=3, limit=3)
+    assert len(page) == 3 and has_more and len(rest) == 1 and not last
+    assert all("score" in r for r in page)
+
+def check_channel_stats(store):
+    channel_id = store.add_channel("judy", "https://t.me/stats")
+    other_id = store.add_channel("judy", "https://t.me/stats2")
+    _add_results(store, channel_id, 48)
+    store.save_monitoring_result(other_id, {
+        "message_id": 1, "date": datetime(2024, 1, 1, 5, 30), "message_text": "mdma",
+        "prediction": "drug sale", "confidence": 0.9,
+        "features": {"term_ids": [11], "category_mask": 1}
+    })
+
+    stats = store.get_channel_stats([channel_id, other_id])
+    assert stats[channel_id]["total"] == 48
+    assert stats[channel_id]["predictions"] == {"drug sale": 16, "normal": 32}
+    assert abs(stats[channel_id]["avg_confidence"] - (16 * 0.9 + 32 * 0.4) / 48) < 1e-9
+    assert stats[other_id]["categories"] == {"high_confidence": 1} and stats[other_id]["terms"] == {"11": 1}
+
+    day_two = store.get_channel_stats([channel_id], datetime(2024, 1, 2), datetime(2024, 1, 3))[channel_id]
+    assert day_two["total"] == 24
+
+    series = store.get_stats_series([channel_id, other_id], bucket="day")
+    assert [(p["period"], p["total"]) for p in series] == [(datetime(2024, 1, 1), 25), (datetime(2024, 1, 2), 24)]
+    assert len(store.get_stats_series([channel_id], bucket="hour")) == 48
+
+    result = store.get_monitoring_results(other_id, limit=1)[0]
+    store.update_stats([(result, -1), (dict(result, prediction="normal"), 1)])
+    assert store.get_channel_stats([other_id])[other_id]["predictions"] == {"drug sale": 0, "normal": 1}
+
+    # A store created empty starts with complete rollups; incomplete ones
+    # (results saved before rollups existed) are counted from the results
+    assert store.stats_complete()
+    store.set_stats_complete(False)
+    live = store.get_channel_stats([channel_id])[channel_id]
+    assert live["total"] == 48 and live["predictions"] == {"drug sale": 16, "normal": 32}
+    assert abs(live["avg_confidence"] - stats[channel_id]["avg_confidence"]) < 1e-9
+    assert store.get_channel_stats([channel_id], datetime(2024, 1, 2), datetime(2024, 1, 3))[channel_id]["total"] == 24
+    assert [(p["period"], p["total"]) for p in store.get_stats_series([channel_id], bucket="day")] == \
+        [(datetime(2024, 1, 1), 24), (datetime(2024, 1, 2), 24)]
+    store.set_stats_complete(True)
+
+    assert store.remove_channel(other_id, "judy")
+    assert store.get_channel_stats([other_id])[other_id]["total"] == 0
+    assert store.clear_channel_stats() > 0
+    assert store.get_channel_stats([channel_id])[channel_id]["total"] == 0
+
+def check_retention(store):
+    import tempfile
+    from retention import apply_retention, iter_channel_results
+
+    channel_id = store.add_channel("frank", "https://t.me/retention")
+    _add_results(store, channel_id, 12)
+    now = datetime.utcnow() + timedelta(days=400)
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        assert store.last_retention_run() is None
+        counts = apply_retention(store, now=now, archive_dir=archive_dir)
+        assert counts["compacted"] == 8 and counts["archived"] == 4
+        assert isinstance(store.last_retention_run(), datetime)
+        assert store.count_results(channel_id) == 8
+        assert store.count_results(channel_id, "drug sale") == 0
+        assert store.count_results(channel_id, compacted=True) == 8
+        assert store.count_results(channel_id, compacted=False) == 0
+        assert all("message_text" not in r and r["compacted"] for r in store.get_all_monitoring_results(channel_id))
+
+        merged = list(iter_channel_results(store, channel_id, archive_dir))
+        assert len(merged) == 12
+        archived = [r for r in merged if r["prediction"] == "drug sale"]
+        assert sorted(r["message_id"] for r in archived) == [0, 3, 6, 9]
+        assert all(r["message_text"] for r in archived)
+
+        # Streamed CSV export covers both tiers and totals them on the fly
+        from exports import ExportSummary, iter_csv
+        summary = ExportSummary()
+        lines = "".join(iter_csv(store, channel_id, summary, archive_dir)).splitlines()
+        assert summary.total == 12 and summary.predictions["drug sale"] == 4
+        assert lines[0].startswith("\ufeffMessage ID") and lines[15].startswith("Total Messages,12,")
+
+        from exports import iter_ndjson_gz, parse_export_fields
+        fields = parse_export_fields("prediction,message_id")
+        records = [json.loads(line) for line in
+                   gzip.decompress(b"".join(iter_ndjson_gz(store, channel_id, fields, archive_dir))).splitlines()]
+        assert len(records) == 12 and all(list(r) == ["message_id", "prediction"] for r in records)
+
+    assert store.purge_expired_results(now + timedelta(days=400)) == 8
+    assert store.count_results(channel_id) == 0
+
+def check_archive_after_crash(store):
+    import glob
+    import shutil
+    import tempfile
+    from retention import archive_results, iter_archived_results, remove_archived_results
+
+    channel_id = store.add_channel("grace", "https://t.me/crash")
+    _add_results(store, channel_id, 12)
+    before = datetime.utcnow() + timedelta(days=1)
+
+    def crash(result_ids):
+        raise RuntimeError("killed before delete")
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        # Archived, then killed before the rows were deleted
+        store.delete_results = crash
+        try:
+            archive_results(store, before, archive_dir)
+            assert False, "expected the crash"
+        except RuntimeError:
+            pass
+        finally:
+            del store.delete_results
+        assert store.count_results(channel_id, "drug sale") == 4
+
+        # The rerun deletes the rows without writing them a second time
+        assert archive_results(store, before, archive_dir) == 4
+        parts = glob.glob(f"{archive_dir}/monitoring_results/channel_id={channel_id}/*/*.jsonl.gz")
+        assert len(parts) == 1
+        assert sorted(r["message_id"] for r in iter_archived_results(channel_id, archive_dir)) == [0, 3, 6, 9]
+
+        # Partitions duplicated by older versions still read back once
+        shutil.copy(parts[0], parts[0].replace("part-", "part-0-"))
+        assert len(list(iter_archived_results(channel_id, archive_dir))) == 4
+
+        remove_archived_results(channel_id, archive_dir)
+        assert list(iter_archived_results(channel_id, archive_dir)) == []
+
+def test_users():
+    for store in _backends():
+        check_users(store)
+
+def test_channels():
+    for store in _backends():
+        check_channels(store)
+
+def test_results_pagination():
+    for store in _backends():
+        check_results_pagination(store)
+
+def test_alerts():
+    for store in _backends():
+        check_alerts(store)
+
+def test_bulk_rescore():
+    for store in _backends():
+        check_bulk_rescore(store)
+
+def test_changed_results():
+    for store in _backends():
+        check_changed_results(store)
+
+def test_term_index():
+    for store in _backends():
+        check_term_index(store)
+
+def test_known_images():
+    for store in _backends():
+        check_known_images(store)
+
+def test_search():
+    for store in _backends():
+        check_search(store)
+
+def test_channel_stats():
+    for store in _backends():
+        check_channel_stats(store)
+
+def test_retention():
+    for store in _backends():
+        check_retention(store)
+
+def test_archive_after_crash():
+    for store in _backends():
+        check_archive_after_crash(store)
+
+def test_backend_primitives_are_abstract():
+    """A backend missing a primitive fails when it is created, not on first use"""
+    from storage import StorageBackend
+    from database import Database
+    from sqlite_storage import SQLiteDatabase
+    assert not Database.__abstractmethods__ and not SQLiteDatabase.__abstractmethods__
+
+    class Incomplete(StorageBackend):
+        name = "incomplete"
+    try:
+        Incomplete()
+    except TypeError as e:
+        assert "search_results" in str(e)
+    else:
+        raise AssertionError("backend without primitives was instantiated")
+
+if __name__ == "__main__":
+    checks = [check_users, check_channels, check_results_pagination, check_alerts,
+              check_bulk_rescore, check_changed_results, check_term_index, check_known_images, check_search,
+              check_channel_stats, check_retention, check_archive_after_crash]
+    failures = 0
+    for store in _backends():
+        print(f"🗄️ Backend: {store.name}")
+        for check in checks:
+            try:
+                check(store)
+                print(f"  ✅ {check.__name__}")
+            except Exception as e:
+                failures += 1
+                print(f"  ❌ {check.__name__}: {e!r}")
+    print("✅ All contract checks passed" if not failures else f"❌ {failures} contract checks failed")
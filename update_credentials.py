@@ -1,5 +1,4 @@
 from database import db
-from datetime import datetime
 
 # Update Devesh's API credentials with the NEWEST ones (Desktop platform)
 new_api_id = 24748004
@@ -7,18 +6,9 @@ new_api_hash = "67a1e3c7ea60479f708baf3ad52dc0cf"
 
 print("🔄 Updating API credentials for user 'Devesh'...")
 
-result = db.users.update_one(
-    {"username": "Devesh"},
-    {
-        "$set": {
-            "api_id": new_api_id,
-            "api_hash": new_api_hash,
-            "credentials_updated_at": datetime.utcnow()
-        }
-    }
-)
+result = db.update_credentials("Devesh", new_api_id, new_api_hash)
 
-if result.modified_count > 0:
+if result > 0:
     print("✅ Credentials updated successfully!")
     
     # Verify the update